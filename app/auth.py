@@ -1,31 +1,28 @@
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from . import models, db
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, db, hashing
+from .hashing import pwd_context, verify_password, get_password_hash
 from .schemas import Token
 import os
+import time
 
 
 SECRET_KEY = os.getenv("SECRET_KEY", "devsecretkey")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days for dev
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/token")
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
-
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
     if expires_delta:
@@ -37,21 +34,114 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-def get_user(db: Session, username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
+async def get_user(db: AsyncSession, username: str):
+    result = await db.execute(
+        select(models.User).filter(models.User.username == username)
+    )
+    return result.scalars().first()
 
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = get_user(db, username)
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await get_user(db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await hashing.pool.verify(password, user.hashed_password):
         return False
     return user
 
 
+@dataclass(frozen=True)
+class UserSnapshot:
+    """Detached, read-only copy of the columns handlers need from a User."""
+
+    id: int
+    username: str
+    email: str | None
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user: models.User):
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            is_active=user.is_active,
+        )
+
+
+class UserCache:
+    """LRU of token -> UserSnapshot.
+
+    An entry lives for at most ``ttl`` seconds and never past the token's own
+    ``exp``, so a cache hit can skip both the JWT decode and the DB lookup.
+    """
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[float, UserSnapshot]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str):
+        entry = self.entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, user = entry
+        if expires_at <= time.monotonic():
+            del self.entries[token]
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(token)
+        self.hits += 1
+        return user
+
+    def put(self, token: str, user: UserSnapshot, exp: float):
+        lifetime = min(self.ttl, exp - time.time())
+        if lifetime <= 0 or self.maxsize <= 0:
+            return
+
+        self.entries[token] = (time.monotonic() + lifetime, user)
+        self.entries.move_to_end(token)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int):
+        stale = [t for t, (_, u) in self.entries.items() if u.id == user_id]
+        for token in stale:
+            del self.entries[token]
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+user_cache = UserCache()
+
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    user_cache.invalidate_user(target.id)
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
-    # global db
+    cached = user_cache.get(token)
+    if cached is not None:
+        return cached
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -60,13 +150,17 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
+        exp = payload.get("exp")
         if username is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    d_b = db.SessionLocal()
-    user = get_user(d_b, username=username)
-    d_b.close()
+    async with db.SessionLocal() as d_b:
+        user = await get_user(d_b, username=username)
     if user is None:
         raise credentials_exception
-    return user
+
+    snapshot = UserSnapshot.from_user(user)
+    if exp is not None:
+        user_cache.put(token, snapshot, exp)
+    return snapshot
@@ -0,0 +1,104 @@
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from . import db, models, uploads
+import glob
+import hashlib
+import os
+
+# Content-addressed file store: every distinct file is kept once under
+# UPLOAD_DIR/blobs/ab/cd/<sha256>, however many messages (uploads, forwards)
+# refer to it. ``Blob.ref_count`` tracks those messages.
+
+
+def blob_path(digest: str):
+    return os.path.join(uploads.UPLOAD_DIR, "blobs", digest[:2], digest[2:4], digest)
+
+
+def file_sha256(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def add_ref(session: AsyncSession, digest: str, size: int, count: int = 1):
+    """Count ``count`` more messages pointing at a blob, creating its row."""
+    bump = (
+        update(models.Blob)
+        .filter_by(sha256=digest)
+        .values(ref_count=models.Blob.ref_count + count)
+    )
+    if (await session.execute(bump)).rowcount:
+        return
+    try:
+        async with session.begin_nested():
+            session.add(models.Blob(sha256=digest, size=size, ref_count=count))
+    except IntegrityError:
+        # another upload of the same content created it first
+        await session.execute(bump)
+
+
+async def release_refs(session: AsyncSession, counts: dict):
+    """Drop references (``{digest: n}``) and the rows nobody points at.
+
+    Returns the digests whose rows were deleted; once the caller has
+    committed, ``collect`` removes their files.
+    """
+    for digest, count in counts.items():
+        await session.execute(
+            update(models.Blob)
+            .filter_by(sha256=digest)
+            .values(ref_count=models.Blob.ref_count - count)
+        )
+    result = await session.execute(
+        select(models.Blob.sha256).filter(
+            models.Blob.sha256.in_(list(counts)), models.Blob.ref_count <= 0
+        )
+    )
+    garbage = result.scalars().all()
+    if garbage:
+        await session.execute(
+            delete(models.Blob).filter(models.Blob.sha256.in_(garbage))
+        )
+    return garbage
+
+
+def _put(temp_path: str, digest: str):
+    path = blob_path(digest)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # identical content either way; replacing (rather than skipping when it
+    # exists) keeps the file in place if a collection raced with this upload
+    os.replace(temp_path, path)
+    return path
+
+
+async def put(temp_path: str, digest: str):
+    """Move a received file into the store, after its row is committed."""
+    return await run_in_threadpool(_put, temp_path, digest)
+
+
+async def collect(digests):
+    """Delete the files of blobs whose rows are gone."""
+    if not digests:
+        return
+    async with db.SessionLocal() as session:
+        result = await session.execute(
+            select(models.Blob.sha256).filter(models.Blob.sha256.in_(list(digests)))
+        )
+        revived = set(result.scalars().all())
+
+    def _unlink(paths):
+        for path in paths:
+            # the blob and anything derived from it, e.g. previews
+            for derived in [path, *glob.glob(glob.escape(path) + ".*")]:
+                try:
+                    os.remove(derived)
+                except FileNotFoundError:
+                    pass
+
+    await run_in_threadpool(
+        _unlink, [blob_path(d) for d in digests if d not in revived]
+    )
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+
+# "" or "memory" keeps everything in this process; "redis://host:6379/0"
+# shares events between every worker subscribed to the same channel.
+EVENT_BUS_URL = os.getenv("EVENT_BUS_URL", "")
+EVENT_BUS_CHANNEL = os.getenv("EVENT_BUS_CHANNEL", "chat-go:events")
+EVENT_BUS_RETRY = float(os.getenv("EVENT_BUS_RETRY", "1"))
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBus:
+    """In-process event bus: ``publish`` hands the event straight to the
+    subscribed handlers. Enough for a single worker, and the default.
+
+    Events are plain JSON-able dicts with a ``scope`` key; each handler picks
+    out the scopes it cares about. Handlers deliver to sockets held by this
+    process only, so with a shared backend every worker runs the same
+    handlers on every event.
+    """
+
+    def __init__(self):
+        self.handlers = []
+        self.node_id = uuid.uuid4().hex
+        self.published = 0
+        self.received = 0
+
+    def subscribe(self, handler):
+        self.handlers.append(handler)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def publish(self, event: dict):
+        self.published += 1
+        await self._dispatch(event)
+
+    async def _dispatch(self, event: dict):
+        self.received += 1
+        for handler in self.handlers:
+            try:
+                await handler(event)
+            except Exception:
+                logger.exception("event bus handler failed for %r", event)
+
+
+class RedisBus(LocalBus):
+    """Redis pub/sub backend: every worker publishes to and listens on one
+    channel, including the publisher itself, so local delivery happens in
+    the listener just like remote delivery.
+
+    Needs the optional ``redis`` package (``redis.asyncio``).
+    """
+
+    def __init__(self, url: str, channel: str = EVENT_BUS_CHANNEL):
+        super().__init__()
+        self.url = url
+        self.channel = channel
+        self.client = None
+        self.task = None
+        self.ready = None
+
+    async def start(self):
+        if self.task is not None:
+            return
+        from redis import asyncio as aioredis
+
+        self.client = aioredis.from_url(self.url)
+        self.ready = asyncio.Event()
+        self.task = asyncio.create_task(self._listen())
+        await self.ready.wait()
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def publish(self, event: dict):
+        if self.client is None:
+            await self.start()
+        self.published += 1
+        await self.client.publish(self.channel, json.dumps(event))
+
+    async def _listen(self):
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                self.ready.set()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        await self._dispatch(json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # events published while disconnected are lost; clients
+                # refetch history when they rejoin a room
+                logger.exception("event bus connection lost, resubscribing")
+                await asyncio.sleep(EVENT_BUS_RETRY)
+            finally:
+                await pubsub.aclose()
+
+
+def create_bus(url: str = EVENT_BUS_URL):
+    if not url or url == "memory":
+        return LocalBus()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBus(url)
+    raise ValueError(f"Unsupported EVENT_BUS_URL: {url}")
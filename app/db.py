@@ -1,14 +1,130 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
 import os
 
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./chat_app.db")
 
+# "production": WAL, tuned pragmas, one writer connection and a pool of
+# read-only ones. "default": a single engine with SQLite's stock settings.
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "production")
+SQLITE_READ_POOL = int(os.getenv("SQLITE_READ_POOL", "4"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", str(64 * 1024)))
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+# How long a write waits for the writer connection before failing
+SQLITE_WRITE_TIMEOUT = float(os.getenv("SQLITE_WRITE_TIMEOUT", "30"))
 
-# SQLAlchemy async engine and sessionmaker will be used later; for simplicity we use sync for now
-engine = create_engine(
-    "sqlite:///./chat_app.db", connect_args={"check_same_thread": False}
+
+def sqlite_pragmas(read_only: bool):
+    pragmas = [
+        f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA cache_size = -{SQLITE_CACHE_KB}",
+        f"PRAGMA mmap_size = {SQLITE_MMAP_BYTES}",
+        "PRAGMA temp_store = MEMORY",
+    ]
+    if read_only:
+        return pragmas + ["PRAGMA query_only = 1"]
+    # WAL lets the readers go on while the writer commits; with WAL,
+    # NORMAL only syncs at checkpoints and stays corruption-safe
+    return ["PRAGMA journal_mode = WAL", "PRAGMA synchronous = NORMAL"] + pragmas
+
+
+def _apply_pragmas(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return on_connect
+
+
+def create_engines(url: str, profile: str = None):
+    """Return ``(write_engine, read_engine)`` for ``url``.
+
+    They are the same engine except for a SQLite file under the production
+    profile. There all writes queue for one connection, so transactions in
+    this process never fight over SQLite's single write lock ("database is
+    locked"), while reads run concurrently on read-only connections.
+    """
+    profile = profile or SQLITE_PROFILE
+    in_memory = ":memory:" in url or url.rstrip("/").endswith(":")
+    if not url.startswith("sqlite") or in_memory or profile != "production":
+        engine = create_async_engine(url)
+        return engine, engine
+
+    writer = create_async_engine(
+        url,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=SQLITE_WRITE_TIMEOUT,
+    )
+    reader = create_async_engine(
+        url,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=SQLITE_READ_POOL,
+        max_overflow=0,
+    )
+    event.listen(writer.sync_engine, "connect", _apply_pragmas(sqlite_pragmas(False)))
+    event.listen(reader.sync_engine, "connect", _apply_pragmas(sqlite_pragmas(True)))
+    return writer, reader
+
+
+WRITE_VERBS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+class RoutingSession(Session):
+    """Sends reads to ``read_engine`` and everything else to ``engine``.
+
+    Once a transaction has written, the rest of it stays on the writer so it
+    reads its own uncommitted changes.
+    """
+
+    writing = False
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if read_engine is engine:
+            return engine.sync_engine
+        if not self.writing:
+            is_text_write = isinstance(clause, TextClause) and (
+                clause.text.lstrip().upper().startswith(WRITE_VERBS)
+            )
+            if self._flushing or isinstance(clause, UpdateBase) or is_text_write:
+                self.writing = True
+        return (engine if self.writing else read_engine).sync_engine
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _transaction_ended(session, transaction):
+    if transaction.parent is None:
+        session.writing = False
+
+
+engine, read_engine = create_engines(DATABASE_URL)
+# expire_on_commit=False keeps ORM objects readable after commit; lazy
+# refreshes would otherwise need an awaitable round-trip per attribute.
+SessionLocal = sessionmaker(
+    class_=AsyncSession,
+    sync_session_class=RoutingSession,
+    autoflush=False,
+    expire_on_commit=False,
 )
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+
+
+def configure(url: str, profile: str = None):
+    """Point the app at another database; returns the new engines."""
+    global engine, read_engine
+    engine, read_engine = create_engines(url, profile)
+    return engine, read_engine
+
+
+async def get_session():
+    async with SessionLocal() as session:
+        yield session
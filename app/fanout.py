@@ -0,0 +1,182 @@
+from collections import deque
+from fastapi import WebSocket
+import asyncio
+import contextvars
+import os
+
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+WS_OUTBOX_SIZE = int(os.getenv("WS_OUTBOX_SIZE", "256"))
+# Applied in order when a socket's queue is full; if there is still no room
+# afterwards the socket is disconnected.
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop_typing,coalesce_presence")
+
+OVERFLOW_STEPS = ("drop_typing", "coalesce_presence")
+
+counters = {
+    "frames": 0,
+    "typing_dropped": 0,
+    "presence_coalesced": 0,
+    "overflow_disconnects": 0,
+    "send_failures": 0,
+}
+
+_outboxes = {}  # websocket -> Outbox
+_closing = set()  # close tasks, referenced until done so they aren't collected
+
+
+async def _send(websocket: WebSocket, text: str, timeout: float):
+    try:
+        await asyncio.wait_for(websocket.send_text(text), timeout)
+        return True
+    except Exception:
+        # closed, reset or too slow: the caller evicts it either way
+        return False
+
+
+async def _close_quietly(websocket: WebSocket):
+    try:
+        await asyncio.wait_for(websocket.close(code=1013), WS_SEND_TIMEOUT)
+    except Exception:
+        pass
+
+
+def parse_policy(policy: str):
+    steps = [step.strip() for step in policy.split(",") if step.strip()]
+    for step in steps:
+        if step not in OVERFLOW_STEPS:
+            raise ValueError(f"Unknown overflow policy step: {step}")
+    return steps
+
+
+class Outbox:
+    """Bounded queue of encoded frames for one socket.
+
+    Frames are sent in order by the socket's own writer task, so whoever
+    queues a frame never waits on the client. ``kind`` and ``key`` tag a
+    frame for the overflow policy: ``"typing"`` frames may be dropped, and
+    ``"presence"`` frames with the same key (the user id) collapse to the
+    newest one.
+    """
+
+    def __init__(self, websocket: WebSocket, maxsize: int = None, policy=None):
+        self.websocket = websocket
+        self.maxsize = maxsize or WS_OUTBOX_SIZE
+        self.policy = parse_policy(WS_OVERFLOW_POLICY) if policy is None else policy
+        self.frames = deque()  # (text, kind, key)
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.closed = False
+
+    def put(self, text: str, kind: str = None, key=None):
+        """Queue a frame; returns False if the socket is closed or overflowed."""
+        if self.closed:
+            return False
+
+        if len(self.frames) >= self.maxsize:
+            self._make_room(kind, key)
+        if len(self.frames) >= self.maxsize:
+            if kind == "typing" and "drop_typing" in self.policy:
+                counters["typing_dropped"] += 1
+                return True
+            counters["overflow_disconnects"] += 1
+            self.close()
+            return False
+
+        self.frames.append((text, kind, key))
+        counters["frames"] += 1
+        self.wakeup.set()
+        if self.task is None:
+            # lives as long as the socket: don't inherit the context (and
+            # SQL profile) of whichever action first queued a frame
+            self.task = asyncio.create_task(
+                self._drain(), context=contextvars.Context()
+            )
+        return True
+
+    def _make_room(self, kind, key):
+        for step in self.policy:
+            if step == "drop_typing":
+                kept = deque(frame for frame in self.frames if frame[1] != "typing")
+                counters["typing_dropped"] += len(self.frames) - len(kept)
+            else:
+                # newest presence per user wins, counting the incoming frame
+                seen = {key} if kind == "presence" else set()
+                kept = deque()
+                for frame in reversed(self.frames):
+                    if frame[1] == "presence":
+                        if frame[2] in seen:
+                            continue
+                        seen.add(frame[2])
+                    kept.appendleft(frame)
+                counters["presence_coalesced"] += len(self.frames) - len(kept)
+            self.frames = kept
+            if len(self.frames) < self.maxsize:
+                return
+
+    async def _drain(self):
+        while not self.closed:
+            if not self.frames:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            text, _, _ = self.frames.popleft()
+            if not await _send(self.websocket, text, WS_SEND_TIMEOUT):
+                counters["send_failures"] += 1
+                self.close()
+
+    def _stop(self):
+        self.closed = True
+        self.frames.clear()
+        self.wakeup.set()
+
+    def close(self):
+        """Stop writing and close the socket so the client reconnects.
+
+        The outbox stays registered, closed, until the connection handler
+        calls ``release``, so later frames are refused rather than retried.
+        """
+        if not self.closed:
+            self._stop()
+            task = asyncio.create_task(_close_quietly(self.websocket))
+            _closing.add(task)
+            task.add_done_callback(_closing.discard)
+
+    def release(self):
+        """Stop writing and forget the socket; its handler is done with it."""
+        self._stop()
+        if _outboxes.get(self.websocket) is self:
+            del _outboxes[self.websocket]
+
+
+def outbox(websocket: WebSocket):
+    box = _outboxes.get(websocket)
+    if box is None:
+        box = _outboxes[websocket] = Outbox(websocket)
+    return box
+
+
+def release(websocket: WebSocket):
+    box = _outboxes.get(websocket)
+    if box is not None:
+        box.release()
+
+
+def fan_out(sockets, text: str, kind: str = None, key=None):
+    """Queue an already-encoded frame on every socket's outbox.
+
+    Never waits on a client. Returns the sockets that could not take the
+    frame, because an earlier send failed or their queue overflowed; they
+    are being closed so the client reconnects cleanly.
+    """
+    return [ws for ws in list(sockets) if not outbox(ws).put(text, kind, key)]
+
+
+def outbox_stats():
+    depths = [len(box.frames) for box in _outboxes.values() if not box.closed]
+    return {
+        "connections": len(depths),
+        "queued": sum(depths),
+        "max_depth": max(depths, default=0),
+        "capacity": WS_OUTBOX_SIZE,
+        **counters,
+    }
@@ -0,0 +1,180 @@
+from fastapi import HTTPException, Request
+from mimetypes import guess_type
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import FileResponse, Response
+from urllib.parse import quote
+import anyio
+import os
+import uuid
+
+# A message's file never changes, so its URL can be cached for good. It sits
+# behind auth, hence private.
+FILE_CACHE_CONTROL = os.getenv(
+    "FILE_CACHE_CONTROL", "private, max-age=31536000, immutable"
+)
+# More ranges than this in one request and the whole file is sent instead.
+MAX_RANGES = int(os.getenv("FILE_MAX_RANGES", "16"))
+CHUNK_SIZE = 64 * 1024
+
+
+def etag_matches(header: str, etag: str):
+    """Weak comparison, as If-None-Match requires."""
+    if header.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in header.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+def parse_range(header: str, size: int):
+    """Return ``[(start, end_inclusive), ...]`` for a ``bytes=`` Range header.
+
+    ``None`` means serve the whole file (malformed, not bytes, or too many
+    ranges, all of which a server may ignore); an empty list means none of
+    the ranges overlap the file.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec:
+        return None
+    parts = spec.split(",")
+    if len(parts) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for part in parts:
+        first, sep, last = part.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and start > end:
+                    return None
+            else:
+                suffix = int(last)
+                start, end = max(size - suffix, 0), size - 1
+                if suffix == 0:
+                    continue
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))
+    return ranges
+
+
+def content_disposition(filename: str):
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+class RangeResponse(Response):
+    """206 response carrying one range, or several as multipart/byteranges."""
+
+    def __init__(self, path: str, size: int, ranges, media_type: str, headers):
+        super().__init__(status_code=206, headers=headers)
+        self.path = path
+        self.parts = []
+        self.tail = b""
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            self.headers["content-type"] = media_type
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+            self.parts.append((b"", start, end))
+            length = end - start + 1
+        else:
+            boundary = uuid.uuid4().hex
+            self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+            length = 0
+            for start, end in ranges:
+                head = (
+                    f"--{boundary}\r\nContent-Type: {media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                ).encode()
+                if self.parts:
+                    head = b"\r\n" + head
+                self.parts.append((head, start, end))
+                length += len(head) + end - start + 1
+            self.tail = f"\r\n--{boundary}--\r\n".encode()
+            length += len(self.tail)
+        self.headers["content-length"] = str(length)
+
+    async def __call__(self, scope, receive, send):
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            for head, start, end in self.parts:
+                if head:
+                    await send(
+                        {"type": "http.response.body", "body": head, "more_body": True}
+                    )
+                await file.seek(start)
+                remaining = end - start + 1
+                while remaining:
+                    chunk = await file.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+        await send(
+            {"type": "http.response.body", "body": self.tail, "more_body": False}
+        )
+
+
+async def file_response(
+    request: Request,
+    path: str,
+    etag: str,
+    filename: str = None,
+    media_type: str = None,
+    cache_control: str = FILE_CACHE_CONTROL,
+):
+    """Serve a stored file with validators, caching headers and Range support.
+
+    ``etag`` must identify the bytes (for blobs, their SHA-256), which is what
+    lets the response be marked immutable.
+    """
+    try:
+        stat = await run_in_threadpool(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(404, "File not found")
+
+    etag = f'"{etag}"'
+    headers = {"etag": etag, "cache-control": cache_control, "accept-ranges": "bytes"}
+    media_type = (
+        media_type or guess_type(filename or path)[0] or "application/octet-stream"
+    )
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        ranges = parse_range(range_header, stat.st_size)
+        if ranges == []:
+            return Response(
+                status_code=416,
+                headers={**headers, "content-range": f"bytes */{stat.st_size}"},
+            )
+        if ranges:
+            if filename:
+                headers["content-disposition"] = content_disposition(filename)
+            return RangeResponse(path, stat.st_size, ranges, media_type, headers)
+
+    return FileResponse(
+        path,
+        headers=headers,
+        media_type=media_type,
+        filename=filename,
+        stat_result=stat,
+    )
@@ -0,0 +1,67 @@
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from .processes import ProcessPool
+import os
+
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count())))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def verify_password(plain_password, hashed_password):
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def get_password_hash(password):
+    return pwd_context.hash(password)
+
+
+class HashingPool:
+    """Runs bcrypt in a dedicated process pool.
+
+    bcrypt holds a CPU for hundreds of milliseconds, so a login storm in the
+    default threadpool starves every other sync route and fights the event
+    loop for the GIL. Work beyond ``max_pending`` in-flight calls is refused
+    with a 503 instead of queueing without bound. ``workers=0`` falls back to
+    the threadpool, which is handy for tests and tiny deployments.
+    """
+
+    def __init__(
+        self,
+        workers: int = PASSWORD_HASH_WORKERS,
+        max_pending: int = PASSWORD_HASH_MAX_PENDING,
+    ):
+        self.processes = ProcessPool(workers)
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication is busy, retry shortly",
+                headers={"Retry-After": "1"},
+            )
+
+        self.pending += 1
+        try:
+            return await self.processes.run(fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password):
+        return await self.run(get_password_hash, password)
+
+    async def verify(self, plain_password, hashed_password):
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    def shutdown(self):
+        self.processes.shutdown()
+
+
+pool = HashingPool()
@@ -0,0 +1,158 @@
+from collections import deque
+from datetime import datetime
+from weakref import WeakKeyDictionary
+from . import metrics
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "100")) / 1000
+# Blocked for longer than this and the stack of whatever holds the loop is
+# captured.
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD_MS", "200")) / 1000
+LOOP_MONITOR_SAMPLES = int(os.getenv("LOOP_MONITOR_SAMPLES", "3000"))
+
+logger = logging.getLogger(__name__)
+
+loop_lag = metrics.Histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a timer it was due to."
+)
+
+_labels = WeakKeyDictionary()  # task -> route or WS action it is serving
+
+
+def label_task(text: str):
+    """Name what the current task is doing, for stall reports."""
+    task = asyncio.current_task()
+    if task is not None:
+        _labels[task] = text
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return 0.0
+    return ordered[max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))]
+
+
+class LoopMonitor:
+    """Measures event-loop lag and catches what blocks the loop.
+
+    A task on the loop sleeps ``interval`` at a time and records how late it
+    wakes up. A watchdog thread checks on that task; once it is overdue by
+    ``threshold`` the loop is stuck in synchronous code, so the thread takes
+    the loop thread's current stack (the blocking code itself) and the
+    label of the task running at that moment. The stall's duration is
+    filled in when the loop gets going again.
+    """
+
+    def __init__(
+        self,
+        interval: float = LOOP_MONITOR_INTERVAL,
+        threshold: float = LOOP_STALL_THRESHOLD,
+        samples: int = LOOP_MONITOR_SAMPLES,
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.samples = deque(maxlen=samples)
+        self.stalls = deque(maxlen=50)
+        self.stall_count = 0
+        self.loop = None
+        self.loop_thread = None
+        self.beat = None
+        self.pending = None
+        self.stopped = threading.Event()
+        self.watchdog = None
+
+    @property
+    def running(self):
+        return self.watchdog is not None and not self.stopped.is_set()
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.stopped.clear()
+        self.watchdog = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self.watchdog.start()
+        try:
+            while True:
+                beat = self.beat = time.perf_counter()
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, time.perf_counter() - beat - self.interval)
+                self.samples.append(lag)
+                loop_lag.observe(lag)
+                stall = self.pending
+                if stall is not None and stall["beat"] == beat:
+                    self.pending = None
+                    stall["duration_ms"] = round(lag * 1000, 1)
+                    logger.warning(
+                        "event loop blocked for %.0f ms in %s\n%s",
+                        lag * 1000,
+                        stall["label"] or stall["task"],
+                        "".join(stall["stack"]),
+                    )
+        finally:
+            self.stopped.set()
+
+    def _watch(self):
+        while not self.stopped.wait(self.threshold / 4):
+            beat = self.beat
+            if beat is None or (self.pending and self.pending["beat"] == beat):
+                continue
+            if time.perf_counter() - beat - self.interval > self.threshold:
+                self.pending = self._capture(beat)
+
+    def _capture(self, beat):
+        frame = sys._current_frames().get(self.loop_thread)
+        task = asyncio.current_task(self.loop)
+        stall = {
+            "beat": beat,
+            "at": datetime.utcnow().isoformat(),
+            "duration_ms": None,  # still blocked
+            "label": _labels.get(task) if task is not None else None,
+            "task": task.get_name() if task is not None else None,
+            "stack": traceback.format_stack(frame) if frame is not None else [],
+        }
+        self.stall_count += 1
+        self.stalls.append(stall)
+        return stall
+
+    def stats(self):
+        ordered = sorted(self.samples)
+        lag = {
+            f"p{pct}": round(_percentile(ordered, pct) * 1000, 2)
+            for pct in (50, 95, 99)
+        }
+        lag["max"] = round(ordered[-1] * 1000, 2) if ordered else 0.0
+        return {
+            "running": self.running,
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "samples": len(ordered),
+            "lag_ms": lag,
+            "stall_count": self.stall_count,
+            "stalls": [
+                {key: value for key, value in stall.items() if key != "beat"}
+                for stall in reversed(self.stalls)
+            ],
+        }
+
+
+class TaskLabelMiddleware:
+    """Labels each HTTP request's task with its method and path."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            label_task(f"{scope['method']} {scope['path']}")
+        await self.app(scope, receive, send)
+
+
+loop_monitor = LoopMonitor()
@@ -0,0 +1,164 @@
+from collections import OrderedDict
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import db, models
+import os
+
+MEMBERSHIP_CACHE_THREADS = int(os.getenv("MEMBERSHIP_CACHE_THREADS", "10000"))
+MEMBERSHIP_CACHE_USERS = int(os.getenv("MEMBERSHIP_CACHE_USERS", "10000"))
+
+
+class MembershipIndex:
+    """Process-wide view of who is in which thread, and who administers it.
+
+    Both directions are kept: thread -> members for access checks and
+    fan-out, user -> threads for the chat list and search scoping. Entries
+    are loaded lazily on first lookup and then kept in step by the routes
+    that change membership (create, add, leave, remove, promote, demote,
+    dissolve), which call the mutators below after their commit. Hot-path
+    checks are then dictionary lookups. Each direction is an LRU capped at
+    ``max_threads`` / ``max_users`` entries, and dissolved threads are
+    dropped from both.
+
+    With several workers each keeps its own index. The routes also publish a
+    ``membership`` event on the bus, and the other workers forget the thread
+    and user it names so their next lookup reloads them.
+    """
+
+    def __init__(
+        self,
+        max_threads: int = MEMBERSHIP_CACHE_THREADS,
+        max_users: int = MEMBERSHIP_CACHE_USERS,
+    ):
+        self.max_threads = max_threads
+        self.max_users = max_users
+        self.threads: OrderedDict[int, dict[int, bool]] = OrderedDict()
+        self.users: OrderedDict[int, set[int]] = OrderedDict()
+        # bumped by every mutation, so a load racing a write is not cached
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _store(cache: OrderedDict, key: int, value, maxsize: int):
+        if maxsize <= 0:
+            return
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > maxsize:
+            cache.popitem(last=False)
+
+    async def _load_thread(self, session: AsyncSession, thread_id: int):
+        version = self.version
+        result = await session.execute(
+            select(models.ThreadMember.user_id, models.ThreadMember.is_admin).filter(
+                models.ThreadMember.thread_id == thread_id
+            )
+        )
+        members = {user_id: bool(is_admin) for user_id, is_admin in result}
+        if self.version == version:
+            self._store(self.threads, thread_id, members, self.max_threads)
+        return members
+
+    async def _load_user(self, session: AsyncSession, user_id: int):
+        version = self.version
+        result = await session.execute(
+            select(models.ThreadMember.thread_id).filter(
+                models.ThreadMember.user_id == user_id
+            )
+        )
+        thread_ids = set(result.scalars().all())
+        if self.version == version:
+            self._store(self.users, user_id, thread_ids, self.max_users)
+        return thread_ids
+
+    async def _lookup(self, cache: OrderedDict, key: int, load, session):
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        if session is not None:
+            return await load(session, key)
+        async with db.SessionLocal() as session:
+            return await load(session, key)
+
+    async def members(self, thread_id: int, session: AsyncSession | None = None):
+        """Return ``{user_id: is_admin}`` for the thread."""
+        return await self._lookup(self.threads, thread_id, self._load_thread, session)
+
+    async def thread_ids(self, user_id: int, session: AsyncSession | None = None):
+        """Return the ids of the threads the user belongs to."""
+        return await self._lookup(self.users, user_id, self._load_user, session)
+
+    async def is_member(self, thread_id: int, user_id: int, session=None):
+        return user_id in await self.members(thread_id, session)
+
+    async def is_admin(self, thread_id: int, user_id: int, session=None):
+        return (await self.members(thread_id, session)).get(user_id, False)
+
+    def add_thread(self, thread_id: int, user_id: int, is_admin: bool = False):
+        """Record a freshly created thread whose only member is its creator."""
+        self.version += 1
+        self._store(
+            self.threads, thread_id, {user_id: bool(is_admin)}, self.max_threads
+        )
+        if user_id in self.users:
+            self.users[user_id].add(thread_id)
+
+    def add_member(self, thread_id: int, user_id: int, is_admin: bool = False):
+        self.version += 1
+        if thread_id in self.threads:
+            self.threads[thread_id][user_id] = bool(is_admin)
+        if user_id in self.users:
+            self.users[user_id].add(thread_id)
+
+    def set_admin(self, thread_id: int, user_id: int, is_admin: bool):
+        self.version += 1
+        members = self.threads.get(thread_id)
+        if members is not None and user_id in members:
+            members[user_id] = bool(is_admin)
+
+    def remove_member(self, thread_id: int, user_id: int):
+        self.version += 1
+        if thread_id in self.threads:
+            self.threads[thread_id].pop(user_id, None)
+        if user_id in self.users:
+            self.users[user_id].discard(thread_id)
+
+    def drop_thread(self, thread_id: int):
+        """Remove a dissolved thread from both directions."""
+        self.version += 1
+        self.threads.pop(thread_id, None)
+        for thread_ids in self.users.values():
+            thread_ids.discard(thread_id)
+
+    def forget_thread(self, thread_id: int):
+        """Drop a thread's cached members so the next lookup reloads them."""
+        self.version += 1
+        self.threads.pop(thread_id, None)
+
+    def forget_user(self, user_id: int):
+        """Drop a user's cached threads so the next lookup reloads them."""
+        self.version += 1
+        self.users.pop(user_id, None)
+
+    def clear(self):
+        self.threads.clear()
+        self.users.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "threads": len(self.threads),
+            "users": len(self.users),
+            "memberships": sum(len(m) for m in self.threads.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+membership = MembershipIndex()
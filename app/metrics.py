@@ -0,0 +1,255 @@
+from bisect import bisect_left
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import time
+
+# A minimal Prometheus client: counters, gauges and histograms with labels,
+# rendered in the text exposition format by ``render()``. Recording is a dict
+# lookup and an addition; all formatting happens at scrape time, and gauges
+# that mirror existing state (rooms, outboxes) are computed only then.
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base for the metric types; ``collect`` makes it a view of live state.
+
+    ``collect`` is called when scraped and returns ``{(label values...):
+    value}`` (``{(): value}`` when unlabelled), for counters and gauges that
+    other code already keeps.
+    """
+
+    type = None
+
+    def __init__(self, name: str, help: str, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self.collect = collect
+        self.children = {}
+        _registry.append(self)
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self.children.get(key)
+        if child is None:
+            child = self.children[key] = self._new_child()
+        return child
+
+    def samples(self):
+        if self.collect is not None:
+            for key, value in self.collect().items():
+                yield self.name, _labels(self.labelnames, key), value
+            return
+        for key, child in list(self.children.items()):
+            for suffix, extra, value in child.samples():
+                yield self.name + suffix, _labels(self.labelnames, key, extra), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {_number(value)}")
+        return "\n".join(lines)
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        yield "", None, self.value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class _Buckets:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += count
+            yield "_bucket", ("le", _number(float(bound))), cumulative
+        yield "_sum", None, self.sum
+        yield "_count", None, cumulative
+
+
+class _Timer:
+    def __init__(self, target):
+        self.target = target
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.target.observe(time.perf_counter() - self.start)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+def render():
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+http_requests = Histogram(
+    "http_request_duration_seconds",
+    "REST request latency by route template.",
+    ["method", "route", "status"],
+)
+ws_actions = Histogram(
+    "ws_action_duration_seconds",
+    "Time to handle one /ws/chat action.",
+    ["action"],
+)
+fanout_seconds = Histogram(
+    "ws_fanout_duration_seconds",
+    "Time to queue one broadcast on this worker's sockets.",
+    ["scope"],
+)
+fanout_recipients = Counter(
+    "ws_fanout_recipients_total",
+    "Sockets a broadcast was queued on.",
+    ["scope"],
+)
+db_queries = Histogram(
+    "db_query_duration_seconds",
+    "SQL statement execution time.",
+    ["statement"],
+)
+upload_bytes = Counter("upload_bytes_total", "File bytes received from clients.")
+
+
+# Installed once on the Engine class, so it covers every engine the app
+# creates (tests and benchmarks swap db.engine). The statement label is the
+# leading keyword only.
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    kind = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+    db_queries.labels(kind).observe(elapsed)
+
+
+@event.listens_for(Engine, "handle_error")
+def _query_failed(context):
+    started = context.connection is not None and context.connection.info.get(
+        "query_started"
+    )
+    if started:
+        started.pop()
+
+
+class MetricsMiddleware:
+    """Times every HTTP request, labelled by route template, not raw path."""
+
+    def __init__(self, app):
+        self.app = app
+        self.routes = None
+
+    def route(self, scope):
+        if self.routes is None:
+            # a Mount's "endpoint" is the mounted app
+            self.routes = {
+                getattr(r, "endpoint", getattr(r, "app", None)): r.path
+                for r in scope["app"].routes
+            }
+        return self.routes.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests.labels(scope["method"], self.route(scope), status[0]).observe(
+                time.perf_counter() - start
+            )
@@ -0,0 +1,83 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+from .db import Base
+from . import search
+
+# ``create_all`` only creates missing tables, it never touches tables that
+# already exist. Anything added to an existing model (indexes, columns, data
+# rewrites) needs an idempotent step here so older databases catch up on
+# startup.
+
+
+def add_missing_columns(conn: Connection):
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(
+                text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+            )
+
+
+def ensure_indexes(conn: Connection):
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+
+# A member's read watermark lands just before their oldest unread receipt, or
+# on the thread's newest message when nothing is unread, so unread counts right
+# after the migration match what the receipts reported.
+COLLAPSE_READ_RECEIPTS = """
+UPDATE thread_members SET last_read_message_id = COALESCE(
+    (SELECT MIN(r.message_id) - 1 FROM message_receipts r
+     JOIN messages m ON m.id = r.message_id
+     WHERE m.thread_id = thread_members.thread_id
+       AND r.user_id = thread_members.user_id
+       AND r.read_at IS NULL),
+    (SELECT MAX(m.id) FROM messages m
+     WHERE m.thread_id = thread_members.thread_id)
+)
+WHERE last_read_message_id IS NULL
+"""
+
+COLLAPSE_DELIVERY_RECEIPTS = """
+UPDATE thread_members SET last_delivered_message_id = COALESCE(
+    (SELECT MAX(r.message_id) FROM message_receipts r
+     JOIN messages m ON m.id = r.message_id
+     WHERE m.thread_id = thread_members.thread_id
+       AND r.user_id = thread_members.user_id
+       AND r.delivered_at IS NOT NULL),
+    last_read_message_id
+)
+WHERE last_delivered_message_id IS NULL
+"""
+
+# Anything read was necessarily delivered.
+RAISE_DELIVERY_TO_READ = """
+UPDATE thread_members SET last_delivered_message_id = last_read_message_id
+WHERE last_delivered_message_id < last_read_message_id
+"""
+
+
+def collapse_message_receipts(conn: Connection):
+    """Fold per-message receipt rows into ThreadMember watermarks."""
+    if not inspect(conn).has_table("message_receipts"):
+        return
+
+    conn.execute(text(COLLAPSE_READ_RECEIPTS))
+    conn.execute(text(COLLAPSE_DELIVERY_RECEIPTS))
+    conn.execute(text(RAISE_DELIVERY_TO_READ))
+    conn.execute(text("DROP TABLE message_receipts"))
+
+
+def run_migrations(conn: Connection):
+    add_missing_columns(conn)
+    ensure_indexes(conn)
+    collapse_message_receipts(conn)
+    search.create_index(conn)
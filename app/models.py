@@ -1,4 +1,13 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    Boolean,
+    DateTime,
+    ForeignKey,
+    Text,
+    Index,
+)
 from sqlalchemy.orm import relationship
 from .db import Base
 from datetime import datetime
@@ -37,9 +46,28 @@ class ThreadMember(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     is_admin = Column(Boolean, default=False)
 
+    # Read/delivery state is a per-member high-water mark over message ids
+    # rather than one receipt row per recipient per message.
+    last_read_message_id = Column(Integer, nullable=True)
+    last_delivered_message_id = Column(Integer, nullable=True)
+
     thread = relationship("ChatThread", back_populates="members")
     user = relationship("User")
 
+    __table_args__ = (
+        Index("ix_thread_members_thread_id_user_id", "thread_id", "user_id"),
+    )
+
+
+class Blob(Base):
+    # One stored file per distinct content; ref_count is the number of
+    # messages pointing at it, and the file is deleted when it drops to zero.
+    __tablename__ = "blobs"
+    sha256 = Column(String, primary_key=True)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 
 class Message(Base):
     __tablename__ = "messages"
@@ -54,19 +82,32 @@ class Message(Base):
     file_path = Column(String, nullable=True)
     file_size = Column(Integer, nullable=True)
     file_name = Column(String, nullable=True)
+    # SHA-256 of the content in the blob store; NULL for files stored before
+    # it existed, which are still served from file_path
+    file_hash = Column(String, ForeignKey("blobs.sha256"), nullable=True, index=True)
 
     thread = relationship("ChatThread", back_populates="messages")
     sender = relationship("User")
 
+    __table_args__ = (Index("ix_messages_thread_id_id", "thread_id", "id"),)
 
-class MessageReceipt(Base):
-    __tablename__ = "message_receipts"
 
-    id = Column(Integer, primary_key=True)
-    message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"))
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+class PresenceSession(Base):
+    # One row per open /ws/chat socket on any worker; a user is online while
+    # at least one of their rows has not expired.
+    __tablename__ = "presence_sessions"
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True, nullable=False)
+    expires_at = Column(DateTime, index=True, nullable=False)
 
-    delivered_at = Column(DateTime, nullable=True)
-    read_at = Column(DateTime, nullable=True)
 
-    message = relationship("Message", backref="receipts")
+class Upload(Base):
+    # A resumable upload in progress; its bytes so far are in
+    # uploads/partial/<id> until the client completes it.
+    __tablename__ = "uploads"
+    id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    thread_id = Column(Integer, ForeignKey("threads.id"), nullable=False)
+    file_name = Column(String, nullable=False)
+    file_size = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
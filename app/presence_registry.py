@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import db, models
+import os
+import uuid
+
+PRESENCE_HEARTBEAT = float(os.getenv("PRESENCE_HEARTBEAT", "15"))
+PRESENCE_TTL = float(os.getenv("PRESENCE_TTL", "45"))
+
+
+class PresenceRegistry:
+    """Who is online, shared by every worker through the database.
+
+    Each socket registers a row that expires ``ttl`` seconds later unless
+    its worker refreshes it on the heartbeat. Sockets closed cleanly remove
+    their row; sockets on a worker that crashed or hung simply stop being
+    refreshed and drop out once expired, which ``expire`` reports so the
+    offline event still goes out.
+    """
+
+    def __init__(self, ttl: float = PRESENCE_TTL):
+        self.ttl = ttl
+        self.local = set()  # connection ids held by this worker
+
+    def _deadline(self):
+        return datetime.utcnow() + timedelta(seconds=self.ttl)
+
+    @staticmethod
+    async def _is_online(session: AsyncSession, user_id: int):
+        live = await session.scalar(
+            select(models.PresenceSession.id)
+            .filter(
+                models.PresenceSession.user_id == user_id,
+                models.PresenceSession.expires_at > datetime.utcnow(),
+            )
+            .limit(1)
+        )
+        return live is not None
+
+    def online_user_ids(self):
+        """Select of the ids of users with a live connection on any worker."""
+        return (
+            select(models.PresenceSession.user_id)
+            .filter(models.PresenceSession.expires_at > datetime.utcnow())
+            .distinct()
+        )
+
+    async def connect(self, user_id: int):
+        """Register a connection; returns ``(connection_id, first)`` where
+        ``first`` is true if the user was offline everywhere until now."""
+        conn_id = uuid.uuid4().hex
+        async with db.SessionLocal() as session:
+            first = not await self._is_online(session, user_id)
+            session.add(
+                models.PresenceSession(
+                    id=conn_id, user_id=user_id, expires_at=self._deadline()
+                )
+            )
+            await session.commit()
+        self.local.add(conn_id)
+        return conn_id, first
+
+    async def disconnect(self, conn_id: str, user_id: int):
+        """Drop a connection; returns true if it was the user's last one."""
+        self.local.discard(conn_id)
+        async with db.SessionLocal() as session:
+            await session.execute(delete(models.PresenceSession).filter_by(id=conn_id))
+            await session.commit()
+            return not await self._is_online(session, user_id)
+
+    async def refresh(self):
+        """Push back the expiry of every connection this worker still holds."""
+        if not self.local:
+            return
+        async with db.SessionLocal() as session:
+            await session.execute(
+                update(models.PresenceSession)
+                .filter(models.PresenceSession.id.in_(list(self.local)))
+                .values(expires_at=self._deadline())
+            )
+            await session.commit()
+
+    async def expire(self):
+        """Delete expired connections and return ``(user_id, username)`` for
+        users who no longer have a live one anywhere."""
+        async with db.SessionLocal() as session:
+            result = await session.execute(
+                select(models.PresenceSession.id, models.User.id, models.User.username)
+                .join(models.User, models.User.id == models.PresenceSession.user_id)
+                .filter(models.PresenceSession.expires_at <= datetime.utcnow())
+            )
+            expired = result.all()
+            if not expired:
+                return []
+
+            users = {}
+            for conn_id, user_id, username in expired:
+                # several workers sweep; whoever deletes the row reports it
+                deleted = await session.execute(
+                    delete(models.PresenceSession).filter_by(id=conn_id)
+                )
+                if deleted.rowcount:
+                    users[user_id] = username
+            await session.commit()
+
+            offline = []
+            for user_id, username in users.items():
+                if not await self._is_online(session, user_id):
+                    offline.append((user_id, username))
+            return offline
+
+    def stats(self):
+        return {"local_connections": len(self.local), "ttl": self.ttl}
+
+
+presence_registry = PresenceRegistry()
@@ -0,0 +1,124 @@
+from mimetypes import guess_type
+from . import blobs
+from .processes import ProcessPool
+import asyncio
+import logging
+import os
+import uuid
+
+try:
+    from PIL import Image
+except ImportError:  # previews are optional; files are served as-is without
+    Image = None
+
+PREVIEW_SIZES = tuple(
+    sorted(int(s) for s in os.getenv("PREVIEW_SIZES", "320,1024").split(",") if s)
+)
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "1"))
+PREVIEW_FORMAT = os.getenv("PREVIEW_FORMAT", "WEBP")
+# Larger images are not decoded at all (decompression bombs, huge scans).
+PREVIEW_MAX_PIXELS = int(os.getenv("PREVIEW_MAX_PIXELS", str(50_000_000)))
+
+MEDIA_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg"}
+
+logger = logging.getLogger(__name__)
+
+
+def preview_path(digest: str, size: int):
+    """Previews live next to their blob: ``<sha256>.<size>``."""
+    return f"{blobs.blob_path(digest)}.{size}"
+
+
+def render_previews(source: str, targets: dict, fmt: str):
+    """Write the previews of an image; runs in a worker process.
+
+    ``targets`` maps each size to its output path. Only sizes smaller than
+    the image are produced; for the rest the original is already the best
+    fit. Returns the sizes written.
+    """
+    Image.MAX_IMAGE_PIXELS = PREVIEW_MAX_PIXELS
+    written = []
+    with Image.open(source) as image:
+        image.load()
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        if fmt == "JPEG" and image.mode == "RGBA":
+            image = image.convert("RGB")
+        for size, target in sorted(targets.items()):
+            if size >= max(image.size):
+                break
+            preview = image.copy()
+            preview.thumbnail((size, size))
+            partial = f"{target}.{uuid.uuid4().hex}.partial"
+            preview.save(partial, format=fmt)
+            os.replace(partial, target)
+            written.append(size)
+    return written
+
+
+class PreviewPool:
+    """Generates previews for uploaded images in a process pool.
+
+    Decoding and resizing a photo takes long enough to hurt the event loop,
+    and holds the GIL, so it runs in separate processes. ``schedule`` is
+    fire-and-forget: until the previews exist ``preview_file`` serves the
+    original.
+    """
+
+    def __init__(self, workers: int = PREVIEW_WORKERS, sizes=PREVIEW_SIZES):
+        self.processes = ProcessPool(workers)
+        self.sizes = sizes
+        self.tasks = set()
+        self.generated = 0
+        self.failed = 0
+
+    @property
+    def enabled(self):
+        return Image is not None and bool(self.sizes)
+
+    async def generate(self, digest: str):
+        args = (
+            blobs.blob_path(digest),
+            {size: preview_path(digest, size) for size in self.sizes},
+            PREVIEW_FORMAT,
+        )
+        try:
+            sizes = await self.processes.run(render_previews, *args)
+            self.generated += len(sizes)
+            return sizes
+        except Exception:
+            self.failed += 1
+            logger.exception("preview generation failed for %s", digest)
+            return []
+
+    def schedule(self, digest: str, file_name: str):
+        """Queue preview generation for a freshly stored file, if an image."""
+        media_type = guess_type(file_name or "")[0] or ""
+        if not self.enabled or not media_type.startswith("image/"):
+            return None
+        task = asyncio.create_task(self.generate(digest))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def best_size(self, digest: str, wanted: int):
+        """Pick the preview closest to ``wanted`` pixels; touches the disk.
+
+        That is the smallest stored preview at least that big. Failing that,
+        the original is closer whenever a larger size was skipped for being
+        bigger than the image (or is not written yet), so None is returned,
+        as it is when there are no previews at all.
+        """
+        available = [s for s in self.sizes if os.path.exists(preview_path(digest, s))]
+        fits = [s for s in available if s >= wanted]
+        if fits:
+            return fits[0]
+        if available and available[-1] == self.sizes[-1]:
+            return available[-1]
+        return None
+
+    def shutdown(self):
+        self.processes.shutdown()
+
+
+pool = PreviewPool()
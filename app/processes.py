@@ -0,0 +1,37 @@
+from concurrent.futures import ProcessPoolExecutor
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import multiprocessing
+
+
+class ProcessPool:
+    """A lazily started process pool for CPU-bound work off the event loop.
+
+    The executor is only spawned on the first call, so importing a module
+    that owns one costs nothing. ``workers=0`` runs calls in the threadpool
+    instead, which is handy for tests and tiny deployments.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.executor = None
+
+    def _get_executor(self):
+        if self.executor is None:
+            # spawn, not fork: the parent has aiosqlite and portal threads
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self.executor
+
+    async def run(self, fn, *args):
+        if self.workers <= 0:
+            return await run_in_threadpool(fn, *args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), fn, *args)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
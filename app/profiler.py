@@ -0,0 +1,207 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import logging
+import os
+import re
+import time
+
+# Off by default: SQL_PROFILE=1 makes every HTTP response carry an
+# ``X-SQL-Profile`` header and logs requests with repeated statements.
+SQL_PROFILE = os.getenv("SQL_PROFILE", "").lower() in ("1", "true", "yes")
+# The same statement shape this many times in one request is an N+1 suspect.
+N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_PROFILE_N1_THRESHOLD", "3"))
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar("sql_profile", default=None)
+_watching = []  # profiles that see every statement, see ``profile()``
+
+
+_PLACEHOLDER = r"(?:\?|%\(\w+\)s|\$\d+|:\w+)"
+_EXPANDED_IN = re.compile(rf"IN \({_PLACEHOLDER}(?:, {_PLACEHOLDER})*\)")
+
+
+def statement_shape(statement: str):
+    """Collapse whitespace and expanded IN lists, so a query issued with
+    different parameters and list lengths counts as the same statement."""
+    return _EXPANDED_IN.sub("IN (?)", " ".join(statement.split()))
+
+
+class Profile:
+    """Statements seen during one request, WS action or ``profile()`` block."""
+
+    def __init__(self, name: str = None):
+        self.name = name
+        self.queries = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement: str, seconds: float):
+        self.queries += 1
+        self.seconds += seconds
+        self.shapes[statement_shape(statement)] += 1
+
+    @property
+    def n_plus_one(self):
+        """Statement shapes repeated at least N_PLUS_ONE_THRESHOLD times."""
+        return {
+            shape: count
+            for shape, count in self.shapes.items()
+            if count >= N_PLUS_ONE_THRESHOLD
+        }
+
+    def header(self):
+        return (
+            f"queries={self.queries}; db_ms={self.seconds * 1000:.2f}; "
+            f"n_plus_one={len(self.n_plus_one)}"
+        )
+
+    def report(self):
+        lines = [f"{self.name or 'profile'}: {self.header()}"]
+        for shape, count in self.shapes.most_common():
+            lines.append(f"  {count:>4}x {shape}")
+        return "\n".join(lines)
+
+    def assert_budget(self, queries: int = None, allow_repeats: bool = False):
+        """Fail with the statement list if the budget was exceeded.
+
+        Repeated statement shapes fail too unless ``allow_repeats``.
+        """
+        if queries is not None and self.queries > queries:
+            raise AssertionError(f"over budget of {queries} queries\n{self.report()}")
+        if not allow_repeats and self.n_plus_one:
+            raise AssertionError(f"N+1 suspects\n{self.report()}")
+
+
+class ProfileGroup:
+    """Records each statement into several profiles at once."""
+
+    def __init__(self, profiles):
+        self.profiles = profiles
+
+    def record(self, statement: str, seconds: float):
+        for profile in self.profiles:
+            profile.record(statement, seconds)
+
+
+def begin(name: str):
+    """Attribute statements run from here on in this context (and in tasks it
+    starts) to a new profile. Returns None when SQL_PROFILE is off.
+
+    Long-lived tasks must be started in a clean ``contextvars.Context()``,
+    or every statement they ever run lands in the profile that was current
+    when they were created."""
+    if not SQL_PROFILE:
+        return None
+    profile = Profile(name)
+    _current.set(profile)
+    return profile
+
+
+def end(profile: Profile):
+    """Close a profile from ``begin``; logs it, loudly if N+1 suspects."""
+    if profile is None:
+        return
+    _current.set(None)
+    if profile.n_plus_one:
+        logger.warning("N+1 suspect\n%s", profile.report())
+    else:
+        logger.debug("%s", profile.report())
+
+
+def current():
+    """The profile of the running request or WS action, if any."""
+    return _current.get()
+
+
+@contextmanager
+def attribute_to(*profiles):
+    """Attribute statements run in the block to ``profiles`` instead.
+
+    For work done on behalf of others, like the message writer's group
+    commits; None entries are skipped."""
+    profiles = [p for p in profiles if p is not None]
+    token = _current.set(ProfileGroup(profiles) if profiles else None)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def profile(name: str = None):
+    """Record every statement any code runs while the block is open.
+
+    Meant for tests, where requests run outside the caller's context::
+
+        with profiler.profile() as p:
+            client.get("/api/chats", headers=headers)
+        p.assert_budget(queries=3)
+    """
+    watcher = Profile(name)
+    _watching.append(watcher)
+    try:
+        yield watcher
+    finally:
+        _watching.remove(watcher)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _statement_started(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None or _watching:
+        conn.info.setdefault("profile_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _statement_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("profile_started")
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    current = _current.get()
+    if current is not None:
+        current.record(statement, elapsed)
+    for watcher in _watching:
+        watcher.record(statement, elapsed)
+
+
+@event.listens_for(Engine, "handle_error")
+def _statement_failed(context):
+    started = context.connection is not None and context.connection.info.get(
+        "profile_started"
+    )
+    if started:
+        started.pop()
+
+
+class SQLProfilerMiddleware:
+    """Profiles each HTTP request when SQL_PROFILE is on.
+
+    The numbers go out in an ``X-SQL-Profile`` header; statement texts only
+    go to the log.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        current = scope["type"] == "http" and begin(
+            f"{scope['method']} {scope['path']}"
+        )
+        if not current:
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-sql-profile", current.header().encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            end(current)
@@ -49,3 +49,9 @@ class PromoteMember(BaseModel):
 
 class DemoteMember(BaseModel):
     user_id: int
+
+
+class StartUpload(BaseModel):
+    thread_id: int
+    file_name: str
+    file_size: int
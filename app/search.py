@@ -0,0 +1,169 @@
+from sqlalchemy import bindparam, inspect, text
+from sqlalchemy.engine import Connection
+from . import db
+import base64
+import re
+
+# Messages are indexed by their text and, for files, their file name, one
+# entry per message keyed by its id. The entry is written in the same
+# transaction as the message, so search never lags behind the thread.
+#
+# SQLite keeps the entries in an FTS5 table ranked with bm25(); PostgreSQL in
+# a tsvector table behind a GIN index, ranked with ts_rank(). Both rank
+# "lower is better" so one cursor shape serves both.
+
+SQLITE_CREATE = """
+CREATE VIRTUAL TABLE messages_fts USING fts5(
+    body, thread_id UNINDEXED, tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+SQLITE_BACKFILL = """
+INSERT INTO messages_fts (rowid, body, thread_id)
+SELECT id, TRIM(COALESCE(content, '') || ' ' || COALESCE(file_name, '')), thread_id
+FROM messages
+"""
+SQLITE_INSERT = """
+INSERT INTO messages_fts (rowid, body, thread_id) VALUES (:id, :body, :thread_id)
+"""
+SQLITE_DELETE_THREAD = """
+DELETE FROM messages_fts
+WHERE rowid IN (SELECT id FROM messages WHERE thread_id = :thread_id)
+"""
+SQLITE_HITS = """
+SELECT rowid AS id, bm25(messages_fts) AS rank FROM messages_fts
+WHERE messages_fts MATCH :query
+  AND thread_id IN :thread_ids
+"""
+
+POSTGRES_CREATE = [
+    """
+    CREATE TABLE message_search (
+        message_id INTEGER PRIMARY KEY REFERENCES messages (id) ON DELETE CASCADE,
+        thread_id INTEGER NOT NULL,
+        document TSVECTOR NOT NULL
+    )
+    """,
+    "CREATE INDEX ix_message_search_document ON message_search USING GIN (document)",
+]
+POSTGRES_BACKFILL = """
+INSERT INTO message_search (message_id, thread_id, document)
+SELECT id, thread_id,
+       to_tsvector('simple', COALESCE(content, '') || ' ' || COALESCE(file_name, ''))
+FROM messages
+"""
+POSTGRES_INSERT = """
+INSERT INTO message_search (message_id, thread_id, document)
+VALUES (:id, :thread_id, to_tsvector('simple', :body))
+"""
+POSTGRES_DELETE_THREAD = "DELETE FROM message_search WHERE thread_id = :thread_id"
+POSTGRES_HITS = """
+SELECT s.message_id AS id, -ts_rank(s.document, q) AS rank
+FROM message_search s, websearch_to_tsquery('simple', :query) q
+WHERE s.document @@ q
+  AND s.thread_id IN :thread_ids
+"""
+
+
+def _postgres(dialect_name: str = None):
+    return (dialect_name or db.engine.dialect.name) == "postgresql"
+
+
+def create_index(conn: Connection):
+    """Create and fill the search index once; a migration step."""
+    if _postgres(conn.dialect.name):
+        if inspect(conn).has_table("message_search"):
+            return
+        for statement in POSTGRES_CREATE:
+            conn.execute(text(statement))
+        conn.execute(text(POSTGRES_BACKFILL))
+    else:
+        if inspect(conn).has_table("messages_fts"):
+            return
+        conn.execute(text(SQLITE_CREATE))
+        conn.execute(text(SQLITE_BACKFILL))
+
+
+def message_text(content: str = None, file_name: str = None):
+    return " ".join(part for part in (content, file_name) if part)
+
+
+async def index_messages(executor, rows):
+    """Add ``(message_id, thread_id, text)`` rows to the index.
+
+    ``executor`` is the session or connection that wrote the messages, so
+    the entries commit (or roll back) with them.
+    """
+    params = [
+        {"id": message_id, "thread_id": thread_id, "body": body}
+        for message_id, thread_id, body in rows
+        if body
+    ]
+    if params:
+        insert = POSTGRES_INSERT if _postgres() else SQLITE_INSERT
+        await executor.execute(text(insert), params)
+
+
+async def remove_thread(executor, thread_id: int):
+    """Drop a thread's entries; call before its messages are deleted."""
+    delete = POSTGRES_DELETE_THREAD if _postgres() else SQLITE_DELETE_THREAD
+    await executor.execute(text(delete), {"thread_id": thread_id})
+
+
+def fts_query(query: str):
+    """Turn user input into an FTS5 query: all words, the last one a prefix.
+
+    Every word is quoted, so FTS5 operators and column filters typed by the
+    user are searched for literally instead of being interpreted.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def encode_cursor(rank: float, message_id: int):
+    return base64.urlsafe_b64encode(f"{rank!r}:{message_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        rank, _, message_id = base64.urlsafe_b64decode(cursor).decode().partition(":")
+        return float(rank), int(message_id)
+    except ValueError:
+        return None
+
+
+async def search(executor, thread_ids, query: str, limit: int, cursor=None):
+    """Best matches first among ``thread_ids``, the caller's threads.
+
+    Returns ``([message_id, ...], next_cursor)``. The cursor is the
+    ``(rank, id)`` of the last hit, so each page continues the ranking where
+    the previous one stopped rather than counting an offset.
+    """
+    if _postgres():
+        hits, query = POSTGRES_HITS, query.strip()
+    else:
+        hits, query = SQLITE_HITS, fts_query(query)
+    if not query or not thread_ids:
+        return [], None
+
+    params = {"query": query, "thread_ids": list(thread_ids), "limit": limit + 1}
+    after = ""
+    if cursor is not None:
+        after = "WHERE rank > :rank OR (rank = :rank AND id < :id)"
+        params["rank"], params["id"] = cursor
+
+    result = await executor.execute(
+        text(
+            f"SELECT id, rank FROM ({hits}) hits {after} "
+            "ORDER BY rank, id DESC LIMIT :limit"
+        ).bindparams(bindparam("thread_ids", expanding=True)),
+        params,
+    )
+    rows = result.all()
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = encode_cursor(rows[limit - 1].rank, rows[limit - 1].id)
+    return [row.id for row in rows[:limit]], next_cursor
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import os
+import time
+
+TYPING_TICK = float(os.getenv("TYPING_TICK_MS", "500")) / 1000
+TYPING_TTL = float(os.getenv("TYPING_TTL", "6"))
+
+logger = logging.getLogger(__name__)
+
+
+class TypingAggregator:
+    """Per-thread "who is typing" state, sent as one combined event per tick.
+
+    Clients send ``typing_start`` on every keystroke. Only actual state
+    changes, plus a refresh every half TTL while someone keeps typing, are
+    published on the bus, so every worker holds the same state. A typer who
+    goes quiet for ``ttl`` seconds is dropped without needing a
+    ``typing_stop``.
+
+    Every ``tick`` each worker sends the threads whose typer set changed
+    ``{"type": "typing", "thread_id", "users": [{"user_id", "username"}]}``
+    through ``deliver``, which reaches that worker's own sockets only.
+    """
+
+    def __init__(
+        self, bus, deliver, tick: float = TYPING_TICK, ttl: float = TYPING_TTL
+    ):
+        self.bus = bus
+        self.deliver = deliver
+        self.tick = tick
+        self.ttl = ttl
+        self.typing = {}  # thread_id -> {user_id: (username, expires_at)}
+        self.dirty = set()
+        self.events = 0
+        bus.subscribe(self._on_event)
+
+    async def start_typing(self, thread_id: int, user_id: int, username: str):
+        current = self.typing.get(thread_id, {}).get(user_id)
+        # still announced and not due for a refresh: a keystroke costs nothing
+        if current and current[1] - time.monotonic() > self.ttl / 2:
+            return
+        await self._publish(thread_id, user_id, username, True)
+
+    async def stop_typing(self, thread_id: int, user_id: int):
+        if user_id in self.typing.get(thread_id, {}):
+            await self._publish(thread_id, user_id, None, False)
+
+    async def _publish(self, thread_id, user_id, username, is_typing):
+        await self.bus.publish(
+            {
+                "scope": "typing",
+                "thread_id": thread_id,
+                "user_id": user_id,
+                "username": username,
+                "is_typing": is_typing,
+            }
+        )
+
+    async def _on_event(self, event: dict):
+        if event["scope"] != "typing":
+            return
+        thread_id, user_id = event["thread_id"], event["user_id"]
+        typers = self.typing.setdefault(thread_id, {})
+        if event["is_typing"]:
+            if user_id not in typers:
+                self.dirty.add(thread_id)
+            typers[user_id] = (event["username"], time.monotonic() + self.ttl)
+        elif typers.pop(user_id, None):
+            self.dirty.add(thread_id)
+        if not typers:
+            del self.typing[thread_id]
+
+    def users(self, thread_id: int):
+        return [
+            {"user_id": user_id, "username": username}
+            for user_id, (username, _) in self.typing.get(thread_id, {}).items()
+        ]
+
+    def flush(self):
+        """Expire quiet typers and send one event per changed thread."""
+        now = time.monotonic()
+        for thread_id, typers in list(self.typing.items()):
+            for user_id, (_, expires_at) in list(typers.items()):
+                if expires_at <= now:
+                    del typers[user_id]
+                    self.dirty.add(thread_id)
+            if not typers:
+                del self.typing[thread_id]
+
+        dirty, self.dirty = self.dirty, set()
+        for thread_id in dirty:
+            self.events += 1
+            self.deliver(
+                thread_id,
+                {
+                    "type": "typing",
+                    "thread_id": thread_id,
+                    "users": self.users(thread_id),
+                },
+            )
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("typing flush failed")
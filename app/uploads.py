@@ -0,0 +1,270 @@
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from fastapi import HTTPException, Request
+from multipart.multipart import MultipartParser, parse_options_header
+from sqlalchemy import delete, select
+from starlette.concurrency import run_in_threadpool
+from . import db, metrics, models
+import fcntl
+import hashlib
+import os
+import time
+import uuid
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(512 * 1024 * 1024)))
+# bytes gathered from the request before each write hop to the threadpool
+UPLOAD_BUFFER_BYTES = int(os.getenv("UPLOAD_BUFFER_BYTES", str(1024 * 1024)))
+# Resumable uploads with no new bytes for this long are deleted by ``sweep``
+UPLOAD_EXPIRE_SECONDS = float(os.getenv("UPLOAD_EXPIRE_SECONDS", str(24 * 3600)))
+UPLOAD_SWEEP_INTERVAL = float(os.getenv("UPLOAD_SWEEP_INTERVAL", "3600"))
+
+
+def partial_path(upload_id: str):
+    return os.path.join(UPLOAD_DIR, "partial", upload_id)
+
+
+class FileSink:
+    """Buffered file writer whose disk I/O runs in the threadpool.
+
+    Enforces ``max_bytes`` as data arrives, so an oversized upload is
+    rejected (and its file removed) after ``max_bytes``, not after the
+    whole body has been received. The SHA-256 of what it wrote is kept on
+    the way, in the same threadpool hop as the write.
+    """
+
+    def __init__(self, path: str, max_bytes: int = None, append: bool = False):
+        self.path = path
+        self.max_bytes = UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+        self.append = append
+        self.file = None
+        self.buffer = []
+        self.buffered = 0
+        self.size = 0
+        self.hash = hashlib.sha256()
+
+    @property
+    def sha256(self):
+        return self.hash.hexdigest()
+
+    async def open(self):
+        def _open():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            return open(self.path, "ab" if self.append else "wb")
+
+        self.file = await run_in_threadpool(_open)
+        return self
+
+    def feed(self, data: bytes):
+        """Queue bytes; returns True once enough is buffered to ``flush``."""
+        self.size += len(data)
+        metrics.upload_bytes.inc(len(data))
+        if self.size > self.max_bytes:
+            raise HTTPException(413, "File too large")
+        self.buffer.append(data)
+        self.buffered += len(data)
+        return self.buffered >= UPLOAD_BUFFER_BYTES
+
+    def _write(self, chunks):
+        for chunk in chunks:
+            self.hash.update(chunk)
+            self.file.write(chunk)
+
+    async def flush(self):
+        if self.buffer:
+            chunks, self.buffer, self.buffered = self.buffer, [], 0
+            await run_in_threadpool(self._write, chunks)
+
+    async def close(self):
+        await self.flush()
+        await run_in_threadpool(self.file.close)
+
+    async def abort(self):
+        def _discard():
+            if self.file is not None:
+                self.file.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+        await run_in_threadpool(_discard)
+
+
+async def receive_form_file(request: Request, field: str = "file"):
+    """Stream the ``field`` file part of a multipart request to disk.
+
+    Returns ``(sink, filename)``; the data is in ``sink.path``, a temporary
+    file under UPLOAD_DIR that the caller moves or removes. Other parts are
+    ignored. Nothing is spooled in memory beyond one write buffer.
+    """
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > UPLOAD_MAX_BYTES + 64 * 1024:
+        raise HTTPException(413, "File too large")
+
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    if b"boundary" not in params:
+        raise HTTPException(400, "Expected multipart/form-data")
+
+    sink = FileSink(partial_path(uuid.uuid4().hex))
+    part = {"headers": {}, "name": b"", "value": b"", "target": False}
+    found = {}
+
+    def on_part_begin():
+        part.update(headers={}, name=b"", value=b"", target=False)
+
+    def on_header_field(data, start, end):
+        part["name"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["name"].lower()] = part["value"]
+        part["name"], part["value"] = b"", b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(
+            part["headers"].get(b"content-disposition", b"")
+        )
+        if options.get(b"name") == field.encode() and b"filename" in options:
+            part["target"] = not found
+            if part["target"]:
+                found["filename"] = options[b"filename"].decode("utf-8", "replace")
+
+    def on_part_data(data, start, end):
+        if part["target"]:
+            sink.feed(data[start:end])
+
+    parser = MultipartParser(
+        params[b"boundary"],
+        {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+        },
+    )
+
+    await sink.open()
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if sink.buffered >= UPLOAD_BUFFER_BYTES:
+                await sink.flush()
+        parser.finalize()
+        await sink.close()
+    except BaseException:
+        await sink.abort()
+        raise
+
+    if "filename" not in found:
+        await sink.abort()
+        raise HTTPException(400, f"Missing file field '{field}'")
+    return sink, found["filename"]
+
+
+@asynccontextmanager
+async def locked_partial(upload_id: str):
+    """Hold an upload's partial file exclusively; yields its stored size.
+
+    The lock is a ``flock`` on the file, so it also keeps out requests
+    served by other workers. Raises 409 while someone else holds it.
+    """
+    path = partial_path(upload_id)
+
+    def _lock():
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file = open(path, "ab")
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            file.close()
+            return None
+        return file
+
+    file = await run_in_threadpool(_lock)
+    if file is None:
+        raise HTTPException(409, "Upload busy, retry at the reported offset")
+    try:
+        yield os.fstat(file.fileno()).st_size
+    finally:
+        await run_in_threadpool(file.close)
+
+
+async def receive_chunk(request: Request, upload_id: str, offset: int, limit: int):
+    """Append the raw request body to a chunked upload at ``offset``.
+
+    ``offset`` must equal the bytes already stored, so a client that lost
+    a response asks for the offset again and resends from there. Bytes past
+    ``limit`` are refused. Returns the new stored size.
+    """
+    async with locked_partial(upload_id) as stored:
+        # checked under the lock: two PUTs at the same offset can't both pass
+        if offset != stored:
+            raise HTTPException(409, f"Expected offset {stored}")
+
+        path = partial_path(upload_id)
+        sink = await FileSink(path, max_bytes=limit - stored, append=True).open()
+        try:
+            async for chunk in request.stream():
+                if sink.feed(chunk):
+                    await sink.flush()
+        finally:
+            # whatever arrived before a dropped connection is kept; the
+            # client resumes from the offset it reads back
+            await sink.close()
+    return stored + sink.size
+
+
+async def sweep(max_age: float = None):
+    """Delete abandoned resumable uploads and stray partial files.
+
+    An upload is abandoned once it is older than ``max_age`` and its file
+    has not grown for as long. Partial files with no upload, left by
+    interrupted form uploads or a crash, go after ``max_age`` too. Returns
+    the number of files removed.
+    """
+    max_age = UPLOAD_EXPIRE_SECONDS if max_age is None else max_age
+    cutoff = time.time() - max_age
+    directory = os.path.join(UPLOAD_DIR, "partial")
+
+    def _stale(name):
+        try:
+            return os.path.getmtime(os.path.join(directory, name)) < cutoff
+        except FileNotFoundError:
+            return True
+
+    async with db.SessionLocal() as session:
+        result = await session.execute(select(models.Upload.id))
+        uploads = set(result.scalars().all())
+        old = await session.execute(
+            select(models.Upload.id).filter(
+                models.Upload.created_at
+                < datetime.utcnow() - timedelta(seconds=max_age)
+            )
+        )
+        expired = [
+            upload_id
+            for upload_id in old.scalars().all()
+            if await run_in_threadpool(_stale, upload_id)
+        ]
+        if expired:
+            await session.execute(
+                delete(models.Upload).filter(models.Upload.id.in_(expired))
+            )
+            await session.commit()
+
+    def _remove():
+        names = os.listdir(directory) if os.path.isdir(directory) else []
+        removed = 0
+        for name in names:
+            if (name in expired or name not in uploads) and _stale(name):
+                try:
+                    os.remove(os.path.join(directory, name))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    return await run_in_threadpool(_remove)
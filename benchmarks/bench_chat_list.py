@@ -0,0 +1,121 @@
+"""GET /api/chats against users with a growing number of threads.
+
+    python -m benchmarks.bench_chat_list [--threads 10 100 300] [--iterations 50]
+
+For each size a user is seeded into that many threads (half DMs, half
+groups) with message history, a third of it unread.  The table shows the SQL
+statements issued per request and the latency distribution; both should stay
+flat as the thread count grows.
+"""
+
+import argparse
+import json
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from app import models
+from benchmarks.common import (
+    QueryCounter,
+    bearer,
+    create_user,
+    summarize,
+    temp_database,
+    timed,
+)
+from main import app
+
+
+def seed(engine, thread_count, messages_per_thread):
+    me = create_user(engine, "bench_me")
+    peer = create_user(engine, "bench_peer")
+    start = datetime.utcnow() - timedelta(days=1)
+
+    with engine.begin() as conn:
+        threads, members, messages = [], [], []
+        message_id = 0
+        for t in range(1, thread_count + 1):
+            is_group = t % 2 == 0
+            threads.append(
+                {"id": t, "name": f"thread {t}", "is_group": is_group, "created_by": me}
+            )
+            for i in range(messages_per_thread):
+                message_id += 1
+                messages.append(
+                    {
+                        "id": message_id,
+                        "thread_id": t,
+                        "sender_id": peer,
+                        "content": f"message {i}",
+                        "created_at": start + timedelta(seconds=message_id),
+                    }
+                )
+            # leave the last third of every thread unread for bench_me
+            read_up_to = message_id - messages_per_thread // 3
+            members.append(
+                {
+                    "thread_id": t,
+                    "user_id": me,
+                    "is_admin": is_group,
+                    "last_read_message_id": read_up_to,
+                    "last_delivered_message_id": message_id,
+                }
+            )
+            members.append(
+                {
+                    "thread_id": t,
+                    "user_id": peer,
+                    "is_admin": False,
+                    "last_read_message_id": message_id,
+                    "last_delivered_message_id": message_id,
+                }
+            )
+
+        conn.execute(models.ChatThread.__table__.insert(), threads)
+        conn.execute(models.ThreadMember.__table__.insert(), members)
+        conn.execute(models.Message.__table__.insert(), messages)
+
+
+def run(thread_count, messages_per_thread, iterations):
+    with temp_database() as engine:
+        seed(engine, thread_count, messages_per_thread)
+        client = TestClient(app)
+        headers = bearer("bench_me")
+
+        def request():
+            r = client.get("/api/chats", headers=headers)
+            assert r.status_code == 200 and len(r.json()) == thread_count
+
+        request()  # warm up
+        with QueryCounter() as counter:
+            request()
+        samples = timed(request, iterations)
+
+    return {
+        "threads": thread_count,
+        "queries_per_request": counter.count,
+        **summarize(samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, nargs="+", default=[10, 100, 300])
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--json", action="store_true", help="emit JSON lines")
+    args = parser.parse_args()
+
+    for count in args.threads:
+        row = run(count, args.messages, args.iterations)
+        if args.json:
+            print(json.dumps(row))
+        else:
+            print(
+                f"threads={row['threads']:>5}  queries={row['queries_per_request']:>3}"
+                f"  p50={row['p50_ms']:.2f}ms  p95={row['p95_ms']:.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Bytes served for repeated thread opens and for seeking in a video.
+
+    python -m benchmarks.bench_files [--files 20] [--size 200000] [--opens 10]
+
+A thread holds ``--files`` images; the chat view is opened ``--opens`` times
+and fetches every image each time. Three clients are compared:
+
+* ``no-cache``: re-downloads everything, as every client did before files
+  carried validators and caching headers;
+* ``revalidate``: keeps what it got and sends If-None-Match, getting 304s;
+* ``immutable``: honours ``Cache-Control: immutable`` and does not ask again.
+
+The seek scenario reads three 256 KiB windows of a large file with Range
+requests instead of downloading it whole each time.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+
+from fastapi.testclient import TestClient
+
+from app import uploads
+from benchmarks.common import bearer, create_user, temp_database
+from main import app
+
+
+def open_thread(client, headers, urls, cache, mode):
+    served = requests = 0
+    for url in urls:
+        if mode == "immutable" and url in cache:
+            continue
+        extra = {}
+        if mode == "revalidate" and url in cache:
+            extra["If-None-Match"] = cache[url]
+        r = client.get(url, headers={**headers, **extra})
+        requests += 1
+        served += len(r.content)
+        if r.status_code == 200 and mode != "no-cache":
+            cache[url] = r.headers["etag"]
+    return served, requests
+
+
+def run(file_count, size, opens, video_size):
+    with temp_database() as engine, tempfile.TemporaryDirectory() as files:
+        previous, uploads.UPLOAD_DIR = uploads.UPLOAD_DIR, files
+        try:
+            create_user(engine, "bench_files")
+            client = TestClient(app)
+            headers = bearer("bench_files")
+            r = client.post(
+                "/api/threads",
+                json={"name": "media", "is_group": True},
+                headers=headers,
+            )
+            thread_id = r.json()["id"]
+
+            def upload(name, data):
+                r = client.post(
+                    f"/api/threads/{thread_id}/upload",
+                    files={"file": (name, data)},
+                    headers=headers,
+                )
+                return r.json()["file_url"]
+
+            urls = [upload(f"img{i}.jpg", os.urandom(size)) for i in range(file_count)]
+
+            rows = []
+            for mode in ("no-cache", "revalidate", "immutable"):
+                cache, served, requests = {}, 0, 0
+                for _ in range(opens):
+                    b, n = open_thread(client, headers, urls, cache, mode)
+                    served, requests = served + b, requests + n
+                rows.append(
+                    {
+                        "scenario": f"thread-open/{mode}",
+                        "bytes": served,
+                        "requests": requests,
+                    }
+                )
+
+            video = upload("clip.mp4", os.urandom(video_size))
+            window = 256 * 1024
+            offsets = [0, video_size // 2, video_size - window]
+            full = sum(len(client.get(video, headers=headers).content) for _ in offsets)
+            ranged = sum(
+                len(
+                    client.get(
+                        video,
+                        headers={**headers, "Range": f"bytes={o}-{o + window - 1}"},
+                    ).content
+                )
+                for o in offsets
+            )
+            rows.append({"scenario": "seek/full", "bytes": full, "requests": 3})
+            rows.append({"scenario": "seek/range", "bytes": ranged, "requests": 3})
+        finally:
+            uploads.UPLOAD_DIR = previous
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--size", type=int, default=200_000)
+    parser.add_argument("--opens", type=int, default=10)
+    parser.add_argument("--video-size", type=int, default=8 * 1024 * 1024)
+    parser.add_argument("--json", action="store_true", help="emit JSON lines")
+    args = parser.parse_args()
+
+    for row in run(args.files, args.size, args.opens, args.video_size):
+        if args.json:
+            print(json.dumps(row))
+        else:
+            print(
+                f"{row['scenario']:<22} bytes={row['bytes']:>12,}"
+                f"  requests={row['requests']:>4}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""Mixed WebSocket and REST load against a real server, end to end.
+
+    python -m benchmarks.bench_load [--users 40] [--groups 10 5 3 2] \\
+        [--history 200] [--duration 10] [--rate 2] [--readers 8] [--json]
+
+Seeds ``--users`` users, one group per ``--groups`` entry with that many
+members (assigned round robin) and ``--history`` messages in each. The app
+is then served by uvicorn on a local port, in this process so its SQL can be
+counted, and driven over real sockets:
+
+* every user holds a ``/ws/chat`` connection, joins its groups and, about
+  ``--rate`` times a second, sends ``typing_start`` and then a message to one
+  of them; delivery latency is measured from the send to each other member's
+  socket receiving it;
+* ``--readers`` HTTP clients loop over ``GET /api/chats``,
+  ``GET /api/threads/{id}/messages`` and ``POST /api/threads/{id}/read``.
+
+Queries per request are counted for each REST route on an idle server
+before the run; during the run the total is divided by every operation
+served (messages plus REST requests). Clients share the event loop with the
+server, so absolute numbers are pessimistic; compare them run to run.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import time
+from datetime import datetime, timedelta
+
+import httpx
+import uvicorn
+import websockets
+
+from app import auth, models
+from benchmarks.common import QueryCounter, bearer, summarize, temp_database
+from main import app
+
+
+def seed(engine, user_count, group_sizes, history):
+    """Bulk-insert users, groups and history; returns ``{user_id: [thread]}``."""
+    password = auth.get_password_hash("secret")
+    start = datetime.utcnow() - timedelta(days=1)
+    users = list(range(1, user_count + 1))
+    threads, members, messages, joined = [], [], [], {u: [] for u in users}
+
+    message_id, next_user = 0, 0
+    for thread_id, size in enumerate(group_sizes, start=1):
+        group = [users[(next_user + i) % user_count] for i in range(size)]
+        next_user += size
+        threads.append(
+            {"id": thread_id, "name": f"group {thread_id}", "is_group": True}
+        )
+        first = message_id + 1
+        for i in range(history):
+            message_id += 1
+            messages.append(
+                {
+                    "id": message_id,
+                    "thread_id": thread_id,
+                    "sender_id": group[i % len(group)],
+                    "content": f"history {i}",
+                    "created_at": start + timedelta(seconds=message_id),
+                }
+            )
+        for position, user_id in enumerate(dict.fromkeys(group)):
+            joined[user_id].append(thread_id)
+            members.append(
+                {
+                    "thread_id": thread_id,
+                    "user_id": user_id,
+                    "is_admin": position == 0,
+                    "last_read_message_id": first,
+                    "last_delivered_message_id": message_id,
+                }
+            )
+
+    with engine.begin() as conn:
+        conn.execute(
+            models.User.__table__.insert(),
+            [
+                {"id": u, "username": f"load{u}", "hashed_password": password}
+                for u in users
+            ],
+        )
+        conn.execute(models.ChatThread.__table__.insert(), threads)
+        conn.execute(models.ThreadMember.__table__.insert(), members)
+        if messages:
+            conn.execute(models.Message.__table__.insert(), messages)
+    return joined
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Load:
+    def __init__(self, port, joined, rate, duration, clients):
+        self.port = port
+        self.joined = joined
+        self.rate = rate
+        self.duration = duration
+        self.clients = clients
+        self.connected = 0
+        self.go = asyncio.Event()
+        self.started = self.deadline = None
+        self.sent_at = {}  # content -> (sender, perf_counter at send)
+        self.latencies = []
+        self.sent = 0
+        self.rest = {}  # route -> [seconds]
+        self.errors = 0
+        self.connect_errors = 0
+
+    async def connect(self, user_id, thread_id, attempts=5):
+        """Open a socket and join ``thread_id``, waiting for the echo.
+
+        A refused handshake (1008, e.g. "database is locked" while the
+        presence row is written) is counted and retried, as a client would.
+        """
+        token = bearer(f"load{user_id}")["Authorization"].split()[1]
+        url = f"ws://127.0.0.1:{self.port}/ws/chat?token={token}"
+        joined = f"load{user_id} joined thread"
+        for attempt in range(attempts):
+            ws = await websockets.connect(url, max_queue=None)
+            try:
+                await ws.send(json.dumps({"action": "join", "thread_id": thread_id}))
+                while json.loads(await ws.recv()).get("message") != joined:
+                    pass
+                return ws
+            except websockets.ConnectionClosed:
+                self.connect_errors += 1
+                await asyncio.sleep(0.1 * (attempt + 1))
+        raise RuntimeError(f"load{user_id} could not connect")
+
+    async def chatter(self, user_id):
+        threads = self.joined[user_id]
+        if not threads:
+            return
+        async with await self.connect(user_id, threads[0]) as ws:
+            for thread_id in threads[1:]:
+                await ws.send(json.dumps({"action": "join", "thread_id": thread_id}))
+            reader = asyncio.create_task(self.receive(ws, user_id))
+            try:
+                await self.ready()
+                seq = 0
+                while time.perf_counter() < self.deadline:
+                    await asyncio.sleep(random.expovariate(self.rate))
+                    thread_id = random.choice(threads)
+                    seq += 1
+                    content = f"{user_id}:{seq}"
+                    await ws.send(
+                        json.dumps({"action": "typing_start", "thread_id": thread_id})
+                    )
+                    self.sent_at[content] = (user_id, time.perf_counter())
+                    await ws.send(
+                        json.dumps(
+                            {
+                                "action": "message",
+                                "thread_id": thread_id,
+                                "content": content,
+                            }
+                        )
+                    )
+                    self.sent += 1
+                # let the last broadcasts arrive
+                await asyncio.sleep(0.5)
+            finally:
+                reader.cancel()
+
+    async def ready(self):
+        """Hold every client until all sockets are connected and joined.
+
+        Connecting, authenticating and announcing presence for every client
+        at once is a burst of its own; it stays out of the measured window.
+        """
+        self.connected += 1
+        if self.connected == self.clients:
+            await asyncio.sleep(0.5)  # let the last joins be processed
+            self.started = time.perf_counter()
+            self.deadline = self.started + self.duration
+            self.go.set()
+        await self.go.wait()
+
+    async def receive(self, ws, user_id):
+        async for frame in ws:
+            data = json.loads(frame)
+            if data.get("type") == "ping":
+                await ws.send(json.dumps({"action": "pong"}))
+            elif data.get("type") == "message" and data.get("id"):
+                sender, sent = self.sent_at.get(data.get("content"), (None, None))
+                if sender is not None and sender != user_id:
+                    self.latencies.append(time.perf_counter() - sent)
+
+    async def reader(self, user_id):
+        headers = bearer(f"load{user_id}")
+        threads = self.joined[user_id]
+        base_url = f"http://127.0.0.1:{self.port}"
+        async with httpx.AsyncClient(base_url=base_url, headers=headers) as client:
+            await self.go.wait()
+            while time.perf_counter() < self.deadline:
+                thread_id = random.choice(threads)
+                for route, request in (
+                    ("GET /api/chats", client.get("/api/chats")),
+                    (
+                        "GET /api/threads/{id}/messages",
+                        client.get(f"/api/threads/{thread_id}/messages"),
+                    ),
+                    (
+                        "POST /api/threads/{id}/read",
+                        client.post(f"/api/threads/{thread_id}/read"),
+                    ),
+                ):
+                    start = time.perf_counter()
+                    r = await request
+                    self.rest.setdefault(route, []).append(time.perf_counter() - start)
+                    if r.status_code != 200:
+                        self.errors += 1
+
+
+async def queries_per_route(port, user_id, thread_id):
+    """SQL statements per REST request, each measured alone on an idle app."""
+    counts = {}
+    base_url = f"http://127.0.0.1:{port}"
+    async with httpx.AsyncClient(
+        base_url=base_url, headers=bearer(f"load{user_id}")
+    ) as client:
+        for route, method, path in (
+            ("GET /api/chats", "GET", "/api/chats"),
+            (
+                "GET /api/threads/{id}/messages",
+                "GET",
+                f"/api/threads/{thread_id}/messages",
+            ),
+            ("POST /api/threads/{id}/read", "POST", f"/api/threads/{thread_id}/read"),
+        ):
+            await client.request(method, path)  # warm the caches
+            with QueryCounter() as counter:
+                await client.request(method, path)
+            counts[route] = counter.count
+    return counts
+
+
+async def drive(joined, duration, rate, readers):
+    port = free_port()
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    server.install_signal_handlers = lambda: None
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    try:
+        active = [u for u, threads in joined.items() if threads]
+        first = active[0]
+        per_route = await queries_per_route(port, first, joined[first][0])
+
+        load = Load(port, joined, rate, duration, clients=len(active))
+        with QueryCounter() as counter:
+            await asyncio.gather(
+                *(load.chatter(u) for u in active),
+                *(load.reader(active[i % len(active)]) for i in range(readers)),
+            )
+            elapsed = time.perf_counter() - load.started
+    finally:
+        server.should_exit = True
+        await serving
+
+    requests = sum(len(samples) for samples in load.rest.values())
+    return {
+        "clients": len(active),
+        "readers": readers,
+        "duration_s": round(elapsed, 2),
+        "messages_sent": load.sent,
+        "deliveries": len(load.latencies),
+        "msgs_per_sec": round(load.sent / elapsed, 2),
+        "deliveries_per_sec": round(len(load.latencies) / elapsed, 2),
+        "delivery": summarize(load.latencies),
+        "rest": {
+            route: {
+                "requests": len(samples),
+                "queries_per_request": per_route[route],
+                **summarize(samples),
+            }
+            for route, samples in load.rest.items()
+        },
+        "rest_errors": load.errors,
+        "connect_errors": load.connect_errors,
+        "queries": counter.count,
+        "queries_per_operation": round(counter.count / max(load.sent + requests, 1), 2),
+    }
+
+
+def run(users, groups, history, duration, rate, readers):
+    with temp_database() as engine:
+        joined = seed(engine, users, groups, history)
+        return asyncio.run(drive(joined, duration, rate, readers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--groups", type=int, nargs="+", default=[10, 5, 3, 2] * 4)
+    parser.add_argument("--history", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--rate", type=float, default=2.0, help="messages/s/client")
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="emit one JSON line")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    row = run(
+        args.users, args.groups, args.history, args.duration, args.rate, args.readers
+    )
+    if args.json:
+        print(json.dumps(row))
+        return
+
+    delivery = row["delivery"]
+    print(
+        f"ws   clients={row['clients']}  sent={row['messages_sent']}"
+        f"  msgs/s={row['msgs_per_sec']}  deliveries/s={row['deliveries_per_sec']}"
+    )
+    print(
+        f"     delivery p50={delivery['p50_ms']:.2f}ms  p95={delivery['p95_ms']:.2f}ms"
+        f"  p99={delivery['p99_ms']:.2f}ms"
+    )
+    for route, stats in row["rest"].items():
+        print(
+            f"{route:<32} n={stats['requests']:>5}  queries={stats['queries_per_request']:>3}"
+            f"  p50={stats['p50_ms']:.2f}ms  p95={stats['p95_ms']:.2f}ms"
+            f"  p99={stats['p99_ms']:.2f}ms"
+        )
+    print(
+        f"queries/operation={row['queries_per_operation']}  "
+        f"rest errors={row['rest_errors']}  connect errors={row['connect_errors']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Login throughput against the size of the password hashing pool.
+
+    python -m benchmarks.bench_login [--workers 0 1 2 4] [--logins 32]
+
+Fires ``--logins`` concurrent POST /api/token requests at the app in-process
+for each pool size (0 = threadpool fallback) and reports logins/sec, latency
+percentiles and how many requests were shed with 503.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from app import hashing
+from benchmarks.common import create_user, summarize, temp_database
+from main import app
+
+
+async def storm(logins):
+    samples, statuses = [], []
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+
+        async def login():
+            start = time.perf_counter()
+            r = await client.post(
+                "/api/token", data={"username": "bench_login", "password": "secret"}
+            )
+            samples.append(time.perf_counter() - start)
+            statuses.append(r.status_code)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - start
+
+    return samples, statuses, elapsed
+
+
+def run(workers, logins, max_pending):
+    pool = hashing.HashingPool(workers=workers, max_pending=max_pending)
+    previous, hashing.pool = hashing.pool, pool
+    try:
+        with temp_database() as engine:
+            create_user(engine, "bench_login")
+            asyncio.run(storm(max(workers, 1)))  # start the worker processes
+            samples, statuses, elapsed = asyncio.run(storm(logins))
+    finally:
+        pool.shutdown()
+        hashing.pool = previous
+
+    ok = statuses.count(200)
+    return {
+        "workers": workers,
+        "logins": logins,
+        "ok": ok,
+        "shed_503": statuses.count(503),
+        "logins_per_sec": round(ok / elapsed, 2),
+        **summarize(samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4])
+    parser.add_argument("--logins", type=int, default=32)
+    parser.add_argument("--max-pending", type=int, default=64)
+    parser.add_argument("--json", action="store_true", help="emit JSON lines")
+    args = parser.parse_args()
+
+    for workers in args.workers:
+        row = run(workers, args.logins, args.max_pending)
+        if args.json:
+            print(json.dumps(row))
+        else:
+            print(
+                f"workers={row['workers']:>2}  ok={row['ok']:>4}"
+                f"  shed={row['shed_503']:>4}  {row['logins_per_sec']:>7.2f} logins/s"
+                f"  p95={row['p95_ms']:.0f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
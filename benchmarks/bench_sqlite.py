@@ -0,0 +1,178 @@
+"""Concurrent reads and writes under each SQLite profile.
+
+    python -m benchmarks.bench_sqlite [--writers 8] [--readers 8] [--duration 5]
+
+``--writers`` tasks post messages the way the app does: check membership,
+insert the message, advance the delivered watermarks, commit. ``--readers``
+tasks meanwhile load a thread page and its member watermarks. Both run for
+``--duration`` seconds through the app's session factory, once with the
+``default`` profile (one engine, rollback journal, a connection per
+session) and once with ``production`` (WAL, one writer connection, a
+read-only pool).
+
+Under ``default`` every session opens its own connection and concurrent
+writers take turns on SQLite's write lock by backing off in its busy
+handler (or give up with "database is locked", counted as errors), which
+shows as a long write tail. Under ``production`` writes queue for the one
+writer connection instead, and readers never wait on the lock. Everything
+shares one event loop, so with many tasks latencies converge on the loop's
+own throughput.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+from app import db, models
+from app.writer import advance_delivered
+from benchmarks.common import create_user, summarize, temp_database
+
+
+def seed(engine, threads, history):
+    user_id = create_user(engine, "bench_sqlite")
+    with engine.begin() as conn:
+        conn.execute(
+            models.ChatThread.__table__.insert(),
+            [
+                {"id": t, "name": f"t{t}", "is_group": True}
+                for t in range(1, threads + 1)
+            ],
+        )
+        conn.execute(
+            models.ThreadMember.__table__.insert(),
+            [{"thread_id": t, "user_id": user_id} for t in range(1, threads + 1)],
+        )
+        conn.execute(
+            models.Message.__table__.insert(),
+            [
+                {"thread_id": t, "sender_id": user_id, "content": f"m{i}"}
+                for t in range(1, threads + 1)
+                for i in range(history)
+            ],
+        )
+    return user_id
+
+
+async def write(user_id, thread_id):
+    async with db.SessionLocal() as session:
+        member = await session.scalar(
+            select(models.ThreadMember.id).filter_by(
+                thread_id=thread_id, user_id=user_id
+            )
+        )
+        assert member is not None
+        msg = models.Message(thread_id=thread_id, sender_id=user_id, content="x")
+        session.add(msg)
+        await session.flush()
+        await session.execute(advance_delivered(thread_id, msg.id))
+        await session.commit()
+
+
+async def read(thread_id):
+    async with db.SessionLocal() as session:
+        result = await session.execute(
+            select(models.Message)
+            .filter(models.Message.thread_id == thread_id)
+            .order_by(models.Message.id.desc())
+            .limit(50)
+        )
+        result.scalars().all()
+        result = await session.execute(
+            select(models.ThreadMember.last_read_message_id).filter_by(
+                thread_id=thread_id
+            )
+        )
+        result.all()
+
+
+async def load(user_id, threads, writers, readers, duration):
+    deadline = time.perf_counter() + duration
+    samples = {"read": [], "write": []}
+    errors = {"read": 0, "write": 0}
+
+    async def worker(kind):
+        while time.perf_counter() < deadline:
+            thread_id = random.randint(1, threads)
+            start = time.perf_counter()
+            try:
+                if kind == "write":
+                    await write(user_id, thread_id)
+                else:
+                    await read(thread_id)
+            except OperationalError:  # database is locked
+                errors[kind] += 1
+                continue
+            samples[kind].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(worker("write") for _ in range(writers)),
+        *(worker("read") for _ in range(readers)),
+    )
+    elapsed = time.perf_counter() - start
+
+    await db.engine.dispose()
+    await db.read_engine.dispose()
+    return samples, errors, elapsed
+
+
+def run(profile, writers, readers, duration, threads, history):
+    with temp_database(profile) as engine:
+        user_id = seed(engine, threads, history)
+        samples, errors, elapsed = asyncio.run(
+            load(user_id, threads, writers, readers, duration)
+        )
+
+    return {
+        "profile": profile,
+        "writes_per_sec": round(len(samples["write"]) / elapsed, 1),
+        "reads_per_sec": round(len(samples["read"]) / elapsed, 1),
+        "write_errors": errors["write"],
+        "read_errors": errors["read"],
+        "write": summarize(samples["write"]),
+        "read": summarize(samples["read"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--threads", type=int, default=20)
+    parser.add_argument("--history", type=int, default=500)
+    parser.add_argument("--json", action="store_true", help="emit JSON lines")
+    args = parser.parse_args()
+
+    for profile in ("default", "production"):
+        row = run(
+            profile,
+            args.writers,
+            args.readers,
+            args.duration,
+            args.threads,
+            args.history,
+        )
+        if args.json:
+            print(json.dumps(row))
+            continue
+        print(
+            f"{row['profile']:<11} writes/s={row['writes_per_sec']:>8}"
+            f"  reads/s={row['reads_per_sec']:>8}"
+            f"  errors w/r={row['write_errors']}/{row['read_errors']}"
+        )
+        for kind in ("write", "read"):
+            stats = row[kind]
+            print(
+                f"  {kind:<5} p50={stats['p50_ms']:.2f}ms  p95={stats['p95_ms']:.2f}ms"
+                f"  p99={stats['p99_ms']:.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
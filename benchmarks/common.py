@@ -0,0 +1,100 @@
+"""Shared helpers for the scripts in ``benchmarks/``.
+
+Each benchmark seeds a throwaway SQLite database, points the app at it and
+drives it through ``TestClient`` so the numbers include routing, auth and
+serialization, not just the SQL.
+"""
+
+import os
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+
+from app import auth, db, migrations, models
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def summarize(samples):
+    return {
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3) if samples else 0.0,
+    }
+
+
+@contextmanager
+def temp_database(profile=None):
+    """Bind the app's session factory to a fresh database file.
+
+    Yields a plain sync engine on the same file for fast bulk seeding; the app
+    itself talks to it through ``db.engine`` (async). ``profile`` overrides
+    SQLITE_PROFILE.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        engine = create_engine(f"sqlite:///{path}")
+        models.Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            migrations.run_migrations(conn)
+
+        previous = db.engine, db.read_engine
+        db.configure(f"sqlite+aiosqlite:///{path}", profile)
+        try:
+            yield engine
+        finally:
+            db.engine, db.read_engine = previous
+            engine.dispose()
+
+
+class QueryCounter:
+    """Counts statements the app sends through its engines."""
+
+    def __init__(self):
+        self.engines = {db.engine.sync_engine, db.read_engine.sync_engine}
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, many):
+        self.count += 1
+
+    def __enter__(self):
+        for engine in self.engines:
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        for engine in self.engines:
+            event.remove(engine, "before_cursor_execute", self._on_execute)
+
+
+def create_user(engine, username, password="secret"):
+    with engine.begin() as conn:
+        result = conn.execute(
+            models.User.__table__.insert().values(
+                username=username, hashed_password=auth.get_password_hash(password)
+            )
+        )
+        return result.inserted_primary_key[0]
+
+
+def bearer(username):
+    return {"Authorization": f"Bearer {auth.create_access_token({'sub': username})}"}
+
+
+def timed(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
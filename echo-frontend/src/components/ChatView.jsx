@@ -12,11 +12,13 @@ export default function ChatView({ threadId, onRead }) {
   const [dragActive, setDragActive] = useState(false);
   const [uploads, setUploads] = useState([]);
   const [showInfo, setShowInfo] = useState(false);
+  const [olderCursor, setOlderCursor] = useState(null);
 
   const wsRef = useRef(null);
   const messagesEndRef = useRef(null);
   const dragCounter = useRef(0);
   const fileInputRef = useRef(null);
+  const loadingOlder = useRef(false);
 
   const token = localStorage.getItem("token");
 
@@ -48,7 +50,9 @@ export default function ChatView({ threadId, onRead }) {
         `${API_BASE}/api/threads/${threadId}/messages`,
         { headers: { Authorization: `Bearer ${token}` } }
       );
-      setMessages(await res.json());
+      const page = await res.json();
+      setMessages(page.messages);
+      setOlderCursor(page.prev_cursor);
     }
 
     loadMe();
@@ -70,15 +74,10 @@ export default function ChatView({ threadId, onRead }) {
       }
 
       if (data.type === "typing") {
-        setTypingUsers((prev) => {
-          const next = { ...prev };
-          if (data.is_typing) {
-            next[data.user_id] = data.username;
-          } else {
-            delete next[data.user_id];
-          }
-          return next;
-        });
+        // the server sends the whole set of typers for the thread
+        setTypingUsers(
+          Object.fromEntries(data.users.map((u) => [u.user_id, u.username]))
+        );
       }
     });
 
@@ -105,11 +104,28 @@ export default function ChatView({ threadId, onRead }) {
   }, [threadId]);
 
   useEffect(() => {
+    // older pages go on top: keep the reader where they were
+    if (loadingOlder.current) {
+      loadingOlder.current = false;
+      return;
+    }
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
   }, [messages]);
 
   /* ---------------- ACTIONS ---------------- */
 
+  const loadOlder = async () => {
+    if (!olderCursor) return;
+    const res = await fetch(
+      `${API_BASE}/api/threads/${threadId}/messages?before_id=${olderCursor}`,
+      { headers: { Authorization: `Bearer ${token}` } }
+    );
+    const page = await res.json();
+    loadingOlder.current = true;
+    setMessages((prev) => [...page.messages, ...prev]);
+    setOlderCursor(page.prev_cursor);
+  };
+
   const sendMessage = () => {
     if (!text.trim()) return;
     wsRef.current?.send(
@@ -254,6 +270,11 @@ export default function ChatView({ threadId, onRead }) {
       {/* <h2 className="thread-title">{displayName}</h2> */}
 
       <div className="messages">
+        {olderCursor && (
+          <button className="load-older" onClick={loadOlder}>
+            Load older messages
+          </button>
+        )}
         {messages.map((m, i) => (
           <div key={i} className={m.system ? "system" : `message ${m.sender === me?.username ? "me" : "other"}`}>
             {!m.system && (
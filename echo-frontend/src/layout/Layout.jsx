@@ -136,6 +136,11 @@ export default function Layout() {
     ws.onmessage = (event) => {
       const data = JSON.parse(event.data);
 
+      if (data.type === "ping") {
+        ws.send(JSON.stringify({ action: "pong" }));
+        return;
+      }
+
       if (data.type === "message" || data.type === "file") {
         // updateSidebarFromMessage(data);
         refreshChats()
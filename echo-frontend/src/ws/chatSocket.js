@@ -4,6 +4,11 @@ export function connectChatSocket(token, onMessage) {
 
     ws.onmessage = (event) => {
         const data = JSON.parse(event.data);
+        if (data.type === "ping") {
+            // server heartbeat: answer so it keeps us marked online
+            ws.send(JSON.stringify({ action: "pong" }));
+            return;
+        }
         onMessage(data);
     };
 
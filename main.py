@@ -3,39 +3,50 @@ from fastapi import (
     WebSocket,
     WebSocketDisconnect,
     Request,
-    UploadFile,
-    File,
     Depends,
     HTTPException,
+    Query,
 )
 
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
+from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv
-from sqlalchemy import func, desc
-from sqlalchemy.orm import Session, joinedload
-from app import db, models, auth, schemas
-from typing import Dict, Set
+from sqlalchemy import and_, or_, func, desc, select, delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, aliased
+from app import db, models, auth, schemas, migrations, hashing, uploads, blobs
+from app import metrics, previews, profiler, search
+from typing import Dict, Optional, Set
+from app.bus import LocalBus, create_bus
+from app.fanout import counters as fanout_counters, fan_out, outbox_stats, release
+from app.file_responses import file_response
+from app.loop_monitor import TaskLabelMiddleware, label_task, loop_monitor
+from app.membership import membership
+from app.presence_registry import PRESENCE_HEARTBEAT, presence_registry
+from app.typing_indicators import TypingAggregator
+from app.writer import advance_delivered, message_writer
 from presence import PresenceManager
 import json
 import asyncio
+import logging
+import time
 import uvicorn
 import os
 import uuid
-import shutil
-import re
-import random
-from pathlib import Path
+from bisect import bisect_left
+from mimetypes import guess_type
 from datetime import datetime
 
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
 
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+os.makedirs(uploads.UPLOAD_DIR, exist_ok=True)
 
 
 app = FastAPI(title=os.getenv("APP_NAME", "Echo"))
@@ -54,75 +65,174 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(profiler.SQLProfilerMiddleware)
+app.add_middleware(TaskLabelMiddleware)
 
 
 # Mount static folder
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Create DB tables (for dev)
-models.Base.metadata.create_all(bind=db.engine)
 
-presence_manager = PresenceManager()
+@app.on_event("startup")
+async def create_tables():
+    # Create DB tables (for dev)
+    async with db.engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+        await conn.run_sync(migrations.run_migrations)
 
 
-def require_thread_admin(session, thread_id: int, user_id: int):
-    thread = session.query(models.ChatThread).filter_by(id=thread_id).first()
-    if not thread:
-        raise HTTPException(404, "Thread not found")
+@app.on_event("startup")
+async def start_event_bus():
+    await bus.start()
 
-    # 🔹 Personal chats have no admins
-    if not thread.is_group:
+
+@app.on_event("startup")
+async def start_presence_heartbeat():
+    app.state.heartbeat = asyncio.create_task(presence_heartbeat())
+
+
+@app.on_event("startup")
+async def start_typing_indicators():
+    app.state.typing = asyncio.create_task(typing_indicators.run())
+
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    app.state.loop_monitor = asyncio.create_task(loop_monitor.run())
+
+
+@app.on_event("startup")
+async def start_upload_sweeper():
+    app.state.upload_sweeper = asyncio.create_task(upload_sweeper())
+
+
+@app.on_event("shutdown")
+async def stop_hashing_pool():
+    hashing.pool.shutdown()
+
+
+@app.on_event("shutdown")
+async def stop_preview_pool():
+    previews.pool.shutdown()
+
+
+@app.on_event("shutdown")
+async def flush_message_writer():
+    await message_writer.close()
+
+
+@app.on_event("shutdown")
+async def stop_event_bus():
+    await bus.close()
+
+
+@app.on_event("shutdown")
+async def stop_presence_heartbeat():
+    app.state.heartbeat.cancel()
+
+
+@app.on_event("shutdown")
+async def stop_typing_indicators():
+    app.state.typing.cancel()
+
+
+@app.on_event("shutdown")
+async def stop_loop_monitor():
+    app.state.loop_monitor.cancel()
+
+
+@app.on_event("shutdown")
+async def stop_upload_sweeper():
+    app.state.upload_sweeper.cancel()
+
+
+# Room, presence and membership events go through the bus so that every
+# worker delivers to the sockets it holds.
+bus = create_bus()
+presence_manager = PresenceManager(bus)
+
+
+async def on_membership_event(event: dict):
+    # another worker changed this thread's members: reload what it touched
+    if event["scope"] != "membership" or event["origin"] == bus.node_id:
         return
+    if event.get("dissolved"):
+        membership.drop_thread(event["thread_id"])
+    else:
+        membership.forget_thread(event["thread_id"])
+    if event.get("user_id") is not None:
+        membership.forget_user(event["user_id"])
 
-    member = (
-        session.query(models.ThreadMember)
-        .filter_by(thread_id=thread_id, user_id=user_id)
-        .first()
+
+bus.subscribe(on_membership_event)
+
+
+async def membership_changed(thread_id: int, user_id=None, dissolved=False):
+    await bus.publish(
+        {
+            "scope": "membership",
+            "thread_id": thread_id,
+            "user_id": user_id,
+            "dissolved": dissolved,
+            "origin": bus.node_id,
+        }
     )
 
-    if not member or not member.is_admin:
-        raise HTTPException(status_code=403, detail="Admin privileges required")
 
+async def get_membership(session: AsyncSession, thread_id: int, user_id: int):
+    result = await session.execute(
+        select(models.ThreadMember).filter_by(thread_id=thread_id, user_id=user_id)
+    )
+    return result.scalars().first()
 
-def safe_filename(original: str) -> str:
-    name = Path(original).stem
-    ext = Path(original).suffix
 
-    # remove weird chars
-    name = re.sub(r"[^a-zA-Z0-9_-]", "_", name)
+async def latest_message_id(session: AsyncSession, thread_id: int):
+    return await session.scalar(
+        select(func.max(models.Message.id)).filter(
+            models.Message.thread_id == thread_id
+        )
+    )
 
-    suffix = random.randint(1000, 9999)
-    return f"{name}_{suffix}{ext}"
+
+async def require_thread_admin(session: AsyncSession, thread_id: int, user_id: int):
+    thread = await session.get(models.ChatThread, thread_id)
+    if not thread:
+        raise HTTPException(404, "Thread not found")
+
+    # 🔹 Personal chats have no admins
+    if not thread.is_group:
+        return
+
+    if not await membership.is_admin(thread_id, user_id, session):
+        raise HTTPException(status_code=403, detail="Admin privileges required")
 
 
 @app.post("/api/register", response_model=schemas.UserOut)
-def register(user: schemas.UserCreate):
-    session = db.SessionLocal()
-    existing = (
-        session.query(models.User).filter(models.User.username == user.username).first()
-    )
+async def register(
+    user: schemas.UserCreate, session: AsyncSession = Depends(db.get_session)
+):
+    existing = await auth.get_user(session, user.username)
     if existing:
-        session.close()
         raise HTTPException(status_code=400, detail="Username already taken")
-    hashed = auth.get_password_hash(user.password)
+    hashed = await hashing.pool.hash(user.password)
     db_user = models.User(
         username=user.username, email=user.email, hashed_password=hashed
     )
     session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
-    session.close()
+    await session.commit()
     return db_user
 
 
 @app.post("/api/token", response_model=schemas.Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    session = db.SessionLocal()
-    user = auth.authenticate_user(session, form_data.username, form_data.password)
+async def login_for_access_token(
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    session: AsyncSession = Depends(db.get_session),
+):
+    user = await auth.authenticate_user(session, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
     access_token = auth.create_access_token(data={"sub": user.username})
-    session.close()
     return {"access_token": access_token, "token_type": "bearer"}
 
 
@@ -184,8 +294,10 @@ async def websocket_endpoint(websocket: WebSocket):
 
 
 class ThreadConnectionManager:
-    def __init__(self):
+    def __init__(self, bus=None):
         self.rooms: Dict[int, Set[WebSocket]] = {}
+        self.bus = bus or LocalBus()
+        self.bus.subscribe(self._on_event)
 
     async def connect(self, thread_id: int, websocket: WebSocket):
         self.rooms.setdefault(thread_id, set()).add(websocket)
@@ -197,25 +309,178 @@ class ThreadConnectionManager:
                 del self.rooms[thread_id]
 
     async def broadcast(self, thread_id: int, message: dict):
-        dead_sockets = []
+        # encode once; every worker queues it for its own sockets in the room
+        await self.bus.publish(
+            {
+                "scope": "room",
+                "thread_id": thread_id,
+                "text": json.dumps(message),
+                "kind": message.get("type"),
+                "key": message.get("user_id"),
+            }
+        )
+
+    async def _on_event(self, event: dict):
+        if event["scope"] == "room":
+            self.deliver(
+                event["thread_id"], event["text"], event.get("kind"), event.get("key")
+            )
 
-        for ws in self.rooms.get(thread_id, []):
-            try:
-                await ws.send_text(json.dumps(message))
-            except RuntimeError:
-                dead_sockets.append(ws)
+    def deliver(self, thread_id: int, text: str, kind=None, key=None):
+        sockets = self.rooms.get(thread_id, ())
+        with metrics.fanout_seconds.labels("room").time():
+            dead_sockets = fan_out(sockets, text, kind, key)
+        metrics.fanout_recipients.labels("room").inc(len(sockets))
 
         for ws in dead_sockets:
             self.disconnect(thread_id, ws)
 
 
-thread_manager = ThreadConnectionManager()
+thread_manager = ThreadConnectionManager(bus)
+
+typing_indicators = TypingAggregator(
+    bus,
+    lambda thread_id, message: thread_manager.deliver(
+        thread_id, json.dumps(message), "typing"
+    ),
+)
 
 
 async def broadcast_global(message: dict):
-    for sockets in presence_manager.online_users.values():
-        for ws in sockets:
-            await ws.send_text(json.dumps(message))
+    await presence_manager.broadcast(message)
+
+
+# Views of state the managers already keep, computed only when scraped
+metrics.Gauge(
+    "ws_connections",
+    "Open /ws/chat sockets on this worker.",
+    collect=lambda: {(): sum(map(len, presence_manager.online_users.values()))},
+)
+# aggregates only: a thread_id label would grow a series per room ever
+# joined; /api/ws-stats has the per-room breakdown
+metrics.Gauge(
+    "ws_rooms",
+    "Threads with at least one joined socket on this worker.",
+    collect=lambda: {(): len(thread_manager.rooms)},
+)
+metrics.Gauge(
+    "ws_room_connections",
+    "Room memberships of open sockets on this worker, summed over threads.",
+    collect=lambda: {(): sum(map(len, thread_manager.rooms.values()))},
+)
+metrics.Gauge(
+    "ws_room_max_connections",
+    "Sockets joined to the busiest thread on this worker.",
+    collect=lambda: {(): max(map(len, thread_manager.rooms.values()), default=0)},
+)
+metrics.Gauge(
+    "ws_outbox_queued_frames",
+    "Frames waiting in outbound socket queues.",
+    collect=lambda: {(): outbox_stats()["queued"]},
+)
+metrics.Counter(
+    "ws_outbox_events_total",
+    "Frames sent, dropped or coalesced, and sockets evicted, by outbound queues.",
+    ["event"],
+    collect=lambda: {(k,): v for k, v in fanout_counters.items()},
+)
+metrics.Counter(
+    "bus_events_total",
+    "Events published to and received from the event bus.",
+    ["direction"],
+    collect=lambda: {("published",): bus.published, ("received",): bus.received},
+)
+metrics.Counter(
+    "message_writer_batches_total",
+    "Group commits done by the message writer.",
+    collect=lambda: {(): message_writer.batches},
+)
+metrics.Counter(
+    "message_writer_messages_total",
+    "Messages stored by the message writer.",
+    collect=lambda: {(): message_writer.messages},
+)
+metrics.Gauge(
+    "membership_index_threads",
+    "Threads whose members are held in the membership index.",
+    collect=lambda: {(): membership.stats()["threads"]},
+)
+metrics.Counter(
+    "membership_index_lookups_total",
+    "Membership lookups answered from the index (hit) or the database (miss).",
+    ["result"],
+    collect=lambda: {("hit",): membership.hits, ("miss",): membership.misses},
+)
+metrics.Gauge(
+    "auth_user_cache_entries",
+    "Tokens whose user is cached.",
+    collect=lambda: {(): auth.user_cache.stats()["size"]},
+)
+metrics.Counter(
+    "auth_user_cache_lookups_total",
+    "Token lookups answered from the user cache (hit) or the database (miss).",
+    ["result"],
+    collect=lambda: {
+        ("hit",): auth.user_cache.hits,
+        ("miss",): auth.user_cache.misses,
+    },
+)
+metrics.Gauge(
+    "password_hash_pending",
+    "Password hashes and checks in flight in the hashing pool.",
+    collect=lambda: {(): hashing.pool.pending},
+)
+metrics.Counter(
+    "password_hash_rejected_total",
+    "Password hashes and checks refused with 503 because the pool was full.",
+    collect=lambda: {(): hashing.pool.rejected},
+)
+
+
+PING = json.dumps({"type": "ping"})
+WS_ACTIONS = ("join", "message", "typing_start", "typing_stop", "pong")
+
+
+async def presence_heartbeat():
+    # Ping this worker's sockets (clients answer with a "pong" action, which
+    # keeps their receive loop alive), keep their presence rows fresh, and
+    # announce users whose rows ran out, e.g. after a worker crashed.
+    while True:
+        await asyncio.sleep(PRESENCE_HEARTBEAT)
+        try:
+            presence_manager.deliver(presence_manager.list_online_users(), PING)
+            await presence_registry.refresh()
+            for user_id, username in await presence_registry.expire():
+                await broadcast_global(
+                    {
+                        "type": "presence",
+                        "user_id": user_id,
+                        "username": username,
+                        "status": "offline",
+                    }
+                )
+        except Exception:
+            logger.exception("presence heartbeat failed")
+
+
+async def upload_sweeper():
+    # resumable uploads the client never completed, and partial files left
+    # behind by interrupted uploads
+    while True:
+        await asyncio.sleep(uploads.UPLOAD_SWEEP_INTERVAL)
+        try:
+            removed = await uploads.sweep()
+            if removed:
+                logger.info("removed %d abandoned upload files", removed)
+        except Exception:
+            logger.exception("upload sweep failed")
+
+
+async def notify_members(thread_id: int, message: dict, member_ids=None):
+    """Send a sidebar notification to the thread's online members only."""
+    if member_ids is None:
+        member_ids = list(await membership.members(thread_id))
+    await presence_manager.send_to_users(member_ids, message)
 
 
 @app.websocket("/ws/chat")
@@ -229,7 +494,8 @@ async def chat_socket(websocket: WebSocket):
     await websocket.accept()
 
     try:
-        is_first = presence_manager.connect(user.id, websocket)
+        presence_manager.connect(user.id, websocket)
+        conn_id, is_first = await presence_registry.connect(user.id)
         if is_first:
             await broadcast_global(
                 {
@@ -247,7 +513,15 @@ async def chat_socket(websocket: WebSocket):
 
     try:
         while True:
-            data = json.loads(await websocket.receive_text())
+            # nothing at all (not even a pong) for a full TTL: the client is
+            # gone even if the TCP connection never said so
+            text = await asyncio.wait_for(
+                websocket.receive_text(), presence_registry.ttl
+            )
+            data = json.loads(text)
+            started = time.perf_counter()
+            profile = profiler.begin(f"ws {data['action']}")
+            label_task(f"ws {data['action']}")
 
             if data["action"] == "join":
                 thread_id = data["thread_id"]
@@ -263,43 +537,22 @@ async def chat_socket(websocket: WebSocket):
                 thread_id = data["thread_id"]
                 content = data["content"]
 
-                session = db.SessionLocal()
-                msg = models.Message(
+                # Stored together with the receipts in the writer's next
+                # group commit; resolves once that batch is durable.
+                msg = await message_writer.submit(
                     thread_id=thread_id,
                     sender_id=user.id,
                     content=content,
                     reply_to_id=data.get("reply_to_id"),
                     forward_from_id=data.get("forward_from_id"),
                 )
-                session.add(msg)
-                session.commit()
-                session.refresh(msg)
-
-                msg_id = msg.id
-                msg_content = msg.content
-                reply_to_id = msg.reply_to_id
-                forward_from_id = msg.forward_from_id
-                user_username = user.username
-                created_at = (msg.created_at.isoformat(),)
-
-                members = (
-                    session.query(models.ThreadMember)
-                    .filter(models.ThreadMember.thread_id == thread_id)
-                    .all()
-                )
 
-                for m in members:
-                    if m.user_id != user.id:
-                        session.add(
-                            models.MessageReceipt(
-                                message_id=msg.id,
-                                user_id=m.user_id,
-                                delivered_at=datetime.utcnow(),
-                            )
-                        )
-
-                session.commit()
-                session.close()
+                msg_id = msg["id"]
+                msg_content = msg["content"]
+                reply_to_id = msg["reply_to_id"]
+                forward_from_id = msg["forward_from_id"]
+                user_username = user.username
+                created_at = (msg["created_at"].isoformat(),)
 
                 await thread_manager.broadcast(
                     thread_id,
@@ -315,44 +568,44 @@ async def chat_socket(websocket: WebSocket):
                     },
                 )
 
-                await broadcast_global(
+                await notify_members(
+                    thread_id,
                     {
                         "type": "message",
                         "thread_id": thread_id,
-                    }
+                    },
                 )
+                await typing_indicators.stop_typing(thread_id, user.id)
 
             elif data["action"] == "typing_start":
-                thread_id = data["thread_id"]
-
-                await thread_manager.broadcast(
-                    thread_id,
-                    {
-                        "type": "typing",
-                        "thread_id": thread_id,
-                        "user_id": user.id,
-                        "username": user.username,
-                        "is_typing": True,
-                    },
+                # combined per thread and sent on the aggregator's tick
+                await typing_indicators.start_typing(
+                    data["thread_id"], user.id, user.username
                 )
 
             elif data["action"] == "typing_stop":
-                thread_id = data["thread_id"]
+                await typing_indicators.stop_typing(data["thread_id"], user.id)
 
-                await thread_manager.broadcast(
-                    thread_id,
-                    {
-                        "type": "typing",
-                        "thread_id": thread_id,
-                        "user_id": user.id,
-                        "username": user.username,
-                        "is_typing": False,
-                    },
-                )
+            action = data["action"] if data["action"] in WS_ACTIONS else "other"
+            metrics.ws_actions.labels(action).observe(time.perf_counter() - started)
+            profiler.end(profile)
 
+    except asyncio.TimeoutError:
+        try:
+            await websocket.close(code=1001)
+        except Exception:
+            pass
     except WebSocketDisconnect:
-        is_offline = presence_manager.disconnect(user.id, websocket)
+        pass
+    finally:
+        # however the loop ended (client gone, bad frame, failed write), the
+        # socket must leave every structure that would keep it "online"
+        presence_manager.disconnect(user.id, websocket)
+        for tid in joined_threads:
+            thread_manager.disconnect(tid, websocket)
+        release(websocket)
 
+        is_offline = await presence_registry.disconnect(conn_id, user.id)
         if is_offline:
             await broadcast_global(
                 {
@@ -363,28 +616,28 @@ async def chat_socket(websocket: WebSocket):
                 }
             )
 
-        print(f"User {user.username} went offline")
+        logger.info("user %s went offline", user.username)
         for tid in joined_threads:
-            thread_manager.disconnect(tid, websocket)
+            await typing_indicators.stop_typing(tid, user.id)
 
 
 @app.get("/")
 async def get_index(request: Request):
-    html = open("static/index.html", "r").read()
-    return HTMLResponse(html)
+    # read in the threadpool, not on the event loop
+    return FileResponse("static/index.html", media_type="text/html")
 
 
 @app.post("/api/threads")
 async def create_thread(
-    data: schemas.CreateThread, user=Depends(auth.get_current_user)
+    data: schemas.CreateThread,
+    user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
 ):
-    session = db.SessionLocal()
     thread = models.ChatThread(
         name=data.name, is_group=data.is_group, created_by=user.id
     )
     session.add(thread)
-    session.commit()
-    session.refresh(thread)
+    await session.flush()
     admin_status = False
     if data.is_group:
         admin_status = True
@@ -393,17 +646,21 @@ async def create_thread(
         thread_id=thread.id, user_id=user.id, is_admin=admin_status
     )
     session.add(member)
-    session.commit()
+    await session.commit()
+    membership.add_thread(thread.id, user.id, admin_status)
+    await membership_changed(thread.id, user.id)
 
     return {"id": thread.id, "name": thread.name}
 
 
 @app.get("/api/threads/personal/{user_id}")
-async def get_personal_thread(user_id: int, user=Depends(auth.get_current_user)):
-    session = db.SessionLocal()
-
-    thread = (
-        session.query(models.ChatThread)
+async def get_personal_thread(
+    user_id: int,
+    user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
+):
+    result = await session.execute(
+        select(models.ChatThread)
         .join(models.ThreadMember)
         .filter(
             models.ChatThread.is_group == False,
@@ -411,10 +668,8 @@ async def get_personal_thread(user_id: int, user=Depends(auth.get_current_user))
         )
         .group_by(models.ChatThread.id)
         .having(func.count(models.ThreadMember.id) == 2)
-        .first()
     )
-
-    session.close()
+    thread = result.scalars().first()
 
     if not thread:
         return None
@@ -423,36 +678,29 @@ async def get_personal_thread(user_id: int, user=Depends(auth.get_current_user))
 
 
 @app.post("/api/threads/{thread_id}/read")
-async def mark_thread_read(thread_id: int, user=Depends(auth.get_current_user)):
-    session = db.SessionLocal()
-
+async def mark_thread_read(
+    thread_id: int,
+    user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
+):
     # ensure membership
-    member = (
-        session.query(models.ThreadMember)
-        .filter_by(thread_id=thread_id, user_id=user.id)
-        .first()
-    )
-    if not member:
-        session.close()
+    if not await membership.is_member(thread_id, user.id, session):
         raise HTTPException(403, "Not a thread member")
 
-    # mark all delivered messages as read
-    receipts = (
-        session.query(models.MessageReceipt)
-        .join(models.Message)
-        .filter(
-            models.Message.thread_id == thread_id,
-            models.MessageReceipt.user_id == user.id,
-            models.MessageReceipt.read_at.is_(None),
-        )
-        .all()
-    )
+    # mark everything up to the newest message as read
+    last_id = await latest_message_id(session, thread_id)
+    if last_id is not None:
+        for column in ("last_read_message_id", "last_delivered_message_id"):
+            mark = getattr(models.ThreadMember, column)
+            await session.execute(
+                update(models.ThreadMember)
+                .filter_by(thread_id=thread_id, user_id=user.id)
+                .filter(or_(mark.is_(None), mark < last_id))
+                .values({column: last_id})
+            )
 
     now = datetime.utcnow()
-    for r in receipts:
-        r.read_at = now
-
-    session.commit()
+    await session.commit()
 
     # Broadcast read receipt asynchronously
     asyncio.create_task(
@@ -464,63 +712,63 @@ async def mark_thread_read(thread_id: int, user=Depends(auth.get_current_user)):
                 "user_id": user.id,
                 "username": user.username,
                 "read_at": now.isoformat(),
+                "last_read_message_id": last_id,
             },
         )
     )
 
-    session.close()
-
     return {"status": "ok"}
 
 
 @app.post("/api/threads/{thread_id}/members")
 async def add_member(
-    thread_id: int, data: schemas.AddMember, user=Depends(auth.get_current_user)
+    thread_id: int,
+    data: schemas.AddMember,
+    user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
 ):
-    session = db.SessionLocal()
-    existing = (
-        session.query(models.ThreadMember)
-        .filter_by(thread_id=thread_id, user_id=data.user_id)
-        .first()
-    )
-
-    if existing:
+    if await membership.is_member(thread_id, data.user_id, session):
         return {"error": "User already in thread"}
 
+    # New members start caught up; history from before they joined is not
+    # counted as unread for them.
+    head = await latest_message_id(session, thread_id)
     m = models.ThreadMember(
-        thread_id=thread_id, user_id=data.user_id, is_admin=data.is_admin
+        thread_id=thread_id,
+        user_id=data.user_id,
+        is_admin=data.is_admin,
+        last_read_message_id=head,
+        last_delivered_message_id=head,
     )
     session.add(m)
-    session.commit()
-    await presence_manager.send_to_user(
-        data.user_id,
+    await session.commit()
+    membership.add_member(thread_id, data.user_id, data.is_admin)
+    await membership_changed(thread_id, data.user_id)
+    # existing members refresh their sidebar, the new one gets the thread
+    await notify_members(
+        thread_id,
         {
             "type": "thread_added",
             "thread_id": thread_id,
         },
     )
 
-    await broadcast_global(
-        {
-            "type": "thread_added",
-            "thread_id": thread_id,
-        }
-    )
-
-    session.close()
     return {"status": "added"}
 
 
 @app.get("/api/threads/{thread_id}/members")
-async def get_thread_members(thread_id: int, user=Depends(auth.get_current_user)):
-    session = db.SessionLocal()
-
-    members = (
-        session.query(models.ThreadMember)
+async def get_thread_members(
+    thread_id: int,
+    user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
+):
+    result = await session.execute(
+        select(models.ThreadMember)
         .join(models.User)
+        .options(joinedload(models.ThreadMember.user))
         .filter(models.ThreadMember.thread_id == thread_id)
-        .all()
     )
+    members = result.scalars().all()
 
     return [
         {"user_id": m.user_id, "username": m.user.username, "is_admin": m.is_admin}
@@ -529,37 +777,32 @@ async def get_thread_members(thread_id: int, user=Depends(auth.get_current_user)
 
 
 @app.post("/api/threads/{thread_id}/leave")
-async def leave_thread(thread_id: int, user=Depends(auth.get_current_user)):
-    session = db.SessionLocal()
-
-    member = (
-        session.query(models.ThreadMember)
-        .filter_by(thread_id=thread_id, user_id=user.id)
-        .first()
-    )
+async def leave_thread(
+    thread_id: int,
+    user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
+):
+    members = await membership.members(thread_id, session)
 
-    if not member:
-        session.close()
+    if user.id not in members:
         raise HTTPException(404, "Not a member of this thread")
 
-    thread = session.query(models.ChatThread).filter_by(id=thread_id).first()
+    thread = await session.get(models.ChatThread, thread_id)
 
     # 🔐 Group safety
-    if thread.is_group and member.is_admin:
-        admin_count = (
-            session.query(models.ThreadMember)
-            .filter_by(thread_id=thread_id, is_admin=True)
-            .count()
-        )
+    if thread.is_group and members[user.id]:
+        admin_count = sum(1 for is_admin in members.values() if is_admin)
 
         if admin_count == 1:
-            session.close()
             raise HTTPException(400, "You are the only admin. Promote someone first.")
 
-    username = member.user.username
-    session.delete(member)
-    session.commit()
-    session.close()
+    username = user.username
+    await session.execute(
+        delete(models.ThreadMember).filter_by(thread_id=thread_id, user_id=user.id)
+    )
+    await session.commit()
+    membership.remove_member(thread_id, user.id)
+    await membership_changed(thread_id, user.id)
 
     await thread_manager.broadcast(
         thread_id,
@@ -569,35 +812,39 @@ async def leave_thread(thread_id: int, user=Depends(auth.get_current_user)):
     return {"status": "left thread"}
 
 
+async def get_member_with_user(session: AsyncSession, thread_id: int, user_id: int):
+    result = await session.execute(
+        select(models.ThreadMember)
+        .options(joinedload(models.ThreadMember.user))
+        .filter_by(thread_id=thread_id, user_id=user_id)
+    )
+    return result.scalars().first()
+
+
 @app.post("/api/threads/{thread_id}/remove")
 async def remove_member(
     thread_id: int,
     data: schemas.RemoveMember,
     user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
 ):
-    session = db.SessionLocal()
-    thread = session.query(models.ChatThread).filter_by(id=thread_id).first()
+    thread = await session.get(models.ChatThread, thread_id)
     if not thread.is_group:
-        session.close()
         raise HTTPException(400, "Not a group thread")
 
-    require_thread_admin(session, thread_id, user.id)
+    await require_thread_admin(session, thread_id, user.id)
 
-    member = (
-        session.query(models.ThreadMember)
-        .filter_by(thread_id=thread_id, user_id=data.user_id)
-        .first()
-    )
+    member = await get_member_with_user(session, thread_id, data.user_id)
 
     if not member:
-        session.close()
         raise HTTPException(404, "User not in thread")
 
     target = member.user.username
 
-    session.delete(member)
-    session.commit()
-    session.close()
+    await session.delete(member)
+    await session.commit()
+    membership.remove_member(thread_id, data.user_id)
+    await membership_changed(thread_id, data.user_id)
     await thread_manager.broadcast(
         thread_id,
         {
@@ -616,29 +863,24 @@ async def promote_member(
     thread_id: int,
     data: schemas.PromoteMember,
     user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
 ):
-    session = db.SessionLocal()
-    thread = session.query(models.ChatThread).filter_by(id=thread_id).first()
+    thread = await session.get(models.ChatThread, thread_id)
     if not thread.is_group:
-        session.close()
         raise HTTPException(400, "Not a group thread")
-    require_thread_admin(session, thread_id, user.id)
+    await require_thread_admin(session, thread_id, user.id)
 
-    member = (
-        session.query(models.ThreadMember)
-        .filter_by(thread_id=thread_id, user_id=data.user_id)
-        .first()
-    )
+    member = await get_member_with_user(session, thread_id, data.user_id)
 
     if not member:
-        session.close()
         raise HTTPException(404, "User not found")
 
     member.is_admin = True
 
     target = member.user.username
-    session.commit()
-    session.close()
+    await session.commit()
+    membership.set_admin(thread_id, data.user_id, True)
+    await membership_changed(thread_id)
     await thread_manager.broadcast(
         thread_id,
         {
@@ -657,29 +899,24 @@ async def demote_member(
     thread_id: int,
     data: schemas.DemoteMember,
     user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
 ):
-    session = db.SessionLocal()
-    thread = session.query(models.ChatThread).filter_by(id=thread_id).first()
+    thread = await session.get(models.ChatThread, thread_id)
     if not thread.is_group:
-        session.close()
         raise HTTPException(400, "Not a group thread")
-    require_thread_admin(session, thread_id, user.id)
+    await require_thread_admin(session, thread_id, user.id)
 
-    member = (
-        session.query(models.ThreadMember)
-        .filter_by(thread_id=thread_id, user_id=data.user_id)
-        .first()
-    )
+    member = await get_member_with_user(session, thread_id, data.user_id)
 
     if not member or not member.is_admin:
-        session.close()
         raise HTTPException(400, "User is not an admin")
 
     member.is_admin = False
 
     target = member.user.username
-    session.commit()
-    session.close()
+    await session.commit()
+    membership.set_admin(thread_id, data.user_id, False)
+    await membership_changed(thread_id)
     await thread_manager.broadcast(
         thread_id,
         {
@@ -697,66 +934,73 @@ async def demote_member(
 async def dissolve_thread(
     thread_id: int,
     user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
 ):
-    session = db.SessionLocal()
-
-    thread = session.query(models.ChatThread).filter_by(id=thread_id).first()
+    thread = await session.get(models.ChatThread, thread_id)
 
     if not thread:
-        session.close()
         raise HTTPException(404, "Thread not found")
 
     if not thread.is_group:
-        session.close()
         raise HTTPException(400, "Not a group thread")
 
     # ✅ Only admins can dissolve
-    require_thread_admin(session, thread_id, user.id)
+    await require_thread_admin(session, thread_id, user.id)
 
     # Collect members BEFORE deletion (for WS broadcast)
-    members = session.query(models.ThreadMember).filter_by(thread_id=thread_id).all()
+    member_ids = list(await membership.members(thread_id, session))
 
-    member_ids = [m.user_id for m in members]
+    # Files the thread's messages point at, released once they are gone
+    result = await session.execute(
+        select(models.Message.file_hash, func.count())
+        .filter(
+            models.Message.thread_id == thread_id, models.Message.file_hash.isnot(None)
+        )
+        .group_by(models.Message.file_hash)
+    )
+    file_refs = dict(result.all())
 
     # 🧹 Delete messages
-    session.query(models.Message).filter_by(thread_id=thread_id).delete()
+    await search.remove_thread(session, thread_id)
+    await session.execute(
+        delete(models.Message).where(models.Message.thread_id == thread_id)
+    )
+    garbage = await blobs.release_refs(session, file_refs)
 
     # 🧹 Delete members
-    session.query(models.ThreadMember).filter_by(thread_id=thread_id).delete()
+    await session.execute(
+        delete(models.ThreadMember).where(models.ThreadMember.thread_id == thread_id)
+    )
 
     # 🧹 Delete thread
-    session.delete(thread)
+    await session.delete(thread)
 
-    session.commit()
-    session.close()
+    await session.commit()
+    membership.drop_thread(thread_id)
+    await membership_changed(thread_id, dissolved=True)
+    await blobs.collect(garbage)
 
     # 🔔 Notify all members
-    # for uid in member_ids:
-    #     await thread_manager.send_to_user(
-    #         uid,
-    #         {
-    #             "system": True,
-    #             "type": "thread_removed",
-    #             "thread_id": thread_id,
-    #             "message": "This group has been dissolved by an admin",
-    #         },
-    #     )
-
-    await broadcast_global(
+    await notify_members(
+        thread_id,
         {
             "system": True,
             "type": "thread_removed",
             "thread_id": thread_id,
             "message": "This group has been dissolved by an admin",
-        }
+        },
+        member_ids=member_ids,
     )
 
     return {"status": "dissolved"}
 
 
 @app.post("/api/messages")
-async def send_message(data: schemas.SendMessage, user=Depends(auth.get_current_user)):
-    session = db.SessionLocal()
+async def send_message(
+    data: schemas.SendMessage,
+    user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
+):
     msg = models.Message(
         thread_id=data.thread_id,
         sender_id=user.id,
@@ -764,52 +1008,95 @@ async def send_message(data: schemas.SendMessage, user=Depends(auth.get_current_
         reply_to_id=data.reply_to_id,
         forward_from_id=data.forward_from_id,
     )
+
+    # Forwarding a file shares the stored blob instead of copying it
+    if data.forward_from_id:
+        original = await session.get(models.Message, data.forward_from_id)
+        if original and original.file_hash:
+            msg.file_path = original.file_path
+            msg.file_name = original.file_name
+            msg.file_size = original.file_size
+            msg.file_hash = original.file_hash
+            await blobs.add_ref(session, original.file_hash, original.file_size)
+
     session.add(msg)
-    session.commit()
-    session.refresh(msg)
+    await session.flush()
+    await session.execute(advance_delivered(msg.thread_id, msg.id))
+    body = search.message_text(msg.content, msg.file_name)
+    await search.index_messages(session, [(msg.id, msg.thread_id, body)])
+    await session.commit()
     return {"id": msg.id, "content": msg.content}
 
 
-@app.get("/api/online-users")
-def get_online_users(current_user=Depends(auth.get_current_user)):
-    session = db.SessionLocal()
+@app.get("/api/ws-stats")
+async def get_ws_stats(current_user=Depends(auth.get_current_user)):
+    # outbound queue depth and overflow counters for this worker, plus how
+    # many sockets have joined each thread
+    return {
+        **outbox_stats(),
+        "rooms": {t: len(s) for t, s in thread_manager.rooms.items()},
+    }
+
 
-    users = (
-        session.query(models.User)
-        # .filter(models.User.id.in_(presence_manager.list_online_users()))
-        .all()
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    # Prometheus text format; unauthenticated like any scrape target, so keep
+    # it off the public listener
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
     )
 
-    session.close()
 
-    return [{"id": u.id, "username": u.username} for u in users]
+@app.get("/api/diagnostics/loop")
+async def get_loop_diagnostics(current_user=Depends(auth.get_current_user)):
+    # event-loop lag percentiles and the stacks of recent stalls, this worker
+    return loop_monitor.stats()
 
 
-@app.post("/api/threads/{thread_id}/upload")
-async def upload_file(
-    thread_id: int, file: UploadFile = File(...), user=Depends(auth.get_current_user)
+@app.get("/api/online-users")
+async def get_online_users(
+    current_user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
 ):
-    session = db.SessionLocal()
+    result = await session.execute(
+        select(models.User).filter(
+            models.User.id.in_(presence_registry.online_user_ids())
+        )
+    )
+    users = result.scalars().all()
 
-    filename = safe_filename(file.filename)
-    file_path = os.path.join(UPLOAD_DIR, filename)
+    return [{"id": u.id, "username": u.username} for u in users]
 
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
 
-    file_size = os.path.getsize(file_path)
+async def save_file_message(
+    session: AsyncSession,
+    thread_id: int,
+    user,
+    temp_path: str,
+    name: str,
+    size: int,
+    digest: str,
+):
+    """Post a fully received upload to the thread, storing it by content."""
     msg = models.Message(
         thread_id=thread_id,
         sender_id=user.id,
-        file_path=file_path,
-        file_name=file.filename,
-        file_size=file_size,
+        file_path=blobs.blob_path(digest),
+        file_name=name,
+        file_size=size,
+        file_hash=digest,
     )
 
+    await blobs.add_ref(session, digest, size)
     session.add(msg)
-    session.commit()
-    session.refresh(msg)
-    session.close()
+    await session.flush()
+    await session.execute(advance_delivered(thread_id, msg.id))
+    await search.index_messages(session, [(msg.id, thread_id, name)])
+    await session.commit()
+    await blobs.put(temp_path, digest)
+    # thumbnails are made in the background; previews fall back to the
+    # original until they exist
+    previews.pool.schedule(digest, name)
 
     # 🔥 BROADCAST FILE MESSAGE HERE
     await thread_manager.broadcast(
@@ -828,40 +1115,188 @@ async def upload_file(
     return {"id": msg.id, "file_url": f"/api/files/{msg.id}"}
 
 
-@app.get("/api/files/{message_id}")
-def get_file(message_id: int, user=Depends(auth.get_current_user)):
-    session = db.SessionLocal()
+@app.post("/api/threads/{thread_id}/upload")
+async def upload_file(
+    thread_id: int,
+    request: Request,
+    user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
+):
+    # The multipart body is parsed as it arrives and written to disk off the
+    # event loop, up to UPLOAD_MAX_BYTES; it is never spooled as a whole.
+    sink, file_name = await uploads.receive_form_file(request)
+    return await save_file_message(
+        session, thread_id, user, sink.path, file_name, sink.size, sink.sha256
+    )
+
+
+# Resumable uploads: start one, PUT the bytes in any number of chunks at the
+# offset the server reports, then complete it to post the file.
+
+
+@app.post("/api/uploads")
+async def start_upload(
+    data: schemas.StartUpload,
+    user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
+):
+    if not await membership.is_member(data.thread_id, user.id, session):
+        raise HTTPException(403, "Not a member of this thread")
+    if data.file_size < 0 or data.file_size > uploads.UPLOAD_MAX_BYTES:
+        raise HTTPException(413, "File too large")
+
+    upload = models.Upload(
+        id=uuid.uuid4().hex,
+        user_id=user.id,
+        thread_id=data.thread_id,
+        file_name=data.file_name,
+        file_size=data.file_size,
+    )
+    session.add(upload)
+    await session.commit()
+
+    return {"upload_id": upload.id, "offset": 0, "file_size": upload.file_size}
+
+
+async def get_upload(session: AsyncSession, upload_id: str, user_id: int):
+    upload = await session.get(models.Upload, upload_id)
+    if not upload or upload.user_id != user_id:
+        raise HTTPException(404, "Upload not found")
+    return upload
+
+
+def stored_bytes(upload_id: str):
+    path = uploads.partial_path(upload_id)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+@app.get("/api/uploads/{upload_id}")
+async def get_upload_status(
+    upload_id: str,
+    user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
+):
+    upload = await get_upload(session, upload_id, user.id)
+    offset = await run_in_threadpool(stored_bytes, upload_id)
+    return {"upload_id": upload.id, "offset": offset, "file_size": upload.file_size}
+
+
+@app.put("/api/uploads/{upload_id}")
+async def put_upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
+):
+    upload = await get_upload(session, upload_id, user.id)
+    # give the read connection back before the body streams in
+    await session.close()
+    stored = await uploads.receive_chunk(request, upload_id, offset, upload.file_size)
+    return {"upload_id": upload.id, "offset": stored, "file_size": upload.file_size}
+
 
-    msg = session.query(models.Message).filter(models.Message.id == message_id).first()
+@app.post("/api/uploads/{upload_id}/complete")
+async def complete_upload(
+    upload_id: str,
+    user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
+):
+    upload = await get_upload(session, upload_id, user.id)
+    # not holding a read connection while the file is hashed
+    await session.close()
+    # no chunk can land between the size check and the move into the store
+    async with uploads.locked_partial(upload_id) as stored:
+        if stored != upload.file_size:
+            raise HTTPException(409, f"Upload incomplete: {stored}/{upload.file_size}")
+
+        path = uploads.partial_path(upload_id)
+        digest = await run_in_threadpool(blobs.file_sha256, path)
+
+        await session.execute(delete(models.Upload).filter_by(id=upload.id))
+        return await save_file_message(
+            session,
+            upload.thread_id,
+            user,
+            path,
+            upload.file_name,
+            upload.file_size,
+            digest,
+        )
+
+
+def stored_file(msg: models.Message):
+    """Path and ETag of a message's file.
+
+    By content hash; older uploads predate the blob store and are keyed by
+    message id, which is just as immutable.
+    """
+    if msg.file_hash:
+        return blobs.blob_path(msg.file_hash), msg.file_hash
+    return msg.file_path, f"message-{msg.id}"
+
+
+@app.get("/api/files/{message_id}")
+async def get_file(
+    message_id: int,
+    request: Request,
+    user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
+):
+    msg = await session.get(models.Message, message_id)
+    # the request's session lives until the response is fully sent; a slow
+    # download must not keep a pooled read connection for all that time
+    await session.close()
 
     if not msg or not msg.file_path:
-        session.close()
         raise HTTPException(status_code=404, detail="File not found")
 
-    session.close()
-
-    return FileResponse(msg.file_path, filename=os.path.basename(msg.file_path))
+    path, etag = stored_file(msg)
+    return await file_response(request, path, etag, filename=msg.file_name)
 
 
 @app.get("/api/files/{message_id}/preview")
-def preview_file(message_id: int):
-    session = db.SessionLocal()
-    msg = session.query(models.Message).filter(models.Message.id == message_id).first()
+async def preview_file(
+    message_id: int,
+    request: Request,
+    size: int = Query(320, ge=1),
+    session: AsyncSession = Depends(db.get_session),
+):
+    msg = await session.get(models.Message, message_id)
+    await session.close()  # see get_file
 
     if not msg or not msg.file_path:
-        session.close()
         raise HTTPException(404, "File not found")
 
-    session.close()
+    if msg.file_hash:
+        best = await run_in_threadpool(previews.pool.best_size, msg.file_hash, size)
+        if best is not None:
+            return await file_response(
+                request,
+                previews.preview_path(msg.file_hash, best),
+                f"{msg.file_hash}-{best}",
+                media_type=previews.MEDIA_TYPES[previews.PREVIEW_FORMAT],
+            )
 
-    return FileResponse(msg.file_path, media_type="image/*")
+    # No preview (yet): the original, revalidated each time so the client
+    # picks up the thumbnail once it has been generated
+    path, etag = stored_file(msg)
+    return await file_response(
+        request,
+        path,
+        etag,
+        media_type=guess_type(msg.file_name or "")[0],
+        cache_control="no-cache",
+    )
 
 
 @app.get("/api/messages/{message_id}")
-def get_message(message_id: int, user=Depends(auth.get_current_user)):
-    session = db.SessionLocal()
-    msg = session.query(models.Message).get(message_id)
-    session.close()
+async def get_message(
+    message_id: int,
+    user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
+):
+    msg = await session.get(models.Message, message_id)
 
     if not msg:
         raise HTTPException(404, "Message not found")
@@ -877,22 +1312,16 @@ def get_message(message_id: int, user=Depends(auth.get_current_user)):
 
 
 @app.get("/api/threads/{thread_id}")
-async def get_thread(thread_id: int, user=Depends(auth.get_current_user)):
-    session = db.SessionLocal()
-
+async def get_thread(
+    thread_id: int,
+    user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
+):
     # ensure user is a member
-    member = (
-        session.query(models.ThreadMember)
-        .filter_by(thread_id=thread_id, user_id=user.id)
-        .first()
-    )
-
-    if not member:
-        session.close()
+    if not await membership.is_member(thread_id, user.id, session):
         raise HTTPException(403, "Not a member of this thread")
 
-    thread = session.query(models.ChatThread).filter_by(id=thread_id).first()
-    session.close()
+    thread = await session.get(models.ChatThread, thread_id)
 
     if not thread:
         raise HTTPException(404, "Thread not found")
@@ -905,123 +1334,186 @@ async def get_thread(thread_id: int, user=Depends(auth.get_current_user)):
 
 
 @app.get("/api/chats")
-def get_chat_list(user=Depends(auth.get_current_user)):
-    session = db.SessionLocal()
+async def get_chat_list(
+    user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
+):
+    # Everything the sidebar needs comes from one statement: the latest
+    # message id per thread, the unread aggregate and the DM counterpart
+    # are each a grouped subquery over the user's threads (from the
+    # membership index), so the query count does not grow with the number
+    # of threads.
+    my_threads = list(await membership.thread_ids(user.id, session))
+    if not my_threads:
+        return []
+
+    last_ids = (
+        select(
+            models.Message.thread_id.label("thread_id"),
+            func.max(models.Message.id).label("last_id"),
+        )
+        .filter(models.Message.thread_id.in_(my_threads))
+        .group_by(models.Message.thread_id)
+        .subquery()
+    )
 
-    threads = (
-        session.query(
-            models.ChatThread.id.label("thread_id"),
-            models.ChatThread.name.label("thread_name"),
-            models.ChatThread.is_group,
-            func.max(models.Message.created_at).label("last_time"),
+    # Unread = messages from others above the member's read watermark; an
+    # index range scan per thread on ix_messages_thread_id_id.
+    unread = (
+        select(
+            models.Message.thread_id.label("thread_id"),
+            func.count(models.Message.id).label("unread_count"),
         )
         .join(
-            models.ThreadMember, models.ThreadMember.thread_id == models.ChatThread.id
+            models.ThreadMember,
+            and_(
+                models.ThreadMember.thread_id == models.Message.thread_id,
+                models.ThreadMember.user_id == user.id,
+            ),
         )
-        .outerjoin(models.Message, models.Message.thread_id == models.ChatThread.id)
-        .filter(models.ThreadMember.user_id == user.id)
-        .group_by(models.ChatThread.id)
-        .order_by(desc("last_time"))
-        .all()
+        .filter(
+            models.Message.id
+            > func.coalesce(models.ThreadMember.last_read_message_id, 0),
+            models.Message.sender_id != user.id,
+        )
+        .group_by(models.Message.thread_id)
+        .subquery()
     )
 
-    result = []
-
-    for t in threads:
-        last_msg = (
-            session.query(models.Message)
-            .filter(models.Message.thread_id == t.thread_id)
-            .order_by(models.Message.created_at.desc())
-            .first()
+    others = (
+        select(
+            models.ThreadMember.thread_id.label("thread_id"),
+            func.min(models.User.username).label("username"),
+        )
+        .join(models.User, models.User.id == models.ThreadMember.user_id)
+        .filter(
+            models.ThreadMember.thread_id.in_(my_threads),
+            models.User.id != user.id,
         )
+        .group_by(models.ThreadMember.thread_id)
+        .subquery()
+    )
 
-        unread_count = (
-            session.query(models.MessageReceipt)
-            .join(models.Message)
-            .filter(
-                models.Message.thread_id == t.thread_id,
-                models.MessageReceipt.user_id == user.id,
-                models.MessageReceipt.read_at.is_(None),
-            )
-            .count()
+    last_msg = aliased(models.Message)
+
+    result = await session.execute(
+        select(
+            models.ChatThread.id.label("thread_id"),
+            models.ChatThread.name.label("thread_name"),
+            models.ChatThread.is_group,
+            last_msg.content.label("last_message"),
+            last_msg.created_at.label("last_time"),
+            func.coalesce(unread.c.unread_count, 0).label("unread_count"),
+            others.c.username.label("other_username"),
         )
+        .filter(models.ChatThread.id.in_(my_threads))
+        .outerjoin(last_ids, last_ids.c.thread_id == models.ChatThread.id)
+        .outerjoin(last_msg, last_msg.id == last_ids.c.last_id)
+        .outerjoin(unread, unread.c.thread_id == models.ChatThread.id)
+        .outerjoin(others, others.c.thread_id == models.ChatThread.id)
+        .order_by(desc("last_time"))
+    )
+    rows = result.all()
 
+    chats = []
+    for t in rows:
         if not t.is_group:
-            other = (
-                session.query(models.User)
-                .join(models.ThreadMember)
-                .filter(
-                    models.ThreadMember.thread_id == t.thread_id,
-                    models.User.id != user.id,
-                )
-                .first()
-            )
-            name = other.username if other else "Chat"
+            name = t.other_username or "Chat"
         else:
             name = t.thread_name
 
-        result.append(
+        chats.append(
             {
                 "thread_id": t.thread_id,
                 "name": name,
                 "is_group": t.is_group,
-                "last_message": last_msg.content if last_msg else None,
-                "last_message_time": last_msg.created_at.isoformat()
-                if last_msg
-                else None,
-                "unread_count": unread_count,
+                "last_message": t.last_message,
+                "last_message_time": t.last_time.isoformat() if t.last_time else None,
+                "unread_count": t.unread_count,
             }
         )
 
-    session.close()
-    return result
+    return chats
 
 
 @app.get("/api/threads/{thread_id}/messages")
-def get_thread_messages(
+async def get_thread_messages(
     thread_id: int,
-    limit: int = 50,
-    offset: int = 0,
+    limit: int = Query(50, ge=1, le=200),
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
     user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
 ):
-    session = db.SessionLocal()
-
     # Ensure membership
-    member = (
-        session.query(models.ThreadMember)
-        .filter_by(thread_id=thread_id, user_id=user.id)
-        .first()
-    )
-    if not member:
-        session.close()
+    if not await membership.is_member(thread_id, user.id, session):
         raise HTTPException(403, "Not a member of this thread")
 
-    messages = (
-        session.query(models.Message)
+    # Keyset pagination over ix_messages_thread_id_id: every page is an index
+    # range scan starting at the cursor, however deep into history it is.
+    # Without a cursor (or with before_id) we read newest-first; after_id
+    # reads forward for catching up on messages newer than the client has.
+    # The response carries one cursor per direction: prev_cursor is the
+    # before_id of the next older page, next_cursor the after_id of the next
+    # newer one; each is None when there is nothing further that way.
+    query = (
+        select(models.Message)
         .options(joinedload(models.Message.sender))
         .filter(models.Message.thread_id == thread_id)
-        .order_by(models.Message.created_at.asc())
-        .offset(offset)
-        .limit(limit)
-        .all()
     )
-
-    result = []
-    for m in messages:
-        delivered_count = (
-            session.query(models.MessageReceipt)
-            .filter(models.MessageReceipt.message_id == m.id)
-            .filter(models.MessageReceipt.delivered_at.isnot(None))
-            .count()
+    if after_id is not None:
+        query = query.filter(models.Message.id > after_id).order_by(
+            models.Message.id.asc()
         )
-
-        read_count = (
-            session.query(models.MessageReceipt)
-            .filter(models.MessageReceipt.message_id == m.id)
-            .filter(models.MessageReceipt.read_at.isnot(None))
-            .count()
+    else:
+        if before_id is not None:
+            query = query.filter(models.Message.id < before_id)
+        query = query.order_by(models.Message.id.desc())
+
+    # One extra row tells us whether another page exists.
+    result = await session.execute(query.limit(limit + 1))
+    messages = result.scalars().all()
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    if after_id is None:
+        messages.reverse()
+        older, newer = has_more, before_id is not None
+    else:
+        older, newer = True, has_more
+    prev_cursor = messages[0].id if messages and older else None
+    next_cursor = messages[-1].id if messages and newer else None
+
+    # Per-message counts come from the members' watermarks: a member has
+    # read message m when their read watermark is >= m.id. With the
+    # watermarks sorted that is a bisect per message, senders excluded.
+    result = await session.execute(
+        select(
+            models.ThreadMember.user_id,
+            models.ThreadMember.last_read_message_id,
+            models.ThreadMember.last_delivered_message_id,
+        ).filter(models.ThreadMember.thread_id == thread_id)
+    )
+    watermarks = {
+        row.user_id: (
+            row.last_read_message_id or 0,
+            row.last_delivered_message_id or 0,
         )
-        result.append(
+        for row in result
+    }
+    read_marks = sorted(read for read, _ in watermarks.values())
+    delivered_marks = sorted(delivered for _, delivered in watermarks.values())
+
+    def count_at_or_above(marks, message_id, sender_mark):
+        count = len(marks) - bisect_left(marks, message_id)
+        return count - 1 if sender_mark >= message_id else count
+
+    page = []
+    for m in messages:
+        sender_read, sender_delivered = watermarks.get(m.sender_id, (0, 0))
+        delivered_count = count_at_or_above(delivered_marks, m.id, sender_delivered)
+        read_count = count_at_or_above(read_marks, m.id, sender_read)
+        page.append(
             {
                 "id": m.id,
                 "thread_id": m.thread_id,
@@ -1039,8 +1531,50 @@ def get_thread_messages(
             }
         )
 
-    session.close()
-    return result
+    return {"messages": page, "prev_cursor": prev_cursor, "next_cursor": next_cursor}
+
+
+@app.get("/api/search")
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    user=Depends(auth.get_current_user),
+    session: AsyncSession = Depends(db.get_session),
+):
+    # Ranked over the full-text index, limited to the caller's threads; the
+    # cursor carries the rank of the last hit, not an offset.
+    after = None
+    if cursor is not None:
+        after = search.decode_cursor(cursor)
+        if after is None:
+            raise HTTPException(400, "Invalid cursor")
+
+    thread_ids = await membership.thread_ids(user.id, session)
+    ids, next_cursor = await search.search(session, thread_ids, q, limit, after)
+    result = await session.execute(
+        select(models.Message)
+        .options(joinedload(models.Message.sender))
+        .filter(models.Message.id.in_(ids))
+    )
+    found = {m.id: m for m in result.scalars()}
+
+    results = []
+    for m in (found[i] for i in ids if i in found):
+        results.append(
+            {
+                "id": m.id,
+                "thread_id": m.thread_id,
+                "sender": m.sender.username if m.sender else None,
+                "content": m.content,
+                "created_at": m.created_at.isoformat(),
+                "file_url": f"/api/files/{m.id}" if m.file_path else None,
+                "filename": m.file_name if m.file_path else None,
+                "type": "file" if m.file_path else "message",
+            }
+        )
+
+    return {"results": results, "next_cursor": next_cursor}
 
 
 if __name__ == "__main__":
@@ -1,10 +1,15 @@
 from fastapi import WebSocket
+from app import metrics
+from app.bus import LocalBus
+from app.fanout import fan_out
 import json
 
 
 class PresenceManager:
-    def __init__(self):
+    def __init__(self, bus=None):
         self.online_users = {}  # user_id -> set of websockets
+        self.bus = bus or LocalBus()
+        self.bus.subscribe(self._on_event)
 
     def connect(self, user_id: int, websocket: WebSocket):
         first_connection = user_id not in self.online_users
@@ -23,9 +28,47 @@ class PresenceManager:
         return list(self.online_users.keys())
 
     async def send_to_user(self, user_id: int, message: dict):
-        sockets = self.online_users.get(user_id, set())
-        for ws in list(sockets):
-            try:
-                await ws.send_text(json.dumps(message))
-            except RuntimeError:
-                sockets.discard(ws)
+        await self.send_to_users([user_id], message)
+
+    async def send_to_users(self, user_ids, message: dict):
+        await self.bus.publish(
+            {
+                "scope": "users",
+                "user_ids": list(user_ids),
+                **self._frame(message),
+            }
+        )
+
+    async def broadcast(self, message: dict):
+        await self.bus.publish({"scope": "all", **self._frame(message)})
+
+    @staticmethod
+    def _frame(message: dict):
+        # encoded once, tagged for the outbound queues' overflow policy
+        return {
+            "text": json.dumps(message),
+            "kind": message.get("type"),
+            "key": message.get("user_id"),
+        }
+
+    async def _on_event(self, event: dict):
+        if event["scope"] == "users":
+            user_ids = event["user_ids"]
+        elif event["scope"] == "all":
+            user_ids = list(self.online_users)
+        else:
+            return
+        self.deliver(user_ids, event["text"], event.get("kind"), event.get("key"))
+
+    def deliver(self, user_ids, text: str, kind=None, key=None):
+        # user -> sockets routing: cost follows the recipients, not everyone
+        # who happens to be online
+        with metrics.fanout_seconds.labels("users").time():
+            owners = {
+                ws: user_id
+                for user_id in set(user_ids)
+                for ws in self.online_users.get(user_id, ())
+            }
+            for ws in fan_out(owners, text, kind, key):
+                self.disconnect(owners[ws], ws)
+        metrics.fanout_recipients.labels("users").inc(len(owners))
@@ -1,8 +1,76 @@
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from app import auth, db, migrations, models, uploads
 from main import app
 
 
+@pytest.fixture(scope="session", autouse=True)
+def test_db(tmp_path_factory):
+    path = tmp_path_factory.mktemp("db") / "test.db"
+
+    setup_engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=setup_engine)
+    with setup_engine.begin() as conn:
+        migrations.run_migrations(conn)
+        conn.execute(
+            models.User.__table__.insert().values(
+                username="testuser",
+                email="test@example.com",
+                hashed_password=auth.get_password_hash("secret"),
+            )
+        )
+    setup_engine.dispose()
+
+    engine, _ = db.configure(f"sqlite+aiosqlite:///{path}")
+    return engine
+
+
+@pytest.fixture(scope="session", autouse=True)
+def upload_dir(tmp_path_factory):
+    uploads.UPLOAD_DIR = str(tmp_path_factory.mktemp("uploads"))
+    return uploads.UPLOAD_DIR
+
+
 @pytest.fixture
 def client():
     return TestClient(app)
+
+
+@pytest.fixture
+def query_counter(test_db):
+    statements = []
+    engines = {db.engine.sync_engine, db.read_engine.sync_engine}
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", count)
+    yield statements
+    for engine in engines:
+        event.remove(engine, "before_cursor_execute", count)
+
+
+@pytest.fixture
+def login(client):
+    def login(username, password="secret"):
+        client.post(
+            "/api/register",
+            json={"username": username, "email": None, "password": password},
+        )
+        r = client.post("/api/token", data={"username": username, "password": password})
+        return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    return login
+
+
+@pytest.fixture
+def make_thread(client):
+    def make_thread(headers):
+        r = client.post(
+            "/api/threads", json={"name": "files", "is_group": True}, headers=headers
+        )
+        return r.json()["id"]
+
+    return make_thread
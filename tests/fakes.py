@@ -0,0 +1,95 @@
+import asyncio
+
+
+class FakeSocket:
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+        self.closed = False
+
+    async def send_text(self, text):
+        if self.fail:
+            raise RuntimeError("socket closed")
+        await asyncio.sleep(self.delay)
+        self.sent.append(text)
+
+    async def close(self, code=1000):
+        self.closed = True
+
+
+class FakeRedis:
+    """Just enough of a Redis server (RESP2 PUBLISH/SUBSCRIBE) to run the
+    pub/sub event bus against without a real one."""
+
+    def __init__(self):
+        self.channels = {}  # channel -> set of subscribed writers
+        self.server = None
+
+    @property
+    def url(self):
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f"redis://{host}:{port}/0"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._client, "127.0.0.1", 0)
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @staticmethod
+    def _encode(*items):
+        out = [f"*{len(items)}\r\n".encode()]
+        for item in items:
+            if isinstance(item, int):
+                out.append(f":{item}\r\n".encode())
+            else:
+                out.append(f"${len(item)}\r\n".encode() + item + b"\r\n")
+        return b"".join(out)
+
+    async def _read_command(self, reader):
+        header = await reader.readline()
+        if not header:
+            return None
+        args = []
+        for _ in range(int(header[1:])):
+            size = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    async def _client(self, reader, writer):
+        subscribed = set()
+        try:
+            while (command := await self._read_command(reader)) is not None:
+                name = command[0].upper()
+                if name == b"SUBSCRIBE":
+                    for channel in command[1:]:
+                        self.channels.setdefault(channel, set()).add(writer)
+                        subscribed.add(channel)
+                        writer.write(
+                            self._encode(b"subscribe", channel, len(subscribed))
+                        )
+                elif name == b"UNSUBSCRIBE":
+                    for channel in command[1:] or list(subscribed):
+                        self.channels.get(channel, set()).discard(writer)
+                        subscribed.discard(channel)
+                        writer.write(
+                            self._encode(b"unsubscribe", channel, len(subscribed))
+                        )
+                elif name == b"PUBLISH":
+                    receivers = self.channels.get(command[1], set())
+                    for receiver in receivers:
+                        receiver.write(self._encode(b"message", *command[1:3]))
+                    writer.write(f":{len(receivers)}\r\n".encode())
+                elif name == b"PING":
+                    writer.write(b"+PONG\r\n")
+                else:
+                    writer.write(b"+OK\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in subscribed:
+                self.channels[channel].discard(writer)
+            writer.close()
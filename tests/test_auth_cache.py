@@ -0,0 +1,32 @@
+from app import auth
+
+
+def test_current_user_is_cached_per_token(client, query_counter):
+    r = client.post("/api/token", data={"username": "testuser", "password": "secret"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    client.get("/api/me", headers=headers)
+    hits = auth.user_cache.hits
+    query_counter.clear()
+
+    r = client.get("/api/me", headers=headers)
+    assert r.json()["username"] == "testuser"
+    assert auth.user_cache.hits == hits + 1
+    assert query_counter == []
+
+
+def test_cache_entry_never_outlives_token():
+    cache = auth.UserCache(maxsize=2, ttl=60)
+    user = auth.UserSnapshot(id=1, username="a", email=None, is_active=True)
+
+    cache.put("expired", user, exp=0)
+    assert cache.get("expired") is None
+
+    cache.put("t1", user, exp=2**31)
+    cache.put("t2", user, exp=2**31)
+    cache.put("t3", user, exp=2**31)
+    assert cache.get("t1") is None  # evicted, least recently used
+    assert cache.get("t3") == user
+
+    cache.invalidate_user(1)
+    assert cache.stats()["size"] == 0
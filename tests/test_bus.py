@@ -0,0 +1,42 @@
+import asyncio
+from app.bus import RedisBus
+from main import ThreadConnectionManager
+from presence import PresenceManager
+from tests.fakes import FakeRedis, FakeSocket
+
+
+def test_redis_bus_reaches_sockets_on_other_workers():
+    async def scenario():
+        redis = FakeRedis()
+        await redis.start()
+        buses = [RedisBus(redis.url), RedisBus(redis.url)]
+        for bus in buses:
+            await bus.start()
+
+        rooms = [ThreadConnectionManager(bus) for bus in buses]
+        presence = [PresenceManager(bus) for bus in buses]
+        here, there = FakeSocket(), FakeSocket()
+        await rooms[0].connect(1, here)
+        await rooms[1].connect(1, there)
+        presence[1].connect(42, there)
+
+        await rooms[0].broadcast(1, {"type": "message", "content": "hi"})
+        await presence[0].send_to_user(42, {"type": "message", "thread_id": 1})
+
+        for _ in range(100):
+            if len(there.sent) == 2:
+                break
+            await asyncio.sleep(0.01)
+
+        for bus in buses:
+            await bus.close()
+        await redis.close()
+        return here, there
+
+    here, there = asyncio.run(scenario())
+
+    assert here.sent == ['{"type": "message", "content": "hi"}']
+    assert there.sent == [
+        '{"type": "message", "content": "hi"}',
+        '{"type": "message", "thread_id": 1}',
+    ]
@@ -0,0 +1,82 @@
+def test_chat_list_last_message_and_dm_name(client, login):
+    alice = login("chats_alice")
+    bob = login("chats_bob")
+    bob_id = client.get("/api/me", headers=bob).json()["id"]
+
+    r = client.post(
+        "/api/threads", json={"name": "dm", "is_group": False}, headers=alice
+    )
+    thread_id = r.json()["id"]
+    client.post(
+        f"/api/threads/{thread_id}/members", json={"user_id": bob_id}, headers=alice
+    )
+    for text in ("first", "second"):
+        client.post(
+            "/api/messages",
+            json={"thread_id": thread_id, "content": text},
+            headers=alice,
+        )
+
+    chats = client.get("/api/chats", headers=alice).json()
+    dm = next(c for c in chats if c["thread_id"] == thread_id)
+    assert dm["name"] == "chats_bob"
+    assert dm["last_message"] == "second"
+    assert dm["unread_count"] == 0
+
+
+def test_chat_list_query_count_is_flat(client, login, query_counter):
+    headers = login("chats_many")
+
+    def chat_list_queries():
+        query_counter.clear()
+        client.get("/api/chats", headers=headers)
+        return len(query_counter)
+
+    client.post("/api/threads", json={"name": "g0", "is_group": True}, headers=headers)
+    chat_list_queries()  # loads the user's threads into the membership index
+    baseline = chat_list_queries()
+
+    for i in range(1, 20):
+        client.post(
+            "/api/threads", json={"name": f"g{i}", "is_group": True}, headers=headers
+        )
+
+    assert chat_list_queries() == baseline
+
+
+def test_unread_and_read_counts_follow_watermarks(client, login):
+    alice = login("marks_alice")
+    bob = login("marks_bob")
+    bob_id = client.get("/api/me", headers=bob).json()["id"]
+
+    r = client.post("/api/threads", json={"name": "g", "is_group": True}, headers=alice)
+    thread_id = r.json()["id"]
+    client.post(
+        "/api/messages", json={"thread_id": thread_id, "content": "old"}, headers=alice
+    )
+    client.post(
+        f"/api/threads/{thread_id}/members", json={"user_id": bob_id}, headers=alice
+    )
+    for text in ("one", "two"):
+        client.post(
+            "/api/messages",
+            json={"thread_id": thread_id, "content": text},
+            headers=alice,
+        )
+
+    def unread(headers):
+        chats = client.get("/api/chats", headers=headers).json()
+        return next(c["unread_count"] for c in chats if c["thread_id"] == thread_id)
+
+    def counts():
+        r = client.get(f"/api/threads/{thread_id}/messages", headers=alice)
+        return [(m["delivered_count"], m["read_count"]) for m in r.json()["messages"]]
+
+    assert unread(bob) == 2
+    assert unread(alice) == 0
+    assert counts() == [(1, 1), (1, 0), (1, 0)]  # bob joined caught up
+
+    client.post(f"/api/threads/{thread_id}/read", headers=bob)
+
+    assert unread(bob) == 0
+    assert counts() == [(1, 1), (1, 1), (1, 1)]
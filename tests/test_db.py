@@ -0,0 +1,100 @@
+import asyncio
+import httpx
+import pytest
+from sqlalchemy import select, text
+from sqlalchemy.exc import OperationalError
+from app import db, models
+from main import app
+
+
+def test_production_profile_pragmas_and_read_only_pool():
+    async def scenario():
+        async with db.engine.connect() as conn:
+            mode = await conn.scalar(text("PRAGMA journal_mode"))
+            synchronous = await conn.scalar(text("PRAGMA synchronous"))
+        async with db.read_engine.connect() as conn:
+            with pytest.raises(OperationalError, match="readonly"):
+                await conn.execute(text("DELETE FROM users WHERE id = -1"))
+        return mode, synchronous
+
+    assert db.read_engine is not db.engine
+    assert asyncio.run(scenario()) == ("wal", 1)  # 1 is NORMAL
+
+
+def test_session_reads_from_pool_until_it_writes():
+    async def scenario():
+        async with db.SessionLocal() as session:
+            await session.execute(select(models.User.id).limit(1))
+            before = session.sync_session.writing
+            session.add(models.User(username="routed", hashed_password="x"))
+            await session.flush()
+            # uncommitted, so only visible on the writer connection
+            found = await session.scalar(
+                select(models.User.id).filter_by(username="routed")
+            )
+            during = session.sync_session.writing
+            await session.rollback()
+            return before, found, during, session.sync_session.writing
+
+    before, found, during, after = asyncio.run(scenario())
+    assert not before and during and not after
+    assert found is not None
+
+
+def test_slow_download_does_not_hold_a_read_connection(
+    client, login, make_thread, monkeypatch
+):
+    headers = login("slow_reader")
+    thread_id = make_thread(headers)
+    r = client.post(
+        f"/api/threads/{thread_id}/upload",
+        files={"file": ("big.bin", b"x" * 100_000)},
+        headers=headers,
+    )
+    path = r.json()["file_url"]
+
+    async def scenario():
+        sending, release = asyncio.Event(), asyncio.Event()
+
+        async def receive():
+            await release.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body":
+                sending.set()
+                await release.wait()  # a client that reads very slowly
+
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(b"authorization", headers["Authorization"].encode())],
+            "client": ("testclient", 1),
+            "server": ("testserver", 80),
+        }
+        download = asyncio.create_task(app(scope, receive, send))
+        await sending.wait()
+        try:
+            async with httpx.AsyncClient(app=app, base_url="http://test") as http:
+                r = await asyncio.wait_for(http.get("/api/chats", headers=headers), 5)
+        finally:
+            release.set()
+            await download
+            await db.engine.dispose()
+            await db.read_engine.dispose()
+        return r.status_code
+
+    saved = db.engine, db.read_engine
+    monkeypatch.setattr(db, "SQLITE_READ_POOL", 1)
+    db.configure(str(db.engine.url))
+    try:
+        assert asyncio.run(scenario()) == 200
+    finally:
+        db.engine, db.read_engine = saved
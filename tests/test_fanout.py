@@ -0,0 +1,71 @@
+import asyncio
+import time
+from app import fanout
+from app.fanout import Outbox
+from main import ThreadConnectionManager
+from tests.fakes import FakeSocket
+
+
+def test_broadcast_is_not_held_up_by_slow_or_dead_sockets(monkeypatch):
+    monkeypatch.setattr("app.fanout.WS_SEND_TIMEOUT", 0.05)
+    fast = [FakeSocket() for _ in range(3)]
+    slow = FakeSocket(delay=10)
+    dead = FakeSocket(fail=True)
+
+    async def scenario():
+        manager = ThreadConnectionManager()
+        for ws in fast + [slow, dead]:
+            await manager.connect(1, ws)
+
+        start = time.perf_counter()
+        await manager.broadcast(1, {"type": "message", "content": "hi"})
+        elapsed = time.perf_counter() - start
+
+        await asyncio.sleep(0.2)  # writers deliver, slow and dead get closed
+        await manager.broadcast(1, {"type": "message", "content": "again"})
+        return manager, elapsed
+
+    manager, elapsed = asyncio.run(scenario())
+
+    assert elapsed < 0.05
+    assert all(len(ws.sent) >= 1 for ws in fast)
+    assert fast[0].sent[0] == '{"type": "message", "content": "hi"}'
+    assert manager.rooms[1] == set(fast)
+    assert slow.closed and dead.closed
+
+
+def test_overflow_drops_typing_then_coalesces_presence_then_disconnects():
+    async def scenario():
+        # nothing awaits below, so the writer never gets to drain the queue
+        box = Outbox(FakeSocket(), maxsize=4)
+        texts = lambda: [text for text, _, _ in box.frames]
+
+        box.put("m1", "message")
+        box.put("t1", "typing", 1)
+        box.put("p1", "presence", 1)
+        box.put("p2", "presence", 1)
+
+        box.put("t2", "typing", 1)
+        after_typing = texts()
+        box.put("p3", "presence", 1)
+        box.put("t3", "typing", 1)
+        after_presence = texts()
+
+        box.put("m2", "message")
+        box.put("m3", "message")
+        accepted = box.put("m4", "message")
+        # the close runs in the background, held by the module until done
+        closing = set(fanout._closing)
+        await asyncio.gather(*closing)
+        return after_typing, after_presence, accepted, box, closing
+
+    dropped = dict(fanout.counters)
+    after_typing, after_presence, accepted, box, closing = asyncio.run(scenario())
+
+    assert after_typing == ["m1", "p1", "p2", "t2"]
+    assert after_presence == ["m1", "p3", "t3"]
+    assert fanout.counters["typing_dropped"] - dropped["typing_dropped"] == 3
+    assert fanout.counters["presence_coalesced"] - dropped["presence_coalesced"] == 2
+    assert not accepted and box.closed
+    assert len(closing) == 1 and not fanout._closing
+    assert box.websocket.closed
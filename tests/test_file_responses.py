@@ -0,0 +1,64 @@
+import hashlib
+import pytest
+
+DATA = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def upload(client, make_thread):
+    def upload(headers):
+        thread_id = make_thread(headers)
+        r = client.post(
+            f"/api/threads/{thread_id}/upload",
+            files={"file": ("video.mp4", DATA, "video/mp4")},
+            headers=headers,
+        )
+        return r.json()["file_url"]
+
+    return upload
+
+
+def test_files_are_immutable_and_revalidate_to_304(client, login, upload):
+    headers = login("files_alice")
+    url = upload(headers)
+
+    r = client.get(url, headers=headers)
+    etag = f'"{hashlib.sha256(DATA).hexdigest()}"'
+    assert r.headers["etag"] == etag
+    assert "immutable" in r.headers["cache-control"]
+    assert r.headers["content-type"] == "video/mp4"
+
+    r = client.get(url, headers={**headers, "If-None-Match": f'"other", W/{etag}'})
+    assert r.status_code == 304 and r.content == b""
+
+
+def test_single_and_multi_range_requests(client, login, upload):
+    headers = login("files_bob")
+    url = upload(headers)
+    size = len(DATA)
+
+    r = client.get(url, headers={**headers, "Range": "bytes=100-199"})
+    assert r.status_code == 206
+    assert r.headers["content-range"] == f"bytes 100-199/{size}"
+    assert r.content == DATA[100:200]
+
+    r = client.get(url, headers={**headers, "Range": "bytes=-10"})
+    assert r.content == DATA[-10:]
+
+    r = client.get(url, headers={**headers, "Range": "bytes=0-1, 1000-1003"})
+    assert r.status_code == 206
+    boundary = r.headers["content-type"].split("boundary=")[1]
+    parts = r.content.split(f"--{boundary}".encode())
+    assert len(parts) == 4  # preamble, two parts, closing "--"
+    assert parts[1].endswith(b"\r\n\r\n" + DATA[0:2] + b"\r\n")
+    assert f"bytes 1000-1003/{size}".encode() in parts[2]
+    assert parts[2].endswith(DATA[1000:1004] + b"\r\n")
+    assert int(r.headers["content-length"]) == len(r.content)
+
+    r = client.get(url, headers={**headers, "Range": f"bytes={size}-"})
+    assert r.status_code == 416
+    assert r.headers["content-range"] == f"bytes */{size}"
+
+    # a stale If-Range means the client's partial copy is outdated
+    r = client.get(url, headers={**headers, "Range": "bytes=0-9", "If-Range": '"x"'})
+    assert r.status_code == 200 and r.content == DATA
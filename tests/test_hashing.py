@@ -0,0 +1,25 @@
+from app import hashing
+
+
+def test_login_is_refused_when_hash_queue_is_full(client, monkeypatch):
+    monkeypatch.setattr(hashing, "pool", hashing.HashingPool(workers=0, max_pending=0))
+
+    r = client.post("/api/token", data={"username": "testuser", "password": "secret"})
+
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "1"
+
+
+def test_process_pool_verifies_passwords(client, monkeypatch):
+    pool = hashing.HashingPool(workers=1, max_pending=4)
+    monkeypatch.setattr(hashing, "pool", pool)
+
+    try:
+        r = client.post(
+            "/api/token", data={"username": "testuser", "password": "secret"}
+        )
+        assert r.status_code == 200
+        r = client.post("/api/token", data={"username": "testuser", "password": "nope"})
+        assert r.status_code == 400
+    finally:
+        pool.shutdown()
@@ -0,0 +1,46 @@
+import asyncio
+import time
+from app.loop_monitor import LoopMonitor, label_task
+
+
+def blocking_handler():
+    time.sleep(0.3)
+
+
+def test_stall_is_captured_with_stack_and_label():
+    monitor = LoopMonitor(interval=0.01, threshold=0.1)
+
+    async def scenario():
+        watching = asyncio.create_task(monitor.run())
+        await asyncio.sleep(0.05)
+
+        async def request():
+            label_task("GET /slow")
+            blocking_handler()
+
+        await asyncio.create_task(request())
+        await asyncio.sleep(0.05)
+        watching.cancel()
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+
+    stats = monitor.stats()
+    assert stats["stall_count"] == 1
+    stall = stats["stalls"][0]
+    assert stall["label"] == "GET /slow"
+    assert stall["duration_ms"] >= 200
+    assert "blocking_handler" in "".join(stall["stack"])
+    assert stats["lag_ms"]["max"] >= 200
+    assert stats["lag_ms"]["p50"] < 100
+    assert not monitor.running
+
+
+def test_diagnostics_endpoint(client, login):
+    headers = login("diagnostics")
+    r = client.get("/api/diagnostics/loop", headers=headers)
+    assert r.status_code == 200
+    assert set(r.json()["lag_ms"]) == {"p50", "p95", "p99", "max"}
+
+    r = client.get("/")
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/html")
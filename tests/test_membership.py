@@ -0,0 +1,48 @@
+from app.membership import MembershipIndex, membership
+
+
+def test_membership_is_cached_and_written_through(client, login, query_counter):
+    alice = login("index_alice")
+    bob = login("index_bob")
+    bob_id = client.get("/api/me", headers=bob).json()["id"]
+
+    thread_id = client.post(
+        "/api/threads", json={"name": "idx", "is_group": True}, headers=alice
+    ).json()["id"]
+    client.post(
+        f"/api/threads/{thread_id}/members", json={"user_id": bob_id}, headers=alice
+    )
+    assert bob_id in membership.threads[thread_id]
+
+    query_counter.clear()
+    assert client.get(f"/api/threads/{thread_id}", headers=bob).status_code == 200
+    assert not any("thread_members" in s for s in query_counter)
+
+    client.post(
+        f"/api/threads/{thread_id}/remove", json={"user_id": bob_id}, headers=alice
+    )
+    assert bob_id not in membership.threads[thread_id]
+    assert client.get(f"/api/threads/{thread_id}", headers=bob).status_code == 403
+
+
+def test_user_threads_follow_membership_and_dissolve(client, login):
+    alice = login("index_carol")
+    alice_id = client.get("/api/me", headers=alice).json()["id"]
+    client.get("/api/chats", headers=alice)
+
+    thread_id = client.post(
+        "/api/threads", json={"name": "gone", "is_group": True}, headers=alice
+    ).json()["id"]
+    assert thread_id in membership.users[alice_id]
+
+    client.post(f"/api/threads/{thread_id}/dissolve", headers=alice)
+    assert thread_id not in membership.threads
+    assert thread_id not in membership.users[alice_id]
+    assert client.get("/api/chats", headers=alice).json() == []
+
+
+def test_membership_cache_is_bounded():
+    index = MembershipIndex(max_threads=2, max_users=2)
+    for thread_id in range(1, 4):
+        index.add_thread(thread_id, user_id=thread_id)
+    assert list(index.threads) == [2, 3]
@@ -19,3 +19,72 @@ def test_send_message(client):
 
     assert r.status_code == 200
     assert r.json()["content"] == "hello"
+
+
+def test_thread_messages_query_count_is_flat(client, query_counter):
+    r = client.post("/api/token", data={"username": "testuser", "password": "secret"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    r = client.post(
+        "/api/threads", json={"name": "Receipts", "is_group": True}, headers=headers
+    )
+    thread_id = r.json()["id"]
+
+    def page_queries():
+        query_counter.clear()
+        r = client.get(f"/api/threads/{thread_id}/messages", headers=headers)
+        assert all(m["delivered_count"] == 0 for m in r.json()["messages"])
+        return len(query_counter)
+
+    client.post(
+        "/api/messages", json={"thread_id": thread_id, "content": "0"}, headers=headers
+    )
+    baseline = page_queries()
+
+    for i in range(1, 10):
+        client.post(
+            "/api/messages",
+            json={"thread_id": thread_id, "content": str(i)},
+            headers=headers,
+        )
+
+    assert page_queries() == baseline
+
+
+def test_thread_messages_cursor_pages_newest_first(client):
+    r = client.post("/api/token", data={"username": "testuser", "password": "secret"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    r = client.post(
+        "/api/threads", json={"name": "History", "is_group": True}, headers=headers
+    )
+    thread_id = r.json()["id"]
+    for i in range(5):
+        client.post(
+            "/api/messages",
+            json={"thread_id": thread_id, "content": str(i)},
+            headers=headers,
+        )
+
+    url = f"/api/threads/{thread_id}/messages"
+    page = client.get(url, params={"limit": 2}, headers=headers).json()
+    assert [m["content"] for m in page["messages"]] == ["3", "4"]
+    assert page["next_cursor"] is None
+
+    page = client.get(
+        url, params={"limit": 2, "before_id": page["prev_cursor"]}, headers=headers
+    ).json()
+    assert [m["content"] for m in page["messages"]] == ["1", "2"]
+    assert page["next_cursor"] == page["messages"][-1]["id"]
+
+    page = client.get(
+        url, params={"limit": 2, "before_id": page["prev_cursor"]}, headers=headers
+    ).json()
+    assert [m["content"] for m in page["messages"]] == ["0"]
+    assert page["prev_cursor"] is None
+
+    oldest = page["messages"][0]["id"]
+    page = client.get(
+        url, params={"limit": 3, "after_id": oldest}, headers=headers
+    ).json()
+    assert [m["content"] for m in page["messages"]] == ["1", "2", "3"]
+    assert page["next_cursor"] == page["messages"][-1]["id"]
+    assert page["prev_cursor"] == page["messages"][0]["id"]
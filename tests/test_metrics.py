@@ -0,0 +1,78 @@
+from app import metrics
+
+
+def scrape(client):
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    return r.text
+
+
+def sample(text, line_start):
+    for line in text.splitlines():
+        if line.startswith(line_start + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return None
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram(
+        "test_latency_seconds", "Test.", ["path"], buckets=(0.1, 1)
+    )
+    for value in (0.05, 0.5, 0.5, 3):
+        histogram.labels('a"b').observe(value)
+    try:
+        text = histogram.render()
+    finally:
+        metrics._registry.remove(histogram)
+
+    assert "# TYPE test_latency_seconds histogram" in text
+    assert sample(text, 'test_latency_seconds_bucket{path="a\\"b",le="0.1"}') == 1
+    assert sample(text, 'test_latency_seconds_bucket{path="a\\"b",le="1.0"}') == 3
+    assert sample(text, 'test_latency_seconds_bucket{path="a\\"b",le="+Inf"}') == 4
+    assert sample(text, 'test_latency_seconds_count{path="a\\"b"}') == 4
+
+
+def test_metrics_endpoint_reports_routes_queries_and_uploads(
+    client, login, make_thread
+):
+    headers = login("metrics_user")
+    thread_id = make_thread(headers)
+    client.get(f"/api/threads/{thread_id}/messages", headers=headers)
+    client.post(
+        f"/api/threads/{thread_id}/upload",
+        files={"file": ("m.bin", b"x" * 1000)},
+        headers=headers,
+    )
+
+    text = scrape(client)
+    # labelled by the route template, not the concrete path
+    route = 'http_request_duration_seconds_count{method="GET",'
+    route += 'route="/api/threads/{thread_id}/messages",status="200"}'
+    assert sample(text, route) >= 1
+    assert sample(text, 'db_query_duration_seconds_count{statement="SELECT"}') > 0
+    assert sample(text, "upload_bytes_total") >= 1000
+    assert sample(text, "ws_room_connections") >= 0
+    assert "ws_room_connections{" not in text
+    assert sample(text, 'membership_index_lookups_total{result="hit"}') >= 1
+    assert sample(text, 'auth_user_cache_lookups_total{result="hit"}') >= 1
+    assert sample(text, "auth_user_cache_entries") >= 1
+    assert sample(text, "password_hash_rejected_total") >= 0
+
+
+def test_room_gauges_are_aggregates(client, login, make_thread):
+    headers = login("rooms_alice")
+    thread_id = make_thread(headers)
+    token = headers["Authorization"].split()[1]
+
+    with client.websocket_connect(f"/ws/chat?token={token}") as ws:
+        ws.send_json({"action": "join", "thread_id": thread_id})
+        while "joined" not in ws.receive_json().get("message", ""):
+            pass
+        text = scrape(client)
+        stats = client.get("/api/ws-stats", headers=headers).json()
+
+    assert sample(text, "ws_room_connections") >= 1
+    assert sample(text, "ws_room_max_connections") >= 1
+    assert "thread_id=" not in text
+    assert stats["rooms"][str(thread_id)] == 1
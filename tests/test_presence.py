@@ -0,0 +1,115 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from app import db, models
+from app.presence_registry import PresenceRegistry, presence_registry
+from main import presence_manager, thread_manager
+from presence import PresenceManager
+from tests.fakes import FakeSocket
+
+
+def test_send_to_users_only_reaches_recipients():
+    presence = PresenceManager()
+    sockets = {uid: FakeSocket() for uid in (1, 2, 3)}
+    for uid, ws in sockets.items():
+        presence.connect(uid, ws)
+    second_tab = FakeSocket()
+    presence.connect(1, second_tab)
+
+    async def scenario():
+        await presence.send_to_users([1, 2], {"type": "message", "thread_id": 7})
+        await asyncio.sleep(0.01)  # let the writer tasks drain
+
+    asyncio.run(scenario())
+
+    assert len(sockets[1].sent) == len(second_tab.sent) == len(sockets[2].sent) == 1
+    assert sockets[3].sent == []
+
+
+def test_registry_expires_connections_that_stop_heartbeating():
+    async def scenario():
+        registry = PresenceRegistry(ttl=30)
+        async with db.SessionLocal() as session:
+            user_id = await session.scalar(
+                select(models.User.id).filter_by(username="testuser")
+            )
+
+        conn_id, first = await registry.connect(user_id)
+        _, second = await registry.connect(user_id)
+        assert first and not second
+
+        await registry.refresh()
+        assert await registry.expire() == []
+
+        # the worker holding them "crashed" and its rows ran out
+        async with db.SessionLocal() as session:
+            await session.execute(
+                update(models.PresenceSession)
+                .filter(models.PresenceSession.id.in_(list(registry.local)))
+                .values(expires_at=datetime.utcnow() - timedelta(seconds=1))
+            )
+            await session.commit()
+        offline = await registry.expire()
+
+        async with db.SessionLocal() as session:
+            online = (await session.execute(registry.online_user_ids())).all()
+        return offline, online, user_id
+
+    offline, online, user_id = asyncio.run(scenario())
+
+    assert offline == [(user_id, "testuser")]
+    assert online == []
+
+
+def test_online_users_come_from_the_registry(client):
+    r = client.post("/api/token", data={"username": "testuser", "password": "secret"})
+    token = r.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    def online():
+        r = client.get("/api/online-users", headers=headers)
+        return [u["username"] for u in r.json()]
+
+    assert "testuser" not in online()
+
+    with client.websocket_connect(f"/ws/chat?token={token}") as ws:
+        ws.send_json({"action": "join", "thread_id": 1})
+        while "joined" not in ws.receive_json().get("message", ""):
+            pass
+        assert "testuser" in online()
+
+
+def test_silent_socket_is_dropped_after_ttl(client, monkeypatch):
+    monkeypatch.setattr(presence_registry, "ttl", 0.2)
+    r = client.post("/api/token", data={"username": "testuser", "password": "secret"})
+    token = r.json()["access_token"]
+
+    with client.websocket_connect(f"/ws/chat?token={token}") as ws:
+        ws.send_json({"action": "join", "thread_id": 1})
+        while "joined" not in ws.receive_json().get("message", ""):
+            pass
+        # no pong, no frames at all: the server gives up on us
+        assert ws.receive()["type"] == "websocket.close"
+
+    r = client.get("/api/online-users", headers={"Authorization": f"Bearer {token}"})
+    assert r.json() == []
+
+
+def test_socket_that_fails_mid_loop_goes_offline(client):
+    r = client.post("/api/token", data={"username": "testuser", "password": "secret"})
+    token = r.json()["access_token"]
+
+    with pytest.raises(KeyError):
+        with client.websocket_connect(f"/ws/chat?token={token}") as ws:
+            ws.send_json({"action": "join", "thread_id": 1})
+            while "joined" not in ws.receive_json().get("message", ""):
+                pass
+            ws.send_json({"action": "message", "thread_id": 1})  # no content
+            ws.receive()
+
+    assert presence_registry.local == set()
+    assert presence_manager.online_users == {}
+    assert thread_manager.rooms.get(1) is None
+    r = client.get("/api/online-users", headers={"Authorization": f"Bearer {token}"})
+    assert r.json() == []
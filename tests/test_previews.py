@@ -0,0 +1,76 @@
+import asyncio
+import hashlib
+import io
+import pytest
+from app import previews
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def png(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 30, 30)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def use_pool(monkeypatch):
+    # generation is driven by the test rather than by the upload's task
+    pool = previews.PreviewPool(workers=0)
+    scheduled = []
+    monkeypatch.setattr(pool, "schedule", lambda *args: scheduled.append(args))
+    monkeypatch.setattr(previews, "pool", pool)
+    return scheduled
+
+
+def test_preview_falls_back_to_original_until_thumbnails_exist(
+    client, login, make_thread, monkeypatch
+):
+    scheduled = use_pool(monkeypatch)
+    headers = login("preview_alice")
+    thread_id = make_thread(headers)
+    data = png(1600, 1200)
+
+    r = client.post(
+        f"/api/threads/{thread_id}/upload",
+        files={"file": ("photo.png", data, "image/png")},
+        headers=headers,
+    )
+    url = f"/api/files/{r.json()['id']}/preview"
+
+    r = client.get(url)
+    assert r.content == data
+    assert r.headers["cache-control"] == "no-cache"
+
+    digest = hashlib.sha256(data).hexdigest()
+    assert scheduled == [(digest, "photo.png")]
+    assert asyncio.run(previews.pool.generate(digest)) == [320, 1024]
+
+    small = client.get(url)
+    assert small.headers["content-type"] == "image/webp"
+    assert "immutable" in small.headers["cache-control"]
+    assert Image.open(io.BytesIO(small.content)).size == (320, 240)
+
+    large = client.get(f"{url}?size=800")
+    assert Image.open(io.BytesIO(large.content)).size == (1024, 768)
+
+
+def test_small_images_and_other_files_keep_the_original(
+    client, login, make_thread, monkeypatch
+):
+    use_pool(monkeypatch)
+    headers = login("preview_bob")
+    thread_id = make_thread(headers)
+    data = png(500, 400)
+
+    r = client.post(
+        f"/api/threads/{thread_id}/upload",
+        files={"file": ("icon.png", data, "image/png")},
+        headers=headers,
+    )
+    url = f"/api/files/{r.json()['id']}/preview"
+    digest = hashlib.sha256(data).hexdigest()
+
+    assert asyncio.run(previews.pool.generate(digest)) == [320]
+    assert client.get(f"{url}?size=320").headers["content-type"] == "image/webp"
+    assert client.get(f"{url}?size=1024").content == data  # closer than 320
+    assert previews.PreviewPool(workers=0).schedule(digest, "notes.txt") is None
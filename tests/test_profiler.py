@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+from app import profiler
+from app.writer import MessageWriter
+
+
+@pytest.fixture
+def busy_user(client, login, make_thread):
+    headers = login("profiled")
+    thread_ids = [make_thread(headers) for _ in range(4)]
+    for thread_id in thread_ids:
+        for i in range(3):
+            client.post(
+                "/api/messages",
+                json={"thread_id": thread_id, "content": f"m{i}"},
+                headers=headers,
+            )
+    return headers, thread_ids
+
+
+@pytest.mark.parametrize(
+    "method, path, budget",
+    [
+        ("GET", "/api/chats", 1),
+        ("GET", "/api/threads/{thread_id}/messages", 2),
+        ("POST", "/api/threads/{thread_id}/read", 3),
+    ],
+)
+def test_query_budgets(client, busy_user, method, path, budget):
+    headers, thread_ids = busy_user
+    url = path.format(thread_id=thread_ids[0])
+    client.request(method, url, headers=headers)  # warm the caches
+
+    with profiler.profile(f"{method} {path}") as profile:
+        r = client.request(method, url, headers=headers)
+    assert r.status_code == 200
+    profile.assert_budget(queries=budget)
+
+
+def test_repeated_statement_shapes_are_flagged():
+    profile = profiler.Profile("loop")
+    profile.record("SELECT * FROM users WHERE id = ?", 0.001)
+    for ids in ("?", "?, ?", "?, ?, ?"):
+        profile.record(f"SELECT *\n  FROM messages WHERE id IN ({ids})", 0.001)
+
+    assert profile.n_plus_one == {"SELECT * FROM messages WHERE id IN (?)": 3}
+    profile.assert_budget(queries=4, allow_repeats=True)
+    with pytest.raises(AssertionError, match="N\\+1 suspects"):
+        profile.assert_budget(queries=4)
+
+
+def test_debug_header_when_enabled(client, busy_user, monkeypatch):
+    headers, _ = busy_user
+    assert "x-sql-profile" not in client.get("/api/chats", headers=headers).headers
+
+    monkeypatch.setattr(profiler, "SQL_PROFILE", True)
+    r = client.get("/api/chats", headers=headers)
+    fields = dict(part.split("=") for part in r.headers["x-sql-profile"].split("; "))
+    assert int(fields["queries"]) >= 1
+    assert fields["n_plus_one"] == "0"
+
+
+def test_writer_statements_count_for_the_submitting_action(monkeypatch):
+    monkeypatch.setattr(profiler, "SQL_PROFILE", True)
+    writer = MessageWriter(window=0)
+
+    async def action(name, content):
+        # one WS action on its own socket task
+        profile = profiler.begin(name)
+        await writer.submit(thread_id=1, sender_id=1, content=content)
+        profiler.end(profile)
+        return profile
+
+    async def scenario():
+        first = await asyncio.create_task(action("ws message", "one"))
+        queries = first.queries
+        second = await asyncio.create_task(action("ws message", "two"))
+        await writer.close()
+        return first, queries, second
+
+    first, queries, second = asyncio.run(scenario())
+
+    assert first.queries == queries  # nothing after it ended
+    assert second.queries == queries > 0
+    assert any(shape.startswith("INSERT INTO messages") for shape in second.shapes)
@@ -0,0 +1,52 @@
+import asyncio
+from app.bus import LocalBus
+from app.typing_indicators import TypingAggregator
+
+
+def test_keystrokes_collapse_into_one_event_per_thread_per_tick():
+    sent = []
+    bus = LocalBus()
+    typing = TypingAggregator(bus, lambda tid, msg: sent.append(msg), ttl=60)
+
+    async def scenario():
+        for _ in range(50):
+            await typing.start_typing(1, 10, "alice")
+            await typing.start_typing(1, 11, "bob")
+        typing.flush()
+        typing.flush()  # nothing changed since
+        await typing.stop_typing(1, 10)
+        typing.flush()
+
+    asyncio.run(scenario())
+
+    assert bus.published == 3  # two starts and one stop, not 100 keystrokes
+    assert sent == [
+        {
+            "type": "typing",
+            "thread_id": 1,
+            "users": [
+                {"user_id": 10, "username": "alice"},
+                {"user_id": 11, "username": "bob"},
+            ],
+        },
+        {
+            "type": "typing",
+            "thread_id": 1,
+            "users": [{"user_id": 11, "username": "bob"}],
+        },
+    ]
+
+
+def test_quiet_typers_expire_without_typing_stop():
+    sent = []
+    typing = TypingAggregator(LocalBus(), lambda tid, msg: sent.append(msg), ttl=0.05)
+
+    async def scenario():
+        await typing.start_typing(2, 10, "alice")
+        typing.flush()
+        await asyncio.sleep(0.1)
+        typing.flush()
+
+    asyncio.run(scenario())
+
+    assert [m["users"] for m in sent] == [[{"user_id": 10, "username": "alice"}], []]
@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from app import blobs, db, models, uploads
+
+
+def test_upload_streams_to_disk_and_enforces_limit(
+    client, login, make_thread, monkeypatch, upload_dir
+):
+    headers = login("upload_alice")
+    thread_id = make_thread(headers)
+    monkeypatch.setattr(uploads, "UPLOAD_BUFFER_BYTES", 1024)
+    data = os.urandom(10_000)
+
+    r = client.post(
+        f"/api/threads/{thread_id}/upload",
+        files={"file": ("photo.jpg", data, "image/jpeg")},
+        headers=headers,
+    )
+    assert r.status_code == 200
+    assert client.get(r.json()["file_url"], headers=headers).content == data
+
+    monkeypatch.setattr(uploads, "UPLOAD_MAX_BYTES", 4096)
+    r = client.post(
+        f"/api/threads/{thread_id}/upload",
+        files={"file": ("big.bin", data, "application/octet-stream")},
+        headers=headers,
+    )
+    assert r.status_code == 413
+    assert os.listdir(os.path.join(upload_dir, "partial")) == []
+
+
+def test_chunked_upload_resumes_from_reported_offset(client, login, make_thread):
+    headers = login("upload_bob")
+    thread_id = make_thread(headers)
+    data = os.urandom(5000)
+
+    r = client.post(
+        "/api/uploads",
+        json={"thread_id": thread_id, "file_name": "clip.mp4", "file_size": len(data)},
+        headers=headers,
+    )
+    upload_id = r.json()["upload_id"]
+    url = f"/api/uploads/{upload_id}"
+
+    r = client.put(f"{url}?offset=0", content=data[:2000], headers=headers)
+    assert r.json()["offset"] == 2000
+
+    # a retry of a chunk that already landed is refused, not duplicated
+    r = client.put(f"{url}?offset=0", content=data[:2000], headers=headers)
+    assert r.status_code == 409
+    assert client.post(f"{url}/complete", headers=headers).status_code == 409
+
+    offset = client.get(url, headers=headers).json()["offset"]
+    client.put(f"{url}?offset={offset}", content=data[offset:], headers=headers)
+    r = client.post(f"{url}/complete", headers=headers)
+
+    assert r.status_code == 200
+    assert client.get(r.json()["file_url"], headers=headers).content == data
+    assert client.get(url, headers=headers).status_code == 404
+
+
+def test_chunk_is_refused_while_another_holds_the_upload(client, login, make_thread):
+    headers = login("upload_dave")
+    thread_id = make_thread(headers)
+    r = client.post(
+        "/api/uploads",
+        json={"thread_id": thread_id, "file_name": "a.bin", "file_size": 10},
+        headers=headers,
+    )
+    upload_id = r.json()["upload_id"]
+    url = f"/api/uploads/{upload_id}"
+
+    async def hold():
+        async with uploads.locked_partial(upload_id):
+            # a concurrent PUT at the same offset, e.g. from another worker
+            return client.put(f"{url}?offset=0", content=b"x" * 10, headers=headers)
+
+    assert asyncio.run(hold()).status_code == 409
+
+    r = client.put(f"{url}?offset=0", content=b"x" * 11, headers=headers)
+    assert r.status_code == 413
+    assert client.get(url, headers=headers).json()["offset"] == 0
+    r = client.put(f"{url}?offset=0", content=b"x" * 10, headers=headers)
+    assert r.json()["offset"] == 10
+
+
+def test_sweep_removes_abandoned_uploads(client, login, make_thread, upload_dir):
+    headers = login("upload_erin")
+    thread_id = make_thread(headers)
+
+    def start():
+        r = client.post(
+            "/api/uploads",
+            json={"thread_id": thread_id, "file_name": "a.bin", "file_size": 10},
+            headers=headers,
+        )
+        upload_id = r.json()["upload_id"]
+        client.put(f"/api/uploads/{upload_id}?offset=0", content=b"x", headers=headers)
+        return upload_id
+
+    abandoned, active = start(), start()
+    stray = uploads.partial_path("stray")
+    with open(stray, "wb") as f:
+        f.write(b"x")
+
+    day_ago = time.time() - 86400
+    for path in (uploads.partial_path(abandoned), stray):
+        os.utime(path, (day_ago, day_ago))
+
+    async def scenario():
+        async with db.SessionLocal() as session:
+            await session.execute(
+                update(models.Upload)
+                .filter(models.Upload.id.in_([abandoned, active]))
+                .values(created_at=datetime.utcnow() - timedelta(days=1))
+            )
+            await session.commit()
+        return await uploads.sweep(max_age=3600)
+
+    assert asyncio.run(scenario()) == 2
+    assert not os.path.exists(uploads.partial_path(abandoned))
+    assert not os.path.exists(stray)
+    # still receiving bytes, so kept however old the upload is
+    assert client.get(f"/api/uploads/{active}", headers=headers).json()["offset"] == 1
+    assert client.get(f"/api/uploads/{abandoned}", headers=headers).status_code == 404
+
+
+def test_identical_files_share_one_blob_until_last_reference_goes(
+    client, login, make_thread
+):
+    headers = login("upload_carol")
+    first, second = make_thread(headers), make_thread(headers)
+    data = os.urandom(3000)
+    digest = hashlib.sha256(data).hexdigest()
+
+    def upload(thread_id):
+        r = client.post(
+            f"/api/threads/{thread_id}/upload",
+            files={"file": ("same.png", data, "image/png")},
+            headers=headers,
+        )
+        return r.json()["id"]
+
+    original = upload(first)
+    upload(second)
+    r = client.post(
+        "/api/messages",
+        json={"thread_id": second, "forward_from_id": original},
+        headers=headers,
+    )
+    forwarded = r.json()["id"]
+
+    assert blob_refs(digest) == 3
+    assert client.get(f"/api/files/{forwarded}", headers=headers).content == data
+
+    client.post(f"/api/threads/{second}/dissolve", headers=headers)
+    assert blob_refs(digest) == 1
+    assert os.path.exists(blobs.blob_path(digest))
+
+    client.post(f"/api/threads/{first}/dissolve", headers=headers)
+    assert blob_refs(digest) is None
+    assert not os.path.exists(blobs.blob_path(digest))
+
+
+def blob_refs(digest):
+    async def lookup():
+        async with db.SessionLocal() as session:
+            blob = await session.get(models.Blob, digest)
+            return blob.ref_count if blob else None
+
+    return asyncio.run(lookup())
@@ -16,3 +16,27 @@ def test_websocket_chat_flow(client):
                 break
 
         assert joined
+
+
+def test_websocket_message_is_stored_and_broadcast(client):
+    r = client.post("/api/token", data={"username": "testuser", "password": "secret"})
+    token = r.json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    r = client.post(
+        "/api/threads", json={"name": "WS Thread", "is_group": True}, headers=headers
+    )
+    thread_id = r.json()["id"]
+
+    with client.websocket_connect(f"/ws/chat?token={token}") as ws:
+        ws.send_json({"action": "join", "thread_id": thread_id})
+        ws.send_json({"action": "message", "thread_id": thread_id, "content": "hi"})
+
+        for _ in range(5):
+            data = ws.receive_json()
+            if data.get("type") == "message" and data.get("id"):
+                break
+
+        assert data["content"] == "hi"
+
+    r = client.get(f"/api/threads/{thread_id}/messages", headers=headers)
+    assert [m["content"] for m in r.json()["messages"]] == ["hi"]
@@ -0,0 +1,78 @@
+import asyncio
+import pytest
+from sqlalchemy import select
+from app import db, models
+from app.writer import MessageWriter
+
+
+async def seed_thread(member_count):
+    async with db.SessionLocal() as session:
+        users = [
+            models.User(username=f"writer_{member_count}_{i}", hashed_password="x")
+            for i in range(member_count)
+        ]
+        thread = models.ChatThread(name="writer", is_group=True)
+        session.add_all(users + [thread])
+        await session.flush()
+        session.add_all(
+            models.ThreadMember(thread_id=thread.id, user_id=u.id) for u in users
+        )
+        await session.commit()
+        return thread.id, [u.id for u in users]
+
+
+def test_concurrent_messages_share_one_commit():
+    async def scenario():
+        thread_id, user_ids = await seed_thread(3)
+        writer = MessageWriter(window=0.05)
+        rows = await asyncio.gather(
+            *(
+                writer.submit(
+                    thread_id=thread_id, sender_id=user_ids[0], content=str(i)
+                )
+                for i in range(10)
+            )
+        )
+        await writer.close()
+
+        async with db.SessionLocal() as session:
+            result = await session.execute(
+                select(models.ThreadMember.last_delivered_message_id).where(
+                    models.ThreadMember.thread_id == thread_id
+                )
+            )
+            watermarks = result.scalars().all()
+        return writer, rows, watermarks
+
+    writer, rows, watermarks = asyncio.run(scenario())
+
+    assert writer.batches == 1
+    assert [r["content"] for r in rows] == [str(i) for i in range(10)]
+    assert len({r["id"] for r in rows}) == 10
+    assert watermarks == [max(r["id"] for r in rows)] * 3
+
+
+def test_bad_row_only_fails_its_own_submit(monkeypatch):
+    async def scenario():
+        thread_id, user_ids = await seed_thread(2)
+        writer = MessageWriter(window=0.05)
+        with pytest.raises(ValueError, match="content"):
+            await writer.submit(
+                thread_id=thread_id, sender_id=user_ids[0], content={"x": 1}
+            )
+
+        # a row that gets past validation but not past the database
+        monkeypatch.setattr(MessageWriter, "_validate", staticmethod(lambda f: None))
+        results = await asyncio.gather(
+            writer.submit(thread_id=thread_id, sender_id=user_ids[0], content="a"),
+            writer.submit(thread_id=thread_id, sender_id=user_ids[1], content=[1]),
+            writer.submit(thread_id=thread_id, sender_id=user_ids[1], content="b"),
+            return_exceptions=True,
+        )
+        await writer.close()
+        return results
+
+    good, bad, other = asyncio.run(scenario())
+
+    assert good["content"] == "a" and other["content"] == "b"
+    assert isinstance(bad, Exception)